@@ -1,41 +1,125 @@
 import requests
 import json
+import asyncio
+import aiohttp
 import pandas as pd
 import os
+import time
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from shards import read_shards, write_shards, total_rows
+import schema
+import unit_store
+from features import drop_binary_variables
+from urls import rebase_url
+from http_cache import ResponseCache, default_cache_dir
+from json_stream import decode_json, decode_json_async, STREAM_CHUNK_SIZE
+from instrumentation import RUN, metered, metered_async, default_report_dir
 
 
 # Remove # Below - and change directory location
 #file_link = "[insert file path to]/property_urls.csv"
 #output_file = "[insert file path to]/complete_portfolio.csv"
-
-df = pd.read_csv(file_link, dtype=str, low_memory=False)
-df = df.dropna(how='all')
-
-# Remove duplicate header rows
-df = df[df['state'] != 'state']
+#shard_dir = "[insert file path to]/complete_portfolio_shards"
+#store_path = "[insert file path to]/units.db"
+
+# Output settings
+# "csv" rewrites output_file every run
+# "shards" writes one CSV per block_id under shard_dir (plus manifest.json), touching only scraped properties
+# "store" upserts into the portfolio table of the SQLite store at store_path (unit_store.py), inserting only new units;
+#         unit_store.export_csv(store_path, 'portfolio', output_file) writes complete_portfolio.csv
+OUTPUT_MODE = "csv"
+
+# Crawl settings
+# "async" uses one pooled aiohttp client (keep-alive, shared TLS connections)
+# "threads" is the original ThreadPoolExecutor + requests.get crawl
+CRAWL_MODE = "async"
+MAX_CONNECTIONS_PER_HOST = 20
+REQUEST_TIMEOUT = 10
+THREAD_WORKERS = 10
+
+# Send every sightmap request to this host instead (e.g. "http://127.0.0.1:8760" for replay_server.py)
+# None crawls sightmap.com; the stored web_url is always the original URL
+BASE_URL_OVERRIDE = None
+
+# Keep sightmap responses in http_cache/ next to the output and revalidate them with conditional requests
+# A payload identical to the one merged on the last run is not parsed again
+RESPONSE_CACHE = True
+
+# Decode responses incrementally (ijson), keeping only SIGHTMAP_FIELDS - False reads each body whole
+STREAM_JSON = True
+
+# The parts of a sightmap response parse_sightmap reads
+SIGHTMAP_FIELDS = {
+    'data.asset.name': None,
+    'data.floor_plans.item': ['id', 'bedroom_count', 'bathroom_count'],
+    'data.floors.item': ['id', 'filter_short_label'],
+    'data.units.item': ['id', 'display_unit_number', 'floor_plan_id', 'floor_id', 'area', 'unit_number']
+}
+
+# "columnar" builds each property's table from per-column lists with one timestamp per fetch
+# "records" is the original one-dict-per-unit parse_sightmap
+PARSE_MODE = "columnar"
+
+# Returned by the scrape functions for a payload that is already merged into the output
+UNCHANGED = object()
 
 # States (where AVB has apartment complexes)
 valid_states = {"California", "Colorado", "Florida", "Maryland", "Massachusetts",
                 "New Jersey", "New York", "North Carolina", "Texas", "Virginia",
                 "Washington", "District Of Columbia"}
 
-def scrape_avalon_apartments(sightmap_url, city="", state=""):
-
-
-    # Block-ID
-    block_id = sightmap_url.split('/')[-1]
+def scrape_avalon_apartments(sightmap_url, city="", state="", cache=None):
 
+    fields = SIGHTMAP_FIELDS if STREAM_JSON else None
+    request_url = rebase_url(sightmap_url, BASE_URL_OVERRIDE)
+    start, status, meter = None, 'error', {'bytes': 0}
     try:
-        response = requests.get(sightmap_url, timeout=10)
-        response.raise_for_status()
-        data = response.json()['data']
+        payload = None
+        entry, headers = cache.prepare(sightmap_url, 'sightmap') if cache else (None, {})
+        if headers is not None:
+            start = time.perf_counter()
+            response = requests.get(request_url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+            status = response.status_code
+            if response.status_code == 304:
+                entry = cache.revalidated(sightmap_url, 'sightmap', entry)
+            else:
+                response.raise_for_status()
+                spool = cache.spool() if cache else None
+                payload = decode_json(metered(response.iter_content(STREAM_CHUNK_SIZE), meter), fields, spool)
+                if cache:
+                    entry = cache.store(sightmap_url, 'sightmap', entry, spool, response.headers)
+        if cache and cache.unchanged(entry):
+            return UNCHANGED
+        if payload is None:
+            payload = decode_json(cache.iter_body(entry), fields)
+        data = payload['data']
     except Exception as e:
         print(f"ERROR: {city}, {state} - {str(e)[:50]}")
         return None
-    
+    finally:
+        if start is not None:
+            RUN.request(request_url, time.perf_counter() - start, status, meter['bytes'])
+
+    return parse_timed(data, sightmap_url, city, state)
+
+def parse_timed(data, sightmap_url, city, state):
+    """
+    Parse with the PARSE_MODE parser, recorded as one step of the parse_sightmap stage
+    """
+    with RUN.stage('parse_sightmap') as step:
+        result = (parse_sightmap_columns if PARSE_MODE == "columnar" else parse_sightmap)(data, sightmap_url, city, state)
+        step['rows'] = 0 if result is None else len(result)
+    return result
+
+def parse_sightmap(data, sightmap_url, city="", state=""):
+    """
+    Build the unit DataFrame from the 'data' object of a sightmap API response
+    """
+    # Block-ID
+    block_id = sightmap_url.split('/')[-1]
+
     apt_complex = data['asset']['name']
     
     # Floor plan lookup (for bed/bath counts)
@@ -101,62 +185,152 @@ def scrape_avalon_apartments(sightmap_url, city="", state=""):
 
     return result_df if len(result_df) > 0 else None
 
-def add_binary_variables(df):
+def parse_sightmap_columns(data, sightmap_url, city="", state=""):
+    """
+    parse_sightmap appending straight into one list per column - same DataFrame, without a dict per unit
+    """
+    block_id = sightmap_url.split('/')[-1]
+    apt_complex = data['asset']['name']
+    scraped = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    floor_plan_lookup = {fp['id']: (fp['bedroom_count'], fp['bathroom_count']) for fp in data['floor_plans']}
+    floor_lookup = {floor['id']: floor['filter_short_label'] for floor in data['floors']}
+
+    apt_id, apt_name, bed_count, bath_count, sqft, floor, floor_plan_id, unit_number = [], [], [], [], [], [], [], []
+    for unit in data.get('units', []):
+        display_unit = unit.get('display_unit_number', '')
+        if not display_unit.startswith(('APT', 'HOME')):
+            continue
+
+        plan_id = unit.get('floor_plan_id')
+        bed, bath = floor_plan_lookup.get(plan_id, ('', ''))
+        apt_id.append(unit.get('id', ''))
+        apt_name.append(display_unit)
+        bed_count.append(bed)
+        bath_count.append(bath)
+        sqft.append(unit.get('area', ''))
+        floor.append(floor_lookup.get(unit.get('floor_id'), ''))
+        floor_plan_id.append(plan_id)
+        unit_number.append(unit.get('unit_number', ''))
+
+    if not apt_id:
+        return None
+
+    # Constant columns are filled by pandas from the scalars
+    result_df = pd.DataFrame({
+        'state': state,
+        'city': city,
+        'apt_complex': apt_complex,
+        'block_id': block_id,
+        'apt_id': apt_id,
+        'apt_name': apt_name,
+        'bed_count': bed_count,
+        'bath_count': bath_count,
+        'sqft': sqft,
+        'floor': floor,
+        'floor_plan_id': floor_plan_id,
+        'unit_number': unit_number,
+        'web_url': sightmap_url,
+        'price': '',
+        'adjusted_price': '',
+        'date_scraped': scraped
+    })
+    return result_df.sort_values('apt_name').reset_index(drop=True)
+
+async def scrape_avalon_apartments_async(session, sightmap_url, city="", state="", cache=None):
+    """
+    Async version of scrape_avalon_apartments using a shared aiohttp session
+    """
+    fields = SIGHTMAP_FIELDS if STREAM_JSON else None
+    request_url = rebase_url(sightmap_url, BASE_URL_OVERRIDE)
+    start, status, meter = None, 'error', {'bytes': 0}
+    try:
+        payload = None
+        entry, headers = cache.prepare(sightmap_url, 'sightmap') if cache else (None, {})
+        if headers is not None:
+            start = time.perf_counter()
+            async with session.get(request_url, headers=headers) as response:
+                status = response.status
+                if response.status == 304:
+                    entry = cache.revalidated(sightmap_url, 'sightmap', entry)
+                else:
+                    response.raise_for_status()
+                    spool = cache.spool() if cache else None
+                    payload = await decode_json_async(metered_async(response.content.iter_chunked(STREAM_CHUNK_SIZE), meter),
+                                                      fields, spool)
+                    if cache:
+                        entry = cache.store(sightmap_url, 'sightmap', entry, spool, response.headers)
+        if cache and cache.unchanged(entry):
+            return UNCHANGED
+        if payload is None:
+            payload = decode_json(cache.iter_body(entry), fields)
+        data = payload['data']
+    except Exception as e:
+        print(f"ERROR: {city}, {state} - {str(e)[:50] or type(e).__name__}")
+        return None
+    finally:
+        if start is not None:
+            RUN.request(request_url, time.perf_counter() - start, status, meter['bytes'])
+
+    return parse_timed(data, sightmap_url, city, state)
+
+async def crawl_async(tasks, max_per_host=MAX_CONNECTIONS_PER_HOST, timeout=REQUEST_TIMEOUT, cache=None):
     """
-    Add binary variables for states and cities
+    Scrape all tasks concurrently over one pooled client.
+    The connector caps open connections per host; the timeout applies per request.
+    Returns: (list of unit DataFrames, number of unchanged payloads)
     """
-    # State binary variables
-    states = ['california', 'colorado', 'district_of_columbia', 'florida', 'maryland',
-              'massachusetts', 'new_jersey', 'new_york', 'north_carolina', 'texas',
-              'virginia', 'washington']
-
-    # Create all state binary columns at once using dict comprehension
-    state_columns = {}
-    for state in states:
-        state_display = state.replace('_', ' ').title()
-        if state == 'district_of_columbia':
-            state_display = 'District Of Columbia'
-        state_columns[f'binary_{state}'] = (df['state'].str.lower().str.replace(' ', '_') == state).astype(int)
-
-    # City binary variables
-    cities = ['Acton', 'Addison', 'Agoura_Hills', 'Alexandria', 'Allen', 'Annapolis', 'Arlington',
-              'Artesia', 'Aurora', 'Austin', 'Baltimore', 'Bedford', 'Bellevue', 'Benbrook',
-              'Bloomfield', 'Bloomingdale', 'Boca_Raton', 'Boonton', 'Boston', 'Bothell', 'Brea',
-              'Brighton', 'Brooklyn', 'Burbank', 'Burlington', 'Calabasas', 'Camarillo', 'Cambridge',
-              'Canoga_Park', 'Carrollton', 'Castle_Rock', 'Charlotte', 'Chestnut_Hill', 'Chino_Hills',
-              'Coconut_Creek', 'Columbia', 'Costa_Mesa', 'Dallas', 'Denver', 'Doral', 'Dublin',
-              'Durham', 'Edgewater', 'Emeryville', 'Encino', 'Englewood', 'Fairfax_County',
-              'Falls_Church', 'Florham_Park', 'Flower_Mound', 'Fort_Lauderdale', 'Foster_City',
-              'Framingham', 'Fremont', 'Frisco', 'Garden_City', 'Georgetown', 'Glendale', 'Glendora',
-              'Great_Neck', 'Harrison', 'Herndon', 'Hialeah', 'Hingham', 'Hoboken', 'Hunt_Valley',
-              'Huntington_Beach', 'Huntington_Station', 'Irvine', 'Jersey_City', 'La_Mesa', 'Lafayette',
-              'Lake_Forest', 'Lakewood', 'Laurel', 'Lewisville', 'Lexington', 'Linthicum_Heights',
-              'Littleton', 'Long_Island', 'Long_Island_City', 'Los_Angeles', 'Lynnwood', 'Maplewood',
-              'Margate', 'Marlborough', 'Melville', 'Merrifield', 'Miami', 'Milford', 'Miramar',
-              'Monrovia', 'Montville', 'Mooresville', 'Morrisville', 'Mountain_View', 'Natick',
-              'Newcastle', 'New_York_City', 'North_Andover', 'North_Bergen', 'North_Bethesda',
-              'North_Potomac', 'Northborough', 'Norwood', 'Old_Bridge', 'Owings_Mills', 'Pacifica',
-              'Parker', 'Parsippany', 'Pasadena', 'Peabody', 'Pflugerville', 'Piscataway', 'Pleasanton',
-              'Plymouth', 'Pomona', 'Princeton', 'Quincy', 'Rancho_Santa_Margarita', 'Redmond', 'Reston',
-              'Rockville', 'Rockville_Centre', 'Roseland', 'San_Bruno', 'San_Diego', 'San_Dimas',
-              'San_Francisco', 'San_Jose', 'San_Marcos', 'Santa_Monica', 'Saugus', 'Seal_Beach',
-              'Seattle', 'Silver_Spring', 'Smithtown', 'Somers', 'Somerville', 'Studio_City', 'Sudbury',
-              'Sunnyvale', 'Teaneck', 'Thousand_Oaks', 'Towson', 'Tysons_Corner', 'Union', 'Union_City',
-              'Vista', 'Walnut_Creek', 'Waltham', 'Washington', 'Wayne', 'West_Hollywood',
-              'West_Palm_Beach', 'West_Windsor', 'Westbury', 'Westminster', 'Wharton', 'Wheaton',
-              'White_Plains', 'Wilmington', 'Woburn', 'Woodland_Hills', 'Yonkers']
-
-    # Create all city binary columns at once using dict comprehension
-    city_columns = {}
-    for city in cities:
-        city_normalized = city.replace('_', ' ')
-        city_columns[f'binary_{city}'] = (df['city'].str.replace(' ', '_').str.lower() == city.lower()).astype(int)
-
-    # Concatenate all binary columns at once (much faster than adding one at a time)
-    binary_df = pd.DataFrame({**state_columns, **city_columns}, index=df.index)
-    df = pd.concat([df, binary_df], axis=1)
-
-    return df
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=max_per_host, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def run(task):
+        result = await scrape_avalon_apartments_async(session, task['url'], task['city'], task['state'], cache)
+        return task, result
+
+    all_results = []
+    unchanged = 0
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        for coro in asyncio.as_completed([run(task) for task in tasks]):
+            task, result = await coro
+
+            if result is UNCHANGED:
+                print(f"= {task['city']}, {task['state']} → unchanged")
+                unchanged += 1
+            elif result is not None:
+                print(f"✓ {task['city']}, {task['state']} → {len(result)} units")
+                all_results.append(result)
+            else:
+                print(f"✗ {task['city']}, {task['state']} → failed")
+
+    return all_results, unchanged
+
+def crawl_threads(tasks, max_workers=THREAD_WORKERS, cache=None):
+    """
+    Scrape all tasks with a thread pool (one blocking requests.get per property)
+    Returns: (list of unit DataFrames, number of unchanged payloads)
+    """
+    all_results = []
+    unchanged = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_task = {
+            executor.submit(scrape_avalon_apartments, task['url'], task['city'], task['state'], cache): task
+            for task in tasks
+        }
+
+        for future in as_completed(future_to_task):
+            task = future_to_task[future]
+            result = future.result()
+
+            if result is UNCHANGED:
+                print(f"= {task['city']}, {task['state']} → unchanged")
+                unchanged += 1
+            elif result is not None:
+                print(f"✓ {task['city']}, {task['state']} → {len(result)} units")
+                all_results.append(result)
+            else:
+                print(f"✗ {task['city']}, {task['state']} → failed")
+
+    return all_results, unchanged
 
 def save_to_downloads(df, filename='{apt_complex}.csv'):
     """Save DataFrame to Downloads folder"""
@@ -170,6 +344,12 @@ def save_to_downloads(df, filename='{apt_complex}.csv'):
     return filepath
 
 if __name__ == "__main__":
+    df = schema.read_csv(file_link, 'property_urls', low_memory=False)
+    df = df.dropna(how='all')
+
+    # Remove duplicate header rows
+    df = df[df['state'] != 'state']
+
     # Build list of tasks to scrape
     tasks = []
     skipped = 0
@@ -196,34 +376,61 @@ if __name__ == "__main__":
     print(f"Found {len(tasks)} valid sightmap URLs (skipped {skipped})")
     print(f"Scraping {len(tasks)} locations concurrently...\n")
 
+    output_target = shard_dir if OUTPUT_MODE == "shards" else store_path if OUTPUT_MODE == "store" else output_file
+    cache = ResponseCache(default_cache_dir(output_target)) if RESPONSE_CACHE else None
+
     # Scrape URLs
-    all_results = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_task = {
-            executor.submit(scrape_avalon_apartments, task['url'], task['city'], task['state']): task
-            for task in tasks
-        }
+    start = time.perf_counter()
+    if CRAWL_MODE == "async":
+        all_results, unchanged = asyncio.run(crawl_async(tasks, cache=cache))
+    else:
+        all_results, unchanged = crawl_threads(tasks, cache=cache)
+    elapsed = time.perf_counter() - start
+    RUN.record_stage('crawl', elapsed, rows=len(tasks))
+    print(f"\nCrawled {len(tasks)} locations in {elapsed:.1f}s ({len(tasks) / max(elapsed, 1e-9):.1f}/s, "
+          f"{len(all_results)} parsed, {unchanged} unchanged)")
+    if cache:
+        print(f"   Response cache: {cache.summary()}")
+        for outcome, count in cache.counts.items():
+            RUN.count('response_cache_total', count, outcome=outcome)
 
-        for future in as_completed(future_to_task):
-            task = future_to_task[future]
-            result = future.result()
+    # Combined
+    start = time.perf_counter()
+    if all_results and OUTPUT_MODE == "store":
+        new_data = pd.concat(all_results, ignore_index=True)
 
-            if result is not None:
-                print(f"✓ {task['city']}, {task['state']} → {len(result)} units")
-                all_results.append(result)
-            else:
-                print(f"✗ {task['city']}, {task['state']} → failed")
+        # The unique index on (apt_id, apt_complex, block_id) skips known units - nothing else is read or written
+        conn = unit_store.connect(store_path)
+        inserted, skipped = unit_store.upsert(conn, 'portfolio', new_data)
+        total_units = unit_store.count(conn, 'portfolio')
+        conn.close()
 
-    # Combined
-    if all_results:
+        if inserted > 0:
+            print(f"\n✓ Saved {inserted} new apartments to {store_path}")
+            print(f"   (skipped {skipped} duplicates)")
+            print(f"   Total apartments in store: {total_units}")
+        else:
+            print(f"\n⚠ All {len(new_data)} apartments already exist in {store_path}")
+
+        if cache:
+            cache.mark_applied(new_data['web_url'].unique(), 'sightmap')
+    elif all_results:
         new_data = pd.concat(all_results, ignore_index=True)
 
-        # Read CSV
-        try:
-            existing_df = pd.read_csv(output_file, dtype=str, low_memory=False)
+        # Read existing data (only the shards of the properties just scraped in shard mode)
+        if OUTPUT_MODE == "shards":
+            existing_df = read_shards(shard_dir, block_ids=new_data['block_id'].unique(), table='complete_portfolio',
+                                      low_memory=False)
             existing_df = existing_df.dropna(how='all')
-        except FileNotFoundError:
-            existing_df = pd.DataFrame()
+        else:
+            try:
+                existing_df = schema.read_csv(output_file, 'complete_portfolio', low_memory=False)
+                existing_df = existing_df.dropna(how='all')
+            except FileNotFoundError:
+                existing_df = pd.DataFrame()
+
+        # Location is stored as the raw state/city columns only - drop indicator columns from older files
+        existing_df = drop_binary_variables(existing_df)
 
         # Filter out duplicates based on apt_id, apt_complex, and block_id
         if len(existing_df) > 0 and all(col in existing_df.columns for col in ['apt_id', 'apt_complex', 'block_id']):
@@ -235,20 +442,34 @@ if __name__ == "__main__":
             new_apartments = new_data
 
         if len(new_apartments) > 0:
-            # Add binary variables to ONLY new apartments
-            print(f"\nAdding binary variables to {len(new_apartments)} new apartments...")
-            new_apartments = add_binary_variables(new_apartments)
-
             # Append new apartments to existing data
             updated_df = pd.concat([existing_df, new_apartments], ignore_index=True)
             updated_df = updated_df.dropna(how='all')
 
-            # Save to CSV
-            updated_df.to_csv(output_file, index=False)
-            print(f"\n✓ Saved {len(new_apartments)} new apartments to {output_file}")
-            print(f"   (skipped {len(new_data) - len(new_apartments)} duplicates)")
-            print(f"   Total apartments in file: {len(updated_df)}")
+            if OUTPUT_MODE == "shards":
+                # Rewrite only the shards that gained apartments
+                changed = updated_df[updated_df['block_id'].isin(new_apartments['block_id'])]
+                written = write_shards(changed, shard_dir, table='complete_portfolio')
+                print(f"\n✓ Saved {len(new_apartments)} new apartments to {len(written)} shards in {shard_dir}")
+                print(f"   (skipped {len(new_data) - len(new_apartments)} duplicates)")
+                print(f"   Total apartments in shards: {total_rows(shard_dir)}")
+            else:
+                # Save to CSV
+                schema.to_csv(updated_df, 'complete_portfolio', output_file)
+                print(f"\n✓ Saved {len(new_apartments)} new apartments to {output_file}")
+                print(f"   (skipped {len(new_data) - len(new_apartments)} duplicates)")
+                print(f"   Total apartments in file: {len(updated_df)}")
         else:
-            print(f"\n⚠ All {len(new_data)} apartments already exist in {output_file}")
+            print(f"\n⚠ All {len(new_data)} apartments already exist in {output_target}")
+
+        # Only now are these payloads merged - a crash before this point leaves them to be parsed again
+        if cache:
+            cache.mark_applied(new_data['web_url'].unique(), 'sightmap')
+    elif unchanged:
+        print(f"\n✓ All {unchanged} scraped payloads are unchanged since the last run")
     else:
         print("\n✗ No data scraped")
+    RUN.record_stage('upsert', time.perf_counter() - start, rows=sum(len(result) for result in all_results))
+
+    report_path = RUN.save(default_report_dir(output_target), 'scrape_portfolio')
+    print(f"   Run report: {report_path}")
@@ -1,13 +1,74 @@
 import pandas as pd
+import numpy as np
 import requests
+import json
+import re
 import time
+from itertools import chain, compress
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from shards import read_shards, write_shards, total_rows
+import price_log
+import schema
+import unit_store
+from features import drop_binary_variables
+from urls import rebase_url
+from http_cache import ResponseCache, default_cache_dir
+from json_stream import decode_json, STREAM_CHUNK_SIZE
+from instrumentation import RUN, metered, default_report_dir
 
 #Remove #Below - and change directory locations
 #file_path = "[insert directory path]/property_urls.csv"
 #output_file = "[insert directory path]/currently_available.csv"
+#shard_dir = "[insert directory path]/currently_available_shards"
+#log_dir = "[insert directory path]/currently_available_log"
+#store_path = "[insert directory path]/units.db"
 
-def create_session():
+#"csv" rewrites output_file every run
+#"shards" writes one CSV per block_id under shard_dir (plus manifest.json), touching only scraped properties
+#"log" appends the scrape's (unit, time, price) observations to the price log in log_dir - nothing is rewritten;
+#      price_log.export_csv(log_dir, output_file) writes currently_available.csv for step 3
+#"store" upserts into the available table of the SQLite store at store_path (unit_store.py) - only scraped rows are written;
+#        unit_store.export_csv(store_path, 'available', output_file) writes currently_available.csv
+OUTPUT_MODE = "csv"
+
+#Log mode: fold the segments into a new snapshot once this many scrapes are pending
+LOG_COMPACT_SEGMENTS = 7
+
+#Composite key identifying a unit across scrapes
+KEY_COLUMNS = ['apt_complex', 'apt_name', 'apt_id']
+
+#Number of community-units requests kept in flight at once (1 = one property at a time)
+FETCH_WORKERS = 8
+
+#Send every community-units request to this host instead (e.g. "http://127.0.0.1:8760" for replay_server.py)
+#None fetches from avaloncommunities.com
+BASE_URL_OVERRIDE = None
+
+#Keep community-units responses in http_cache/ next to the output and revalidate them with conditional requests
+#Unchanged payloads are still parsed: every listed unit needs its last_seen refreshed
+RESPONSE_CACHE = True
+
+#Decode responses incrementally (ijson), keeping only UNIT_FIELDS of each unit - False reads each body whole
+STREAM_JSON = True
+
+#"columnar" parses each response into one list per column (one timestamp per fetch) and builds a single DataFrame at the end
+#"records" is the original one-dict-per-unit parse_units + a DataFrame per property
+PARSE_MODE = "columnar"
+
+#Output columns of a parsed unit, in file order
+UNIT_COLUMNS = ['state', 'city', 'apt_complex', 'block_id', 'apt_id', 'apt_name', 'bed_count', 'bath_count', 'sqft',
+                'floor', 'floor_plan_id', 'unit_number', 'web_url', 'price', 'adjusted_price', 'first_seen', 'last_seen']
+
+#The unit fields parse_units reads
+UNIT_FIELDS = {
+    'units.item': ['unitId', 'unitName', 'floorNumber', 'bedroomNumber', 'bathroomNumber', 'squareFeet',
+                   'floorPlanId', 'url', 'address', 'startingAtPricesUnfurnished']
+}
+
+def create_session(pool_size=FETCH_WORKERS):
     """
     Create a requests session with proper retry logic and headers
     """
@@ -21,7 +82,8 @@ def create_session():
         allowed_methods=["HEAD", "GET", "OPTIONS"]
     )
 
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    #Pool sized so every fetch worker can hold its own keep-alive connection
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=pool_size, pool_maxsize=pool_size)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
 
@@ -38,23 +100,40 @@ def create_session():
 
     return session
 
-def fetch_units_from_api(session, api_url, max_retries=3):
-    
+def fetch_units_from_api(session, api_url, max_retries=3, cache=None):
+
+    fields = UNIT_FIELDS if STREAM_JSON else None
+    entry, headers = cache.prepare(api_url, 'community_units') if cache else (None, {})
+    if headers is None:
+        return decode_json(cache.iter_body(entry), fields)
+
+    request_url = rebase_url(api_url, BASE_URL_OVERRIDE)
     for attempt in range(max_retries):
+        #Every attempt is recorded: latency, status, body bytes, and retries (this loop's plus the adapter's)
+        start, status, meter, adapter_retries = time.perf_counter(), 'error', {'bytes': 0}, 0
         try:
             #Use stream=True to handle chunked encoding properly
-            response = session.get(api_url, timeout=30, stream=True)
-
-            if response.status_code == 200:
-                #Read the full response content
-                content = response.content
+            response = session.get(request_url, headers=headers, timeout=30, stream=True)
+            status = response.status_code
+            if getattr(response.raw, 'retries', None) is not None:
+                adapter_retries = len(response.raw.retries.history)
 
-                #Parse JSON
+            if response.status_code in (200, 304):
+                #Decode the body as it streams in (the cached body on a 304)
                 try:
-                    json_data = json.loads(content)
+                    if response.status_code == 304:
+                        entry = cache.revalidated(api_url, 'community_units', entry)
+                        return decode_json(cache.iter_body(entry), fields)
+
+                    spool = cache.spool() if cache else None
+                    json_data = decode_json(metered(response.iter_content(STREAM_CHUNK_SIZE), meter), fields, spool)
+                    if cache:
+                        entry = cache.store(api_url, 'community_units', entry, spool, response.headers)
                     return json_data
                 except json.JSONDecodeError as e:
                     print(f"    ❌ JSON decode error: {e}")
+                    #Ask for the full body again rather than a 304 for a bad cached copy
+                    headers = {}
                     if attempt < max_retries - 1:
                         print(f"    🔄 Retrying... (attempt {attempt + 2}/{max_retries})")
                         time.sleep(2)
@@ -92,6 +171,9 @@ def fetch_units_from_api(session, api_url, max_retries=3):
                 continue
             return None
 
+        finally:
+            RUN.request(request_url, time.perf_counter() - start, status, meter['bytes'], min(attempt, 1) + adapter_retries)
+
     return None
 
 def parse_units(json_data, state, city, property_name, block_id):
@@ -146,14 +228,14 @@ def parse_units(json_data, state, city, property_name, block_id):
                 'block_id': block_id,
                 'apt_id': unit_id,
                 'apt_name': unit_number,
-                'bed_count': int(bed_count) if bed_count is not None else '',
-                'bath_count': int(bath_count) if bath_count is not None else '',
-                'sqft': int(sqft) if sqft is not None else '',
+                'bed_count': bed_count if bed_count is not None else '',
+                'bath_count': bath_count if bath_count is not None else '',
+                'sqft': sqft if sqft is not None else '',
                 'floor': str(floor_number) if floor_number else '',
                 'floor_plan_id': unit.get('floorPlanId', ''),
                 'unit_number': unit_number,
                 'web_url': web_url,
-                'price': int(price) if price is not None else '',
+                'price': price if price is not None else '',
                 'adjusted_price': '',
                 'first_seen': current_timestamp,
                 'last_seen': current_timestamp
@@ -167,62 +249,248 @@ def parse_units(json_data, state, city, property_name, block_id):
 
     return units_list
 
-def add_binary_variables(df):
+def parse_units_columns(json_data, state, city, property_name, block_id):
     """
-    Add binary variables for states and cities
+    Columnar parse_units: same values, appended straight into one list per column
+    Every unit of the response shares one first_seen/last_seen timestamp
+    Returns: dict of UNIT_COLUMNS -> list (empty lists if nothing parsed)
     """
-    #State binary variables
-    states = ['california', 'colorado', 'district_of_columbia', 'florida', 'maryland',
-              'massachusetts', 'new_jersey', 'new_york', 'north_carolina', 'texas',
-              'virginia', 'washington']
-
-    #Create all state binary columns at once using dict comprehension
-    state_columns = {}
-    for state in states:
-        state_display = state.replace('_', ' ').title()
-        if state == 'district_of_columbia':
-            state_display = 'District Of Columbia'
-        state_columns[f'binary_{state}'] = (df['state'].str.lower().str.replace(' ', '_') == state).astype(int)
-
-    #City binary variables - very important
-    cities = ['Acton', 'Addison', 'Agoura_Hills', 'Alexandria', 'Allen', 'Annapolis', 'Arlington',
-              'Artesia', 'Aurora', 'Austin', 'Baltimore', 'Bedford', 'Bellevue', 'Benbrook',
-              'Bloomfield', 'Bloomingdale', 'Boca_Raton', 'Boonton', 'Boston', 'Bothell', 'Brea',
-              'Brighton', 'Brooklyn', 'Burbank', 'Burlington', 'Calabasas', 'Camarillo', 'Cambridge',
-              'Canoga_Park', 'Carrollton', 'Castle_Rock', 'Charlotte', 'Chestnut_Hill', 'Chino_Hills',
-              'Coconut_Creek', 'Columbia', 'Costa_Mesa', 'Dallas', 'Denver', 'Doral', 'Dublin',
-              'Durham', 'Edgewater', 'Emeryville', 'Encino', 'Englewood', 'Fairfax_County',
-              'Falls_Church', 'Florham_Park', 'Flower_Mound', 'Fort_Lauderdale', 'Foster_City',
-              'Framingham', 'Fremont', 'Frisco', 'Garden_City', 'Georgetown', 'Glendale', 'Glendora',
-              'Great_Neck', 'Harrison', 'Herndon', 'Hialeah', 'Hingham', 'Hoboken', 'Hunt_Valley',
-              'Huntington_Beach', 'Huntington_Station', 'Irvine', 'Jersey_City', 'La_Mesa', 'Lafayette',
-              'Lake_Forest', 'Lakewood', 'Laurel', 'Lewisville', 'Lexington', 'Linthicum_Heights',
-              'Littleton', 'Long_Island', 'Long_Island_City', 'Los_Angeles', 'Lynnwood', 'Maplewood',
-              'Margate', 'Marlborough', 'Melville', 'Merrifield', 'Miami', 'Milford', 'Miramar',
-              'Monrovia', 'Montville', 'Mooresville', 'Morrisville', 'Mountain_View', 'Natick',
-              'Newcastle', 'New_York_City', 'North_Andover', 'North_Bergen', 'North_Bethesda',
-              'North_Potomac', 'Northborough', 'Norwood', 'Old_Bridge', 'Owings_Mills', 'Pacifica',
-              'Parker', 'Parsippany', 'Pasadena', 'Peabody', 'Pflugerville', 'Piscataway', 'Pleasanton',
-              'Plymouth', 'Pomona', 'Princeton', 'Quincy', 'Rancho_Santa_Margarita', 'Redmond', 'Reston',
-              'Rockville', 'Rockville_Centre', 'Roseland', 'San_Bruno', 'San_Diego', 'San_Dimas',
-              'San_Francisco', 'San_Jose', 'San_Marcos', 'Santa_Monica', 'Saugus', 'Seal_Beach',
-              'Seattle', 'Silver_Spring', 'Smithtown', 'Somers', 'Somerville', 'Studio_City', 'Sudbury',
-              'Sunnyvale', 'Teaneck', 'Thousand_Oaks', 'Towson', 'Tysons_Corner', 'Union', 'Union_City',
-              'Vista', 'Walnut_Creek', 'Waltham', 'Washington', 'Wayne', 'West_Hollywood',
-              'West_Palm_Beach', 'West_Windsor', 'Westbury', 'Westminster', 'Wharton', 'Wheaton',
-              'White_Plains', 'Wilmington', 'Woburn', 'Woodland_Hills', 'Yonkers']
-
-    #Create all city binary columns at once using dict comprehension
-    city_columns = {}
-    for city in cities:
-        city_normalized = city.replace('_', ' ')
-        city_columns[f'binary_{city}'] = (df['city'].str.replace(' ', '_').str.lower() == city.lower()).astype(int)
-
-    #Concatenate all binary columns at once (much faster than adding one at a time)
-    binary_df = pd.DataFrame({**state_columns, **city_columns}, index=df.index)
-    df = pd.concat([df, binary_df], axis=1)
-
-    return df
+    apt_id, apt_name, bed_count, bath_count, sqft, floor, floor_plan_id, web_url, price = [], [], [], [], [], [], [], [], []
+
+    if not json_data or 'units' not in json_data:
+        print(f"    ⚠️  Unexpected JSON structure - no 'units' key")
+        units = []
+    elif not json_data['units']:
+        print(f"    ⚠️  No units in response")
+        units = []
+    else:
+        units = json_data['units']
+
+    for unit in units:
+        try:
+            #Every value is read before anything is appended, so a bad unit leaves the columns aligned
+            #(values are typed by schema.coerce once the scrape is combined)
+            unit_bed = unit.get('bedroomNumber')
+            unit_bath = unit.get('bathroomNumber')
+            unit_sqft = unit.get('squareFeet')
+            floor_number = unit.get('floorNumber', '')
+
+            unit_price = None
+            pricing_data = unit.get('startingAtPricesUnfurnished')
+            if pricing_data and isinstance(pricing_data, dict):
+                prices = pricing_data.get('prices', {})
+                if isinstance(prices, dict):
+                    unit_price = prices.get('price') or prices.get('totalPrice')
+
+            unit_url = unit.get('url', '')
+            if not unit_url and unit.get('address', {}).get('addressLine1'):
+                unit_url = ''
+
+            row = (unit.get('unitId', ''),
+                   unit.get('unitName', ''),
+                   unit_bed if unit_bed is not None else '',
+                   unit_bath if unit_bath is not None else '',
+                   unit_sqft if unit_sqft is not None else '',
+                   str(floor_number) if floor_number else '',
+                   unit.get('floorPlanId', ''),
+                   unit_url,
+                   unit_price if unit_price is not None else '')
+        except Exception as e:
+            print(f"    ⚠️  Error parsing unit: {e}")
+            continue
+
+        apt_id.append(row[0])
+        apt_name.append(row[1])
+        bed_count.append(row[2])
+        bath_count.append(row[3])
+        sqft.append(row[4])
+        floor.append(row[5])
+        floor_plan_id.append(row[6])
+        web_url.append(row[7])
+        price.append(row[8])
+
+    n = len(apt_id)
+    current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'state': [state] * n,
+        'city': [city] * n,
+        'apt_complex': [property_name] * n,
+        'block_id': [block_id] * n,
+        'apt_id': apt_id,
+        'apt_name': apt_name,
+        'bed_count': bed_count,
+        'bath_count': bath_count,
+        'sqft': sqft,
+        'floor': floor,
+        'floor_plan_id': floor_plan_id,
+        'unit_number': list(apt_name),
+        'web_url': web_url,
+        'price': price,
+        'adjusted_price': [''] * n,
+        'first_seen': [current_timestamp] * n,
+        'last_seen': [current_timestamp] * n
+    }
+
+def columns_frame(tables):
+    """
+    One DataFrame from a list of parse_units_columns tables - the lists are joined, not the frames
+    """
+    return pd.DataFrame({name: list(chain.from_iterable(table[name] for table in tables)) for name in UNIT_COLUMNS})
+
+def unit_keys(df):
+    """
+    Composite key string (apt_complex|apt_name|apt_id) for every row
+    """
+    return df['apt_complex'].astype(str) + '|' + df['apt_name'].astype(str) + '|' + df['apt_id'].astype(str)
+
+def upsert_apartments(existing_df, new_data):
+    """
+    Keyed upsert of a scrape into the existing file on (apt_complex, apt_name, apt_id)
+    Matched rows get the scraped price and last_seen in one vectorized pass; first_seen is never touched
+    Returns: (existing_df, new_apartments, updated_count, changed) where changed flags the updated existing rows
+    """
+    existing_keys = pd.Index(unit_keys(existing_df))
+    new_keys = pd.Index(unit_keys(new_data))
+
+    #Separate new apartments from updates
+    is_update = new_keys.isin(existing_keys)
+    new_apartments = new_data[~is_update].copy()
+
+    #One row of scraped values per key - the last one wins, as with a row-by-row update
+    latest = new_data.loc[is_update, ['price', 'last_seen']].set_index(new_keys[is_update])
+    latest = latest[~latest.index.duplicated(keep='last')]
+
+    #Position of each existing row's key in the scraped values (-1 if not scraped this run)
+    positions = latest.index.get_indexer(existing_keys)
+    changed = positions >= 0
+    existing_df.loc[changed, 'price'] = latest['price'].to_numpy()[positions[changed]]
+    existing_df.loc[changed, 'last_seen'] = latest['last_seen'].to_numpy()[positions[changed]]
+
+    return existing_df, new_apartments, int(is_update.sum()), changed
+
+def update_days_on_market(df, rows):
+    """
+    Recompute days_on_market (last_seen - first_seen) in place for the flagged rows,
+    plus any row that does not have a value yet
+    """
+    if 'days_on_market' in df.columns:
+        rows = rows | df['days_on_market'].isna().to_numpy()
+    else:
+        rows = np.ones(len(df), dtype=bool)
+
+    first_seen = pd.to_datetime(df.loc[rows, 'first_seen'], errors='coerce')
+    last_seen = pd.to_datetime(df.loc[rows, 'last_seen'], errors='coerce')
+    df.loc[rows, 'days_on_market'] = (last_seen - first_seen).dt.days.astype('Int64')
+
+def build_task(row):
+    """
+    Build the fetch task for one property row of property_urls.csv
+    """
+    api_url = row['communityID']  #communityID contains the Avalon API URL
+
+    #Extract block_id (AVB-XXXXX) from the URL query parameter
+    block_id = ''
+    if isinstance(api_url, str) and 'communityId' in api_url:
+        #URL decode and extract AVB-XXXXX from communityId parameter
+        match = re.search(r'communityId%22%3A%22([^%"&]+)', api_url)
+        if match:
+            block_id = match.group(1)
+
+    if not block_id:
+        block_id = row.get('block_id', '')
+
+    return {
+        'state': row['state'],
+        'city': row['city'],
+        'property_name': row['Unnamed: 4'],  #Name in AvalonMaster.csv
+        'api_url': api_url,
+        'block_id': block_id
+    }
+
+def process_property(json_data, task):
+    """
+    Parse one property's API response
+    Returns: units with a price - a DataFrame, or a column table in columnar mode - or None if the property failed
+    """
+    if not json_data:
+        print(f"    ✗ No data returned\n")
+        return None
+
+    if PARSE_MODE == "columnar":
+        table = parse_units_columns(json_data, task['state'], task['city'], task['property_name'], task['block_id'])
+        total = len(table['apt_id'])
+        if total == 0:
+            print(f"    ✗ No units found\n")
+            return None
+
+        #Filter out units without price data (only keep currently available units with prices)
+        has_price = [price != '' for price in table['price']]
+        priced = sum(has_price)
+        if priced == 0:
+            print(f"    ✗ Found {total} units but none have price data (not currently available)\n")
+            return None
+        if priced < total:
+            table = {name: list(compress(column, has_price)) for name, column in table.items()}
+
+        print(f"    ✓ Found {priced} units with price data (out of {total} total)\n")
+        return table
+
+    #Parse units
+    units = parse_units(json_data, task['state'], task['city'], task['property_name'], task['block_id'])
+
+    if len(units) == 0:
+        print(f"    ✗ No units found\n")
+        return None
+
+    #Filter out units without price data (only keep currently available units with prices)
+    units_with_price = [u for u in units if u.get('price') != '']
+
+    if len(units_with_price) == 0:
+        print(f"    ✗ Found {len(units)} units but none have price data (not currently available)\n")
+        return None
+
+    print(f"    ✓ Found {len(units_with_price)} units with price data (out of {len(units)} total)\n")
+
+    return pd.DataFrame(units_with_price)
+
+def load_existing(block_ids=None):
+    """
+    Read existing output - the whole CSV, or in shard mode only the shards of block_ids
+    """
+    if OUTPUT_MODE == "shards":
+        existing_df = read_shards(shard_dir, block_ids=block_ids, table='currently_available', low_memory=False)
+    else:
+        try:
+            existing_df = schema.read_csv(output_file, 'currently_available', low_memory=False)
+        except FileNotFoundError:
+            print("No existing file found, will create new one\n")
+            return pd.DataFrame()
+
+    existing_df = existing_df.dropna(how='all')
+
+    #Location is stored as the raw state/city columns only - drop indicator columns from older files
+    existing_df = drop_binary_variables(existing_df)
+
+    #Migration: if old format with 'date_scraped', rename to 'first_seen' and add 'last_seen'
+    if 'date_scraped' in existing_df.columns and 'first_seen' not in existing_df.columns:
+        print("Migrating old format: date_scraped -> first_seen/last_seen")
+        existing_df = existing_df.rename(columns={'date_scraped': 'first_seen'})
+        existing_df['last_seen'] = existing_df['first_seen']
+
+    print(f"Found existing data with {len(existing_df)} units\n")
+    return existing_df
+
+def output_target():
+    """
+    Where this run's output goes for the current OUTPUT_MODE: shard_dir, log_dir, store_path or output_file
+    """
+    if OUTPUT_MODE == "shards":
+        return shard_dir
+    if OUTPUT_MODE == "log":
+        return log_dir
+    if OUTPUT_MODE == "store":
+        return store_path
+    return output_file
 
 def main():
     #Create persistent session
@@ -230,7 +498,7 @@ def main():
 
     #Load CSV
     print("Loading CSV...")
-    df = pd.read_csv(file_path)
+    df = schema.read_csv(file_path, 'property_urls')
 
     #Use the 'communityID' column for Avalon Communities API URLs
     #Drop duplicates based on communityID to ensure one row per property
@@ -241,138 +509,120 @@ def main():
 
     print(f"Loaded {len(df)} properties\n")
 
-    #Read existing CSV if it exists
-    try:
-        existing_df = pd.read_csv(output_file, dtype=str, low_memory=False)
-        existing_df = existing_df.dropna(how='all')
-
-        #Migration: if old format with 'date_scraped', rename to 'first_seen' and add 'last_seen'
-        if 'date_scraped' in existing_df.columns and 'first_seen' not in existing_df.columns:
-            print("Migrating old format: date_scraped -> first_seen/last_seen")
-            existing_df = existing_df.rename(columns={'date_scraped': 'first_seen'})
-            existing_df['last_seen'] = existing_df['first_seen']
-
-        print(f"Found existing file with {len(existing_df)} units\n")
-    except FileNotFoundError:
-        existing_df = pd.DataFrame()
-        print("No existing file found, will create new one\n")
+    tasks = [build_task(row) for _, row in df.iterrows()]
+    cache = ResponseCache(default_cache_dir(output_target())) if RESPONSE_CACHE else None
 
     all_results = []
     success_count = 0
     fail_count = 0
 
-    #Process properties
-    for idx, row in df.iterrows():
-        state = row['state']
-        city = row['city']
-        property_name = row['Unnamed: 4']  #Name in AvalonMaster.csv
-        api_url = row['communityID']  #communityID contains the Avalon API URL
-
-        #Extract block_id (AVB-XXXXX) from the URL query parameter
-        block_id = ''
-        if isinstance(api_url, str) and 'communityId' in api_url:
-            import re
-            #URL decode and extract AVB-XXXXX from communityId parameter
-            match = re.search(r'communityId%22%3A%22([^%"&]+)', api_url)
-            if match:
-                block_id = match.group(1)
-
-        if not block_id:
-            block_id = row.get('block_id', '')
-
-        print(f"[{idx+1}/{len(df)}] {property_name} ({city}, {state})")
-
-        #Fetch from API
-        print(f"    → Fetching units from API...")
-        json_data = fetch_units_from_api(session, api_url)
-
-        if not json_data:
-            print(f"    ✗ No data returned\n")
-            fail_count += 1
-            continue
-
-        #Parse units
-        units = parse_units(json_data, state, city, property_name, block_id)
-
-        if len(units) == 0:
-            print(f"    ✗ No units found\n")
-            fail_count += 1
-            continue
-
-        #Filter out units without price data (only keep currently available units with prices)
-        units_with_price = [u for u in units if u.get('price') != '']
-
-        if len(units_with_price) == 0:
-            print(f"    ✗ Found {len(units)} units but none have price data (not currently available)\n")
-            fail_count += 1
-            continue
-
-        print(f"    ✓ Found {len(units_with_price)} units with price data (out of {len(units)} total)")
-
-        #
-        df_units = pd.DataFrame(units_with_price)
-        all_results.append(df_units)
-        success_count += 1
-
-        print()
+    #Fetch with FETCH_WORKERS requests in flight; responses are parsed here as they
+    #arrive, so parsing overlaps with the fetches still running in the pool
+    print(f"Fetching {len(tasks)} properties with {FETCH_WORKERS} concurrent requests...\n")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        future_to_task = {
+            executor.submit(fetch_units_from_api, session, task['api_url'], cache=cache): task
+            for task in tasks
+        }
+
+        for done, future in enumerate(as_completed(future_to_task), start=1):
+            task = future_to_task[future]
+            print(f"[{done}/{len(df)}] {task['property_name']} ({task['city']}, {task['state']})")
+
+            with RUN.stage('parse_units') as step:
+                df_units = process_property(future.result(), task)
+                step['rows'] = 0 if df_units is None else len(df_units['apt_id'])
+            if df_units is None:
+                fail_count += 1
+                continue
 
-        #Be polite to server
-        time.sleep(0.5)
+            all_results.append(df_units)
+            success_count += 1
 
     #Close session
     session.close()
+    elapsed = time.perf_counter() - start
+    RUN.record_stage('fetch', elapsed, rows=len(tasks))
+    print(f"Fetched {len(tasks)} properties in {elapsed:.1f}s ({len(tasks) / max(elapsed, 1e-9):.1f}/s)")
+    if cache:
+        print(f"Response cache: {cache.summary()}")
+        for outcome, count in cache.counts.items():
+            RUN.count('response_cache_total', count, outcome=outcome)
+    print()
+    start = time.perf_counter()
 
     #Combine all results
+    #The scraped values get their column types (schema.py) once, here, whatever the output mode
     if all_results:
-        new_data = pd.concat(all_results, ignore_index=True)
+        new_data = columns_frame(all_results) if PARSE_MODE == "columnar" else pd.concat(all_results, ignore_index=True)
+        new_data = schema.coerce(new_data, 'currently_available')
+
+    if all_results and OUTPUT_MODE == "log":
+        #Append-only: the scrape becomes one segment; existing data is only read for its keys
+        new_count, updated_count = price_log.append_scrape(log_dir, new_data)
+        pending = len(price_log.pending_segments(log_dir))
+        if pending >= LOG_COMPACT_SEGMENTS:
+            print(f"Compacting {pending} log segments...")
+            price_log.compact(log_dir)
+        total_units = price_log.total_units(log_dir)
 
-        #Update existing apartments or add new ones
-        if len(existing_df) > 0 and all(col in existing_df.columns for col in ['apt_id', 'apt_complex', 'apt_name']):
-            #Create composite key for matching (apt_complex, apt_name, apt_id)
-            existing_df['_temp_key'] = existing_df['apt_complex'].astype(str) + '|' + existing_df['apt_name'].astype(str) + '|' + existing_df['apt_id'].astype(str)
-            new_data['_temp_key'] = new_data['apt_complex'].astype(str) + '|' + new_data['apt_name'].astype(str) + '|' + new_data['apt_id'].astype(str)
+        print(f"\n{'='*60}")
+        print(f"✓ SUCCESS SUMMARY")
+        print(f"{'='*60}")
+        print(f"   Properties scraped successfully: {success_count}/{len(df)}")
+        print(f"   Properties failed: {fail_count}/{len(df)}")
+        print(f"   New apartments added: {new_count}")
+        print(f"   Existing apartments updated: {updated_count}")
+        print(f"   Total apartments in log: {total_units}")
+        print(f"\n✓ Output: {log_dir}")
+    elif all_results and OUTPUT_MODE == "store":
+        #Batched upsert on the (apt_complex, apt_name, apt_id) unique index - known units take the scraped
+        #price and last_seen (days_on_market is recomputed in SQL), new units are inserted
+        update_days_on_market(new_data, np.ones(len(new_data), dtype=bool))
+        conn = unit_store.connect(store_path)
+        new_count, updated_count = unit_store.upsert(conn, 'available', new_data)
+        total_units = unit_store.count(conn, 'available')
+        conn.close()
 
-            #Separate new apartments from updates
-            new_apartments = new_data[~new_data['_temp_key'].isin(existing_df['_temp_key'])].copy()
-            apartments_to_update = new_data[new_data['_temp_key'].isin(existing_df['_temp_key'])].copy()
+        print(f"\n{'='*60}")
+        print(f"✓ SUCCESS SUMMARY")
+        print(f"{'='*60}")
+        print(f"   Properties scraped successfully: {success_count}/{len(df)}")
+        print(f"   Properties failed: {fail_count}/{len(df)}")
+        print(f"   New apartments added: {new_count}")
+        print(f"   Existing apartments updated: {updated_count}")
+        print(f"   Total apartments in store: {total_units}")
+        print(f"\n✓ Output: {store_path}")
+    elif all_results:
+        #Shard mode only reads the shards of the properties scraped this run
+        existing_df = load_existing(new_data['block_id'].unique() if OUTPUT_MODE == "shards" else None)
 
-            #Update existing apartments' price and last_seen (keep first_seen unchanged)
-            updated_count = 0
-            if len(apartments_to_update) > 0:
-                for _, apt in apartments_to_update.iterrows():
-                    mask = existing_df['_temp_key'] == apt['_temp_key']
-                    existing_df.loc[mask, 'price'] = apt['price']
-                    existing_df.loc[mask, 'last_seen'] = apt['last_seen']
-                    #first_seen stays unchanged - it's the original date the unit was first scraped
-                    updated_count += 1
-
-            #Remove temporary key column
-            existing_df = existing_df.drop(columns=['_temp_key'])
-            new_apartments = new_apartments.drop(columns=['_temp_key']) if len(new_apartments) > 0 else new_apartments
+        #Update existing apartments or add new ones
+        if len(existing_df) > 0 and all(col in existing_df.columns for col in KEY_COLUMNS):
+            existing_df, new_apartments, updated_count, changed = upsert_apartments(existing_df, new_data)
         else:
             new_apartments = new_data
             updated_count = 0
+            changed = np.zeros(len(existing_df), dtype=bool)
 
-        if len(new_apartments) > 0:
-            #Add binary variables to ONLY the new apartments
-            print("Adding binary variables to new apartments...")
-            new_apartments = add_binary_variables(new_apartments)
+        #Append new apartments to existing data
+        updated_df = pd.concat([existing_df, new_apartments], ignore_index=True)
+        changed_rows = pd.Series(np.concatenate([changed, np.ones(len(new_apartments), dtype=bool)]))
+        updated_df = updated_df.dropna(how='all')
+        changed_rows = changed_rows[updated_df.index].to_numpy()
 
-            #Append new apartments to existing data
-            updated_df = pd.concat([existing_df, new_apartments], ignore_index=True)
-            updated_df = updated_df.dropna(how='all')
-        else:
-            updated_df = existing_df.dropna(how='all')
-
-        #Calculate days_on_market before saving
+        #Calculate days_on_market before saving (only rows touched by this run)
         if 'first_seen' in updated_df.columns and 'last_seen' in updated_df.columns:
-            updated_df['first_seen_dt'] = pd.to_datetime(updated_df['first_seen'], errors='coerce')
-            updated_df['last_seen_dt'] = pd.to_datetime(updated_df['last_seen'], errors='coerce')
-            updated_df['days_on_market'] = (updated_df['last_seen_dt'] - updated_df['first_seen_dt']).dt.days
-            #Drop temporary datetime columns
-            updated_df = updated_df.drop(columns=['first_seen_dt', 'last_seen_dt'])
+            update_days_on_market(updated_df, changed_rows)
+
+        if OUTPUT_MODE == "shards":
+            write_shards(updated_df, shard_dir, table='currently_available')
+            total_units = total_rows(shard_dir)
+        else:
+            schema.to_csv(updated_df, 'currently_available', output_file)
+            total_units = len(updated_df)
 
-        updated_df.to_csv(output_file, index=False)
         print(f"\n{'='*60}")
         print(f"✓ SUCCESS SUMMARY")
         print(f"{'='*60}")
@@ -380,12 +630,16 @@ def main():
         print(f"   Properties failed: {fail_count}/{len(df)}")
         print(f"   New apartments added: {len(new_apartments)}")
         print(f"   Existing apartments updated: {updated_count}")
-        print(f"   Total apartments in file: {len(updated_df)}")
-        print(f"\n✓ Output file: {output_file}")
+        print(f"   Total apartments in file: {total_units}")
+        print(f"\n✓ Output: {output_target()}")
     else:
         print("\n✗ No data scraped")
         print(f"   Properties failed: {fail_count}/{len(df)}")
+    RUN.record_stage('upsert', time.perf_counter() - start, rows=len(new_data) if all_results else 0)
+    RUN.count('properties_total', success_count, outcome='scraped')
+    RUN.count('properties_total', fail_count, outcome='failed')
 
+    print(f"   Run report: {RUN.save(default_report_dir(output_target()), 'scrape_available')}")
     print(f"{'='*60}")
 
 if __name__ == "__main__":
@@ -1,8 +1,19 @@
 import pandas as pd
+import numpy as np
+import schema
+import unit_store
+from instrumentation import RUN, default_report_dir
 
 # Configuration - edit file path
 #currently_available = "/[file path]/currently_available.csv"
 #output_path = "/[file path]/complete_portfolio.csv"
+#store_path = "/[file path]/units.db"
+
+# "csv" matches currently_available against complete_portfolio.csv and rewrites output_path
+# "store" matches inside the SQLite store written by scripts 1-2 (unit_store.py): only the portfolio rows of
+# properties that have available units are read (property index), only rows whose price or scraped_date
+# changed are written back (key index), and output_path is then exported from the store for scripts 4-5
+INPUT_MODE = "csv"
 
 def normalize_text(text):
     """
@@ -36,79 +47,144 @@ def normalize_city(city):
     
     return ' '.join(city.split())
 
+def normalize_column(series, normalize):
+    """
+    Apply a normalize function once per distinct value instead of once per row
+    """
+    codes, uniques = pd.factorize(series)
+    normalized = np.array([normalize(value) for value in uniques] + [normalize(np.nan)], dtype=object)
+    return pd.Series(normalized[codes], index=series.index)
+
+def build_suffix_index(df_available):
+    """
+    Map (city_norm, property_norm, suffix) -> position of the first available unit whose
+    unit_norm ends with that suffix (e.g. "001-101" -> "AVB-CA097-001-101")
+    """
+    suffix_index = {}
+    keys = zip(df_available['city_norm'], df_available['property_norm'], df_available['unit_norm'])
+    for pos, (city_norm, property_norm, unit_norm) in enumerate(keys):
+        for start in range(len(unit_norm) + 1):
+            suffix_index.setdefault((city_norm, property_norm, unit_norm[start:]), pos)
+    return suffix_index
+
 def match_and_update(df_properties, df_available):
     """
     Match properties with available units using apt_complex, city, and unit_number
     """
     # Normalize columns in available units for matching
-    df_available['city_norm'] = df_available['city'].apply(normalize_city)
-    df_available['property_norm'] = df_available['apt_complex'].apply(normalize_text)
+    df_available['city_norm'] = normalize_column(df_available['city'], normalize_city)
+    df_available['property_norm'] = normalize_column(df_available['apt_complex'], normalize_text)
     df_available['unit_norm'] = df_available['unit_number'].astype(str).str.strip()
 
-    matches = 0
-    no_matches = []
-
-    for idx, row in df_properties.iterrows():
-        # Normalize property data
-        city_norm = normalize_city(row['city'])
-        property_norm = normalize_text(row['apt_complex'])
-        unit_number = str(row['unit_number']).strip()
-
-        # Find match in available units (Property Name + City + Unit Number)
-        # Try exact match first
-        match = df_available[
-            (df_available['city_norm'] == city_norm) &
-            (df_available['property_norm'] == property_norm) &
-            (df_available['unit_norm'] == unit_number)
-        ]
-
-        # If no exact match, try matching on unit suffix (e.g., "001-101" matches "AVB-CA097-001-101")
-        if len(match) == 0:
-            match = df_available[
-                (df_available['city_norm'] == city_norm) &
-                (df_available['property_norm'] == property_norm) &
-                (df_available['unit_norm'].str.endswith(unit_number))
-            ]
-
-        if len(match) > 0:
-            # Match found!
-            matched_unit = match.iloc[0]
-
-            # Update price only if:
-            # Current price is empty/null, OR
-            # Currently_available has a non-null price
-            current_price = row['price']
-            available_price = matched_unit['price']
-
-            if pd.isna(current_price) or pd.notna(available_price):
-                df_properties.at[idx, 'price'] = available_price
-
-            # Always update scraped_date if available
-            if pd.notna(matched_unit['date_scraped']):
-                df_properties.at[idx, 'scraped_date'] = matched_unit['date_scraped']
-
-            matches += 1
-
-            if matches % 100 == 0:
-                print(f"  ✓ Matched {matches} units so far...")
-        else:
-            # Track non-matches for debugging
-            no_matches.append({
-                'city': row['city'],
-                'property': row['apt_complex'],
-                'unit': unit_number
-            })
+    # Normalize property data
+    keys = pd.DataFrame({
+        'city_norm': normalize_column(df_properties['city'], normalize_city).to_numpy(),
+        'property_norm': normalize_column(df_properties['apt_complex'], normalize_text).to_numpy(),
+        'unit_norm': df_properties['unit_number'].astype(str).str.strip().to_numpy()
+    })
+
+    # Exact match: hash join on (City + Property Name + Unit Number) against the
+    # first available unit for each key
+    available_keys = df_available[['city_norm', 'property_norm', 'unit_norm']].copy()
+    available_keys['position'] = np.arange(len(df_available))
+    available_keys = available_keys.drop_duplicates(subset=['city_norm', 'property_norm', 'unit_norm'], keep='first')
+    position = keys.merge(available_keys, on=['city_norm', 'property_norm', 'unit_norm'], how='left')['position'].to_numpy()
+
+    # If no exact match, try matching on unit suffix (e.g., "001-101" matches "AVB-CA097-001-101")
+    unmatched = np.flatnonzero(np.isnan(position))
+    if len(unmatched) > 0:
+        suffix_index = build_suffix_index(df_available)
+        unmatched_keys = keys.iloc[unmatched].itertuples(index=False, name=None)
+        position[unmatched] = [suffix_index.get(key, np.nan) for key in unmatched_keys]
+
+    has_match = ~np.isnan(position)
+    matched = position[has_match].astype(int)
+
+    # Update price only if:
+    # Current price is empty/null, OR
+    # Currently_available has a non-null price
+    available_price = df_available['price'].to_numpy()[matched]
+    update_price = df_properties['price'].isna().to_numpy()[has_match] | pd.notna(available_price)
+    price_rows = np.flatnonzero(has_match)[update_price]
+    df_properties.loc[df_properties.index[price_rows], 'price'] = available_price[update_price]
+
+    # Always update scraped_date if available (files written by script 2 since the
+    # first_seen/last_seen migration carry the scrape time as last_seen)
+    date_column = 'date_scraped' if 'date_scraped' in df_available.columns else 'last_seen'
+    available_date = df_available[date_column].to_numpy()[matched]
+    update_date = pd.notna(available_date)
+    if update_date.any():
+        date_rows = np.flatnonzero(has_match)[update_date]
+        df_properties.loc[df_properties.index[date_rows], 'scraped_date'] = available_date[update_date]
+
+    matches = int(has_match.sum())
+
+    # Track non-matches for debugging
+    no_matches = [
+        {'city': city, 'property': apt_complex, 'unit': unit_number}
+        for city, apt_complex, unit_number in zip(
+            df_properties['city'].to_numpy()[~has_match],
+            df_properties['apt_complex'].to_numpy()[~has_match],
+            keys['unit_norm'].to_numpy()[~has_match]
+        )
+    ]
 
     return df_properties, matches, no_matches
 
+def match_in_store(conn):
+    """
+    match_and_update against the store, reading only the portfolio rows that can match and writing only the ones that changed
+    Returns: (rows matched, rows updated, portfolio rows)
+    """
+    df_available = unit_store.read_table(conn, 'available')
+    if len(df_available) == 0:
+        return 0, 0, unit_store.count(conn, 'portfolio')
+
+    # A portfolio row can only match an available unit of the same normalized city + property
+    available_properties = set(zip(normalize_column(df_available['city'], normalize_city),
+                                   normalize_column(df_available['apt_complex'], normalize_text)))
+    properties = [(city, apt_complex) for city, apt_complex in unit_store.distinct_properties(conn, 'portfolio')
+                  if (normalize_city(city), normalize_text(apt_complex)) in available_properties]
+    df_properties = unit_store.read_properties(conn, 'portfolio', properties)
+
+    before = df_properties[['price', 'scraped_date']].astype(str)
+    df_properties, match_count, _ = match_and_update(df_properties, df_available)
+    changed = (df_properties[['price', 'scraped_date']].astype(str) != before).any(axis=1)
+    updated = unit_store.update_rows(conn, 'portfolio', df_properties[changed], ['price', 'scraped_date'])
+    return match_count, updated, unit_store.count(conn, 'portfolio')
+
+def main_store():
+    print(f"Matching in {store_path}...")
+    print("Matching on: City + Property Name (apt_complex) + Unit Number\n")
+    conn = unit_store.connect(store_path)
+    with RUN.stage('match') as step:
+        match_count, updated, total = match_in_store(conn)
+        step['rows'] = total
+    conn.close()
+
+    print(f"\n{'='*60}")
+    print(f"✓ Matched {match_count} out of {total} properties")
+    print(f"  Match rate: {match_count/max(total, 1)*100:.1f}%")
+    print(f"  Not matched: {total - match_count}")
+    print(f"  Rows updated: {updated}")
+
+    with RUN.stage('export') as step:
+        rows = step['rows'] = unit_store.export_csv(store_path, 'portfolio', output_path)
+    print(f"\n✓ Exported {rows} rows to: {output_path}")
+
 def main():
-    print("Loading All_Properties.csv...")
-    df_properties = pd.read_csv(output_path)
-    print(f"Loaded {len(df_properties)} properties\n")
+    if INPUT_MODE == "store":
+        return main_store()
+
+    with RUN.stage('load') as step:
+        print("Loading All_Properties.csv...")
+        df_properties = schema.read_csv(output_path, 'complete_portfolio')
+        print(f"Loaded {len(df_properties)} properties\n")
 
-    print("Loading currently_available.csv...")
-    df_available = pd.read_csv(currently_available)
-    print(f"Loaded {len(df_available)} available units\n")
+        print("Loading currently_available.csv...")
+        df_available = schema.read_csv(currently_available, 'currently_available')
+        print(f"Loaded {len(df_available)} available units\n")
+        step['rows'] = len(df_properties) + len(df_available)
 
     if len(df_available) == 0:
         print("\nNo available units found. Exiting.")
@@ -116,7 +192,8 @@ def main():
 
     print("\nMatching properties with available units...")
     print("Matching on: City + Property Name (apt_complex) + Unit Number\n")
-    df_updated, match_count, no_matches = match_and_update(df_properties, df_available)
+    with RUN.stage('match', rows=len(df_properties)):
+        df_updated, match_count, no_matches = match_and_update(df_properties, df_available)
     
     print(f"\n{'='*60}")
     print(f"✓ Matched {match_count} out of {len(df_properties)} properties")
@@ -124,7 +201,8 @@ def main():
     print(f"  Not matched: {len(no_matches)}")
     
     # Save updated CSV
-    df_updated.to_csv(output_path, index=False)
+    with RUN.stage('save', rows=len(df_updated)):
+        schema.to_csv(df_updated, 'complete_portfolio', output_path)
     print(f"\n✓ Saved updated file to: {output_path}")
     
     # Show sample of matched data
@@ -156,4 +234,5 @@ def main():
             print("This means those properties have NO available units currently")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    print(f"\nRun report: {RUN.save(default_report_dir(output_path), 'merge')}")
\ No newline at end of file
@@ -1,89 +1,140 @@
-from sklearn.tree import DecisionTreeRegressor
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_absolute_error, r2_score
-from sklearn.model_selection import train_test_split
-import pandas as pd
-
-#DecisionTreeRegressor option
-#AVB_model = DecisionTreeRegressor(random_state=1)
-AVB_model = RandomForestRegressor(n_estimators=100, random_state=1,n_jobs=-1)
-file_path = "/Users/charlie/Desktop/Project/All_Properties.csv"
-AVB_data = pd.read_csv(file_path)
-
-print(AVB_data.columns)
-
-# Convert 'GR' (ground floor) to 0, and ensure floor is numeric
-AVB_data['floor'] = AVB_data['floor'].replace('GR', 0)
-AVB_data['floor'] = pd.to_numeric(AVB_data['floor'], errors='coerce')
-
-train_data = AVB_data[AVB_data['price'].notna()]
-y = train_data.price
-AVB_features = ['bed_count', 'bath_count', 'sqft', 'floor',
-                'binary_california', 'binary_colorado', 'binary_district_of_columbia', 'binary_florida',
-                'binary_maryland', 'binary_massachusetts', 'binary_new_jersey', 'binary_new_york',
-                'binary_north_carolina', 'binary_texas', 'binary_virginia', 'binary_washington',
-                'binary_Acton', 'binary_Addison', 'binary_Agoura_Hills', 'binary_Alexandria',
-                'binary_Allen', 'binary_Annapolis', 'binary_Arlington', 'binary_Artesia',
-                'binary_Aurora', 'binary_Austin', 'binary_Baltimore', 'binary_Bedford',
-                'binary_Bellevue', 'binary_Benbrook', 'binary_Bloomfield', 'binary_Bloomingdale',
-                'binary_Boca_Raton', 'binary_Boonton', 'binary_Boston', 'binary_Bothell',
-                'binary_Brea', 'binary_Brighton', 'binary_Brooklyn', 'binary_Burbank',
-                'binary_Burlington', 'binary_Calabasas', 'binary_Camarillo', 'binary_Cambridge',
-                'binary_Canoga_Park', 'binary_Carrollton', 'binary_Castle_Rock', 'binary_Charlotte',
-                'binary_Chestnut_Hill', 'binary_Chino_Hills', 'binary_Coconut_Creek', 'binary_Columbia',
-                'binary_Costa_Mesa', 'binary_Dallas', 'binary_Denver', 'binary_Doral',
-                'binary_Dublin', 'binary_Durham', 'binary_Edgewater', 'binary_Emeryville',
-                'binary_Encino', 'binary_Englewood', 'binary_Fairfax_County', 'binary_Falls_Church',
-                'binary_Florham_Park', 'binary_Flower_Mound', 'binary_Fort_Lauderdale', 'binary_Foster_City',
-                'binary_Framingham', 'binary_Fremont', 'binary_Frisco', 'binary_Garden_City',
-                'binary_Georgetown', 'binary_Glendale', 'binary_Glendora', 'binary_Great_Neck',
-                'binary_Harrison', 'binary_Herndon', 'binary_Hialeah', 'binary_Hingham',
-                'binary_Hoboken', 'binary_Hunt_Valley', 'binary_Huntington_Beach', 'binary_Huntington_Station',
-                'binary_Irvine', 'binary_Jersey_City', 'binary_La_Mesa', 'binary_Lafayette',
-                'binary_Lake_Forest', 'binary_Lakewood', 'binary_Laurel', 'binary_Lewisville',
-                'binary_Lexington', 'binary_Linthicum_Heights', 'binary_Littleton', 'binary_Long_Island',
-                'binary_Long_Island_City', 'binary_Los_Angeles', 'binary_Lynnwood', 'binary_Maplewood',
-                'binary_Margate', 'binary_Marlborough', 'binary_Melville', 'binary_Merrifield',
-                'binary_Miami', 'binary_Milford', 'binary_Miramar', 'binary_Monrovia',
-                'binary_Montville', 'binary_Mooresville', 'binary_Morrisville', 'binary_Mountain_View',
-                'binary_Natick', 'binary_Newcastle', 'binary_New_York_City', 'binary_North_Andover',
-                'binary_North_Bergen', 'binary_North_Bethesda', 'binary_North_Potomac', 'binary_Northborough',
-                'binary_Norwood', 'binary_Old_Bridge', 'binary_Owings_Mills', 'binary_Pacifica',
-                'binary_Parker', 'binary_Parsippany', 'binary_Pasadena', 'binary_Peabody',
-                'binary_Pflugerville', 'binary_Piscataway', 'binary_Pleasanton', 'binary_Plymouth',
-                'binary_Pomona', 'binary_Princeton', 'binary_Quincy', 'binary_Rancho_Santa_Margarita',
-                'binary_Redmond', 'binary_Reston', 'binary_Rockville', 'binary_Rockville_Centre',
-                'binary_Roseland', 'binary_San_Bruno', 'binary_San_Diego', 'binary_San_Dimas',
-                'binary_San_Francisco', 'binary_San_Jose', 'binary_San_Marcos', 'binary_Santa_Monica',
-                'binary_Saugus', 'binary_Seal_Beach', 'binary_Seattle', 'binary_Silver_Spring',
-                'binary_Smithtown', 'binary_Somers', 'binary_Somerville', 'binary_Studio_City',
-                'binary_Sudbury', 'binary_Sunnyvale', 'binary_Teaneck', 'binary_Thousand_Oaks',
-                'binary_Towson', 'binary_Tysons_Corner', 'binary_Union', 'binary_Union_City',
-                'binary_Vista', 'binary_Walnut_Creek', 'binary_Waltham', 'binary_Washington',
-                'binary_Wayne', 'binary_West_Hollywood', 'binary_West_Palm_Beach', 'binary_West_Windsor',
-                'binary_Westbury', 'binary_Westminster', 'binary_Wharton', 'binary_Wheaton',
-                'binary_White_Plains', 'binary_Wilmington', 'binary_Woburn', 'binary_Woodland_Hills',
-                'binary_Yonkers']
-
-X_all = AVB_data[AVB_features]
-X_train, X_test, y_train, y_test = train_test_split(
-    train_data[AVB_features], y, test_size=0.2, random_state=1
-)
-AVB_model.fit(X_train, y_train)
-predicted_test = AVB_model.predict(X_test)
-mae = mean_absolute_error(y_test, predicted_test)
-r2 = r2_score(y_test, predicted_test)
-n = len(y_test)
-p = X_train.shape[1]
-adj_r2 = 1 - (1 - r2) * (n - 1) / (n - p - 1)
-print(f"\nModel Performance:")
-print(f"  Mean Absolute Error: ${mae:.2f}")
-print(f"  R² Score: {r2:.4f}")
-print(f"Adjusted R² Score: {adj_r2:.4f}")
-
-#Edit 2 lines below in/out depending on need. Include if using scikitlearn to predict. Exclude to just get the R2 & MAE
-AVB_data['adjusted_price'] = AVB_model.predict(X_all)
-AVB_data.to_csv(file_path, index=False)
-print(f"Total rows: {len(AVB_data)}")
-print(f"Trained on {len(train_data)} rows with known prices")
-print(f"Predicted for all {len(AVB_data)} rows")
+import os
+import numpy as np
+import schema
+from features import load_feature_cache, rekey_feature_cache, drop_binary_variables, matrix_rows
+from model_registry import train_or_load, update_model, default_model_dir
+from market_models import train_or_load_markets, SEGMENT_BY
+from flat_forest import flat_forest_for, predict_flat, numba
+from instrumentation import RUN, default_report_dir
+
+# Remove # Below, and edit directory path
+#file_path = "/[file path directory]/complete_portfolio.csv"
+
+#Include if using scikitlearn to predict (writes adjusted_price back to file_path). Set False to just get the R2 & MAE
+WRITE_PREDICTIONS = True
+
+# "flat" scores with the compiled forest (flat_forest.py: same predictions, a fraction of the memory),
+# "sklearn" with AVB_model.predict. Flat is only faster with numba installed - its numpy fallback is
+# slower than AVB_model.predict - so it is the default only then
+SCORING_ENGINE = "flat" if numba is not None else "sklearn"
+
+# "full" fits the forest on every priced row (when they change); "incremental" adds trees trained on the
+# recently priced rows to the latest model and retires the oldest (model_registry.INCREMENTAL), with a
+# full rebuild on schedule
+TRAINING_MODE = "full"
+
+# "global" scores every row with the one forest; "markets" also fits one forest per market (state, or metro
+# cluster - market_models.SEGMENT_BY) in parallel, only for the markets whose rows changed, and scores each row
+# with its market's forest - the global forest for markets with too few rows. Their holdout accuracy against
+# the global forest goes into the run report
+MODEL_MODE = "global"
+
+# "chunked" streams file_path through the model SCORE_CHUNK_ROWS rows at a time (read, score, append to the
+# output), so memory stays flat as the portfolio grows; "single" reads, scores and writes the whole file at once
+SCORING_MODE = "chunked"
+SCORE_CHUNK_ROWS = 100_000
+
+def score_in_chunks(source_path, predict_rows, total_rows, chunk_rows=SCORE_CHUNK_ROWS):
+    """
+    Rewrite source_path with adjusted_price = predict_rows(start, stop) for each chunk of rows
+    Chunks are read and written through the complete_portfolio schema; the new file replaces source_path
+    once every chunk is written
+    Returns: number of rows scored
+    """
+    tmp_path = f"{source_path}.tmp"
+    start = 0
+    try:
+        reader = schema.read_csv(source_path, 'complete_portfolio', chunksize=chunk_rows)
+        while True:
+            with RUN.stage('load') as step:
+                chunk = next(reader, None)
+                if chunk is not None:
+                    chunk = drop_binary_variables(chunk)
+                    step['rows'] = len(chunk)
+            if chunk is None:
+                break
+            stop = start + len(chunk)
+            with RUN.stage('predict', rows=len(chunk)):
+                chunk['adjusted_price'] = predict_rows(start, stop)
+            with RUN.stage('save', rows=len(chunk)):
+                schema.to_csv(chunk, 'complete_portfolio', tmp_path, mode='w' if start == 0 else 'a', header=start == 0)
+            start = stop
+        # The feature cache rows line up with the file's rows - a different count means it describes another file
+        if start != total_rows:
+            raise ValueError(f"{source_path} has {start} rows but its feature cache has {total_rows}")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, source_path)
+    return start
+
+def main():
+    # Features: bed/bath/sqft/floor ('GR' ground floor -> 0) plus state and city indicators as a
+    # sparse matrix (columns = FEATURES). Mapped from the feature cache next to file_path, which
+    # is only rebuilt when the file's contents change.
+    with RUN.stage('load_features') as step:
+        feature_cache = load_feature_cache(file_path)
+        step['rows'] = len(feature_cache['price'])
+    train_rows = ~np.isnan(feature_cache['price'])
+
+    # RandomForestRegressor(n_estimators=100, random_state=1) from the model registry (models/ next
+    # to file_path): fitted on an 80/20 split of the priced rows, and only refitted when they change
+    # (the fit itself, when there is one, is recorded as the 'fit' stage)
+    with RUN.stage('train_or_load'):
+        if TRAINING_MODE == "incremental":
+            AVB_model, model_meta = update_model(file_path, feature_cache=feature_cache)
+        else:
+            AVB_model, model_meta = train_or_load(file_path, feature_cache=feature_cache)
+    metrics = model_meta['metrics']
+    print(f"\nModel Performance:")
+    print(f"  Mean Absolute Error: ${metrics['mae']:.2f}")
+    print(f"  R² Score: {metrics['r2']:.4f}")
+    print(f"Adjusted R² Score: {metrics['adj_r2']:.4f}")
+
+    if MODEL_MODE == "markets":
+        print(f"\nMarket models (by {SEGMENT_BY}):")
+        with RUN.stage('train_or_load_markets'):
+            market_models, comparison = train_or_load_markets(file_path, (AVB_model, model_meta), feature_cache=feature_cache)
+        print(f"  Routed: MAE ${comparison['markets']['mae']:.2f}, R² {comparison['markets']['r2']:.4f} "
+              f"(global MAE ${comparison['global']['mae']:.2f}, R² {comparison['global']['r2']:.4f})")
+
+    total_rows = len(feature_cache['price'])
+    print(f"Total rows: {total_rows}")
+    print(f"Trained on {train_rows.sum()} rows with known prices")
+
+    if WRITE_PREDICTIONS:
+        flat_models = {}
+
+        def score_rows(model, version, rows):
+            # Features of the rows (a slice or row numbers) straight from the memory-mapped cache arrays
+            if SCORING_ENGINE == "flat":
+                if version not in flat_models:
+                    flat_models[version] = flat_forest_for(model, default_model_dir(file_path), version)
+                return predict_flat(flat_models[version], feature_cache['numeric'][rows], feature_cache['state_code'][rows],
+                                    feature_cache['city_code'][rows])
+            return model.predict(matrix_rows(feature_cache, rows))
+
+        def predict_rows(start, stop):
+            if MODEL_MODE == "markets":
+                return market_models.predict(feature_cache, slice(start, stop), score_rows)
+            return score_rows(AVB_model, model_meta['version'], slice(start, stop))
+
+        if SCORING_MODE == "chunked":
+            scored = score_in_chunks(file_path, predict_rows, total_rows)
+        else:
+            with RUN.stage('load', rows=total_rows):
+                AVB_data = schema.read_csv(file_path, 'complete_portfolio')
+                AVB_data = drop_binary_variables(AVB_data)
+            with RUN.stage('predict', rows=total_rows):
+                AVB_data['adjusted_price'] = predict_rows(0, total_rows)
+            with RUN.stage('save', rows=len(AVB_data)):
+                schema.to_csv(AVB_data, 'complete_portfolio', file_path)
+            scored = len(AVB_data)
+        # Only adjusted_price changed, so the cached features still describe the file
+        rekey_feature_cache(file_path)
+        print(f"Predicted for all {scored} rows")
+
+if __name__ == "__main__":
+    main()
+    print(f"Run report: {RUN.save(default_report_dir(file_path), 'train_predict')}")
@@ -0,0 +1,228 @@
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import sklearn
+import schema
+from features import load_feature_cache, add_binary_variables, build_feature_matrix, NUMERIC_FEATURES
+from model_registry import fit_model
+from flat_forest import compile_forest, predict_flat, numba
+from synthetic_data import write_inputs
+from json_stream import decode_json, STREAM_CHUNK_SIZE
+
+# Benchmark suite: generates a synthetic portfolio (synthetic_data.py) at the configured scale
+# and times every pipeline stage on it - min wall time over REPEATS runs, plus the peak
+# traced allocation (tracemalloc) of one extra run. tracemalloc sees Python and numpy
+# allocations only - memory allocated inside sklearn's compiled tree code is not counted,
+# so peak_mb understates the fit and predict_sklearn stages. Results go to
+# <BENCH_DIR>/results/<commit>_<units>.json so runs can be compared between commits.
+
+BENCH_UNITS = 76_000            # today's portfolio; 1_000_000+ for the scale-up runs
+BENCH_PROPERTIES = 273
+BENCH_SEED = 0
+BENCH_DIR = "benchmarks"        # relative to the working directory
+REPEATS = 3
+FIT_REPEATS = 1                 # model fits are slow at large scales
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_script(filename):
+    """
+    Import a numbered pipeline script as a module (its main() is not run)
+    """
+    name = 'bench_' + os.path.splitext(filename)[0].lstrip('0123456789_')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def measure(fn, setup=None, repeats=REPEATS):
+    """
+    Time fn(*setup()) repeats times, then run it once more under tracemalloc for the peak
+    Setup runs before each call and is not timed
+    Returns: dict with seconds (min), runs and peak_mb
+    """
+    runs = []
+    for _ in range(repeats):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        fn(*args)
+        runs.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(runs), 'runs': runs, 'peak_mb': peak / 1e6}
+
+def read_payloads(directory):
+    payloads = {}
+    for filename in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            payloads[os.path.splitext(filename)[0]] = f.read()
+    return payloads
+
+def run_suite(paths):
+    scrape_portfolio = load_script('1_scrape_complete_portfolio.py')
+    currently_available = load_script('2_currently_available.py')
+    available_to_portfolio = load_script('3_available_to_complete_portfolio.py')
+    scikit_missing = load_script('5_scikit_missing.py')
+
+    properties = schema.read_csv(paths['property_urls'], 'property_urls')
+    sightmaps = read_payloads(paths['sightmap_dir'])
+    community_units = read_payloads(paths['community_units_dir'])
+    portfolio = schema.read_csv(paths['complete_portfolio'], 'complete_portfolio')
+    available = schema.read_csv(paths['currently_available'], 'currently_available')
+    tasks = [currently_available.build_task(row) for _, row in properties.iterrows()]
+    stages = {}
+
+    def resident_mb(df):
+        return df.memory_usage(deep=True).sum() / 1e6
+    print("read_csv...")
+    stages['read_csv'] = measure(pd.read_csv, lambda: (paths['complete_portfolio'],))
+    # read_csv_schema is an unchanged file (the typed frame cache, filled by the read above); parse is a changed one
+    stages['read_csv_schema'] = measure(schema.read_csv, lambda: (paths['complete_portfolio'], 'complete_portfolio'))
+    stages['read_csv_schema_parse'] = measure(schema.parse_csv, lambda: (paths['complete_portfolio'], 'complete_portfolio'))
+    stages['read_csv']['rows'] = stages['read_csv_schema']['rows'] = stages['read_csv_schema_parse']['rows'] = len(portfolio)
+    # Size of the loaded frame itself (peak_mb includes the parser's buffers)
+    stages['read_csv']['frame_mb'] = resident_mb(pd.read_csv(paths['complete_portfolio']))
+    stages['read_csv_schema']['frame_mb'] = resident_mb(portfolio)
+
+    def parse_all_sightmaps(parse):
+        return [parse(json.loads(sightmaps[url.split('/')[-1]])['data'], url, city, state)
+                for url, city, state in zip(properties['Sitemap Url'], properties['city'], properties['state'])]
+    print("parse_sightmap...")
+    stages['parse_sightmap'] = measure(parse_all_sightmaps, lambda: (scrape_portfolio.parse_sightmap,))
+    stages['parse_sightmap_columns'] = measure(parse_all_sightmaps, lambda: (scrape_portfolio.parse_sightmap_columns,))
+    stages['parse_sightmap']['rows'] = stages['parse_sightmap_columns']['rows'] = len(portfolio)
+
+    def parse_all_units():
+        return [currently_available.parse_units(json.loads(community_units[task['block_id']]), task['state'],
+                                                task['city'], task['property_name'], task['block_id'])
+                for task in tasks]
+    print("parse_units...")
+    stages['parse_units'] = measure(parse_all_units)
+    new_data = schema.coerce(pd.DataFrame([unit for units in parse_all_units() for unit in units]), 'currently_available')
+    stages['parse_units']['rows'] = len(new_data)
+
+    def parse_all_units_columns():
+        return currently_available.columns_frame([
+            currently_available.parse_units_columns(json.loads(community_units[task['block_id']]), task['state'],
+                                                    task['city'], task['property_name'], task['block_id'])
+            for task in tasks])
+    stages['parse_units_columns'] = measure(parse_all_units_columns)
+    stages['parse_units_columns']['rows'] = len(new_data)
+
+    def decode_payloads(stream):
+        # One payload at a time, results dropped - the peak is that of the largest single response
+        for payloads, fields in [(sightmaps, scrape_portfolio.SIGHTMAP_FIELDS if stream else None),
+                                 (community_units, currently_available.UNIT_FIELDS if stream else None)]:
+            for body in payloads.values():
+                decode_json((body[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(body), STREAM_CHUNK_SIZE)), fields)
+    print("decode_payloads...")
+    stages['decode_payloads'] = measure(decode_payloads, lambda: (False,))
+    stages['decode_payloads_stream'] = measure(decode_payloads, lambda: (True,))
+    stages['decode_payloads']['rows'] = stages['decode_payloads_stream']['rows'] = len(sightmaps) + len(community_units)
+
+    print("upsert_apartments...")
+    stages['upsert_apartments'] = measure(currently_available.upsert_apartments, lambda: (available.copy(), new_data))
+    stages['upsert_apartments']['rows'] = len(available) + len(new_data)
+
+    print("match_and_update...")
+    stages['match_and_update'] = measure(available_to_portfolio.match_and_update, lambda: (portfolio.copy(), available.copy()))
+    stages['match_and_update']['rows'] = len(portfolio)
+
+    print("add_binary_variables...")
+    stages['add_binary_variables'] = measure(add_binary_variables, lambda: (portfolio,))
+    stages['add_binary_variables']['rows'] = len(portfolio)
+    stages['build_feature_matrix'] = measure(build_feature_matrix, lambda: (portfolio,))
+    stages['build_feature_matrix']['rows'] = len(portfolio)
+
+    feature_cache = load_feature_cache(paths['complete_portfolio'])
+    train_rows = ~np.isnan(feature_cache['price'])
+    print("fit...")
+    stages['fit'] = measure(fit_model, lambda: (feature_cache,), repeats=FIT_REPEATS)
+    stages['fit']['rows'] = int(train_rows.sum())
+    model = fit_model(feature_cache)[0]
+
+    print("predict...")
+    stages['predict_sklearn'] = measure(model.predict, lambda: (feature_cache['X'],))
+    stages['predict_sklearn']['rows'] = len(portfolio)
+    stages['compile_flat'] = measure(compile_forest, lambda: (model,), repeats=1)
+    flat = compile_forest(model)
+    # First call compiles the numba loop - keep it out of the timings
+    predict_flat(flat, feature_cache['numeric'][:8], feature_cache['state_code'][:8], feature_cache['city_code'][:8])
+    stages['predict_flat'] = measure(predict_flat, lambda: (flat, feature_cache['numeric'], feature_cache['state_code'], feature_cache['city_code']))
+    stages['predict_flat']['rows'] = len(portfolio)
+
+    print("estimate_revenue...")
+    train_data = pd.DataFrame(np.asarray(feature_cache['numeric'][train_rows]), columns=NUMERIC_FEATURES)
+    train_data['state_code'] = feature_cache['state_code'][train_rows]
+    state_averages, state_unit_mix = scikit_missing.state_mix_tables(train_data)
+    missing = schema.read_csv(paths['missing_predictions'], 'missing_predictions')
+    stages['estimate_revenue'] = measure(scikit_missing.estimate_revenue, lambda: (missing.copy(), model, state_averages, state_unit_mix))
+    stages['estimate_revenue']['rows'] = len(missing)
+
+    return stages
+
+def main():
+    data_dir = os.path.join(BENCH_DIR, f"data_{BENCH_UNITS}_{BENCH_PROPERTIES}_{BENCH_SEED}")
+    marker = os.path.join(data_dir, 'paths.json')
+    if os.path.exists(marker):
+        with open(marker) as f:
+            paths = json.load(f)
+    else:
+        print(f"Generating {BENCH_UNITS:,} units across {BENCH_PROPERTIES} properties in {data_dir}...")
+        start = time.perf_counter()
+        paths = write_inputs(data_dir, BENCH_UNITS, BENCH_PROPERTIES, BENCH_SEED)
+        with open(marker, 'w') as f:
+            json.dump(paths, f)
+        print(f"Generated in {time.perf_counter() - start:.1f}s\n")
+
+    stages = run_suite(paths)
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'scale': {'units': BENCH_UNITS, 'properties': BENCH_PROPERTIES, 'seed': BENCH_SEED},
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'scikit-learn': sklearn.__version__,
+            'numba': numba.__version__ if numba is not None else None,
+            'cpus': os.cpu_count()
+        },
+        'stages': stages
+    }
+    results_dir = os.path.join(BENCH_DIR, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"{commit}_{BENCH_UNITS}.json")
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'stage':<22}{'seconds':>10}{'peak MB':>10}{'rows':>10}")
+    for name, stage in stages.items():
+        print(f"{name:<22}{stage['seconds']:>10.3f}{stage['peak_mb']:>10.1f}{stage.get('rows', ''):>10}")
+    print(f"\n✓ Results saved to: {results_path}")
+
+if __name__ == "__main__":
+    main()
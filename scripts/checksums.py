@@ -0,0 +1,12 @@
+import hashlib
+
+# File checksums shared by the caches and manifests keyed on a file's contents: the shard manifest
+# (shards.py), the feature cache (features.py), the typed frame cache (schema.py) and the pipeline's
+# input fingerprints (pipeline.py).
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,292 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import schema
+from schema import FLOOR_NUMBERS, floor_numbers
+from checksums import file_sha256
+
+# Model features: 4 numeric columns plus one indicator per state and per city.
+# The indicators are never stored - each row carries a single state code and city code
+# (its position in STATES / CITIES), and the indicator matrix is built as a sparse
+# matrix from those codes when a model needs it.
+
+NUMERIC_FEATURES = ['bed_count', 'bath_count', 'sqft', 'floor']
+
+# States (where AVB has apartment complexes)
+STATES = ['california', 'colorado', 'district_of_columbia', 'florida', 'maryland',
+          'massachusetts', 'new_jersey', 'new_york', 'north_carolina', 'texas',
+          'virginia', 'washington']
+
+CITIES = ['Acton', 'Addison', 'Agoura_Hills', 'Alexandria', 'Allen', 'Annapolis', 'Arlington',
+          'Artesia', 'Aurora', 'Austin', 'Baltimore', 'Bedford', 'Bellevue', 'Benbrook',
+          'Bloomfield', 'Bloomingdale', 'Boca_Raton', 'Boonton', 'Boston', 'Bothell', 'Brea',
+          'Brighton', 'Brooklyn', 'Burbank', 'Burlington', 'Calabasas', 'Camarillo', 'Cambridge',
+          'Canoga_Park', 'Carrollton', 'Castle_Rock', 'Charlotte', 'Chestnut_Hill', 'Chino_Hills',
+          'Coconut_Creek', 'Columbia', 'Costa_Mesa', 'Dallas', 'Denver', 'Doral', 'Dublin',
+          'Durham', 'Edgewater', 'Emeryville', 'Encino', 'Englewood', 'Fairfax_County',
+          'Falls_Church', 'Florham_Park', 'Flower_Mound', 'Fort_Lauderdale', 'Foster_City',
+          'Framingham', 'Fremont', 'Frisco', 'Garden_City', 'Georgetown', 'Glendale', 'Glendora',
+          'Great_Neck', 'Harrison', 'Herndon', 'Hialeah', 'Hingham', 'Hoboken', 'Hunt_Valley',
+          'Huntington_Beach', 'Huntington_Station', 'Irvine', 'Jersey_City', 'La_Mesa', 'Lafayette',
+          'Lake_Forest', 'Lakewood', 'Laurel', 'Lewisville', 'Lexington', 'Linthicum_Heights',
+          'Littleton', 'Long_Island', 'Long_Island_City', 'Los_Angeles', 'Lynnwood', 'Maplewood',
+          'Margate', 'Marlborough', 'Melville', 'Merrifield', 'Miami', 'Milford', 'Miramar',
+          'Monrovia', 'Montville', 'Mooresville', 'Morrisville', 'Mountain_View', 'Natick',
+          'Newcastle', 'New_York_City', 'North_Andover', 'North_Bergen', 'North_Bethesda',
+          'North_Potomac', 'Northborough', 'Norwood', 'Old_Bridge', 'Owings_Mills', 'Pacifica',
+          'Parker', 'Parsippany', 'Pasadena', 'Peabody', 'Pflugerville', 'Piscataway', 'Pleasanton',
+          'Plymouth', 'Pomona', 'Princeton', 'Quincy', 'Rancho_Santa_Margarita', 'Redmond', 'Reston',
+          'Rockville', 'Rockville_Centre', 'Roseland', 'San_Bruno', 'San_Diego', 'San_Dimas',
+          'San_Francisco', 'San_Jose', 'San_Marcos', 'Santa_Monica', 'Saugus', 'Seal_Beach',
+          'Seattle', 'Silver_Spring', 'Smithtown', 'Somers', 'Somerville', 'Studio_City', 'Sudbury',
+          'Sunnyvale', 'Teaneck', 'Thousand_Oaks', 'Towson', 'Tysons_Corner', 'Union', 'Union_City',
+          'Vista', 'Walnut_Creek', 'Waltham', 'Washington', 'Wayne', 'West_Hollywood',
+          'West_Palm_Beach', 'West_Windsor', 'Westbury', 'Westminster', 'Wharton', 'Wheaton',
+          'White_Plains', 'Wilmington', 'Woburn', 'Woodland_Hills', 'Yonkers']
+
+STATE_FEATURES = [f'binary_{state}' for state in STATES]
+CITY_FEATURES = [f'binary_{city}' for city in CITIES]
+
+# Same names and order as the binary_* columns the model has always been trained on
+FEATURES = NUMERIC_FEATURES + STATE_FEATURES + CITY_FEATURES
+
+def state_codes(df):
+    """
+    Position of each row's state in STATES (-1 if not an AVB state)
+    """
+    normalized = df['state'].astype(str).str.lower().str.replace(' ', '_')
+    return pd.Categorical(normalized, categories=STATES).codes.astype(np.int16)
+
+def city_codes(df):
+    """
+    Position of each row's city in CITIES (-1 if not an AVB city)
+    """
+    normalized = df['city'].astype(str).str.replace(' ', '_').str.lower()
+    return pd.Categorical(normalized, categories=[city.lower() for city in CITIES]).codes.astype(np.int16)
+
+def numeric_features(df):
+    """
+    bed_count, bath_count, sqft, floor as a float array ('GR' ground floor -> 0)
+    """
+    numeric = df[NUMERIC_FEATURES].copy()
+    numeric['floor'] = floor_numbers(numeric['floor'])
+    return numeric.apply(pd.to_numeric, errors='coerce').astype(np.float64).to_numpy()
+
+def build_feature_matrix(df, sparse_output=True):
+    """
+    Feature matrix with columns FEATURES, built from the raw state/city/numeric columns
+    sparse_output=True returns a CSR matrix (6 stored values per row instead of 181)
+    """
+    return encode_features(numeric_features(df), state_codes(df), city_codes(df), sparse_output)
+
+def encode_features(numeric, states, cities, sparse_output=True):
+    """
+    Feature matrix from the numeric columns and the state/city codes
+    """
+    n = len(numeric)
+    rows = np.arange(n)
+
+    numeric = sparse.csr_matrix(np.asarray(numeric, dtype=np.float32))
+    has_state = states >= 0
+    has_city = cities >= 0
+    state_matrix = sparse.csr_matrix(
+        (np.ones(has_state.sum(), dtype=np.float32), (rows[has_state], states[has_state])),
+        shape=(n, len(STATES))
+    )
+    city_matrix = sparse.csr_matrix(
+        (np.ones(has_city.sum(), dtype=np.float32), (rows[has_city], cities[has_city])),
+        shape=(n, len(CITIES))
+    )
+
+    X = sparse.hstack([numeric, state_matrix, city_matrix], format='csr', dtype=np.float32)
+    return X if sparse_output else X.toarray()
+
+STATE_INDEX = {state: i for i, state in enumerate(STATES)}
+CITY_INDEX = {city.lower(): i for i, city in enumerate(CITIES)}
+
+def encode_records(records):
+    """
+    Dense feature matrix (columns FEATURES) for a few unit dicts without building a DataFrame -
+    same normalization and 'GR' handling as build_feature_matrix, for low-latency scoring
+    """
+    X = np.zeros((len(records), len(FEATURES)), dtype=np.float32)
+    for row, record in enumerate(records):
+        for col, name in enumerate(NUMERIC_FEATURES):
+            value = record[name]
+            try:
+                X[row, col] = float(FLOOR_NUMBERS.get(value, value))
+            except (TypeError, ValueError):
+                X[row, col] = np.nan
+        state = STATE_INDEX.get(str(record['state']).lower().replace(' ', '_'))
+        if state is not None:
+            X[row, len(NUMERIC_FEATURES) + state] = 1
+        city = CITY_INDEX.get(str(record['city']).replace(' ', '_').lower())
+        if city is not None:
+            X[row, len(NUMERIC_FEATURES) + len(STATES) + city] = 1
+    return X
+
+def add_binary_variables(df):
+    """
+    Add dense binary_* columns for states and cities (for inspection/export only -
+    the pipeline stores raw columns and encodes with build_feature_matrix)
+    """
+    states = state_codes(df)
+    cities = city_codes(df)
+    state_columns = {name: (states == i).astype(int) for i, name in enumerate(STATE_FEATURES)}
+    city_columns = {name: (cities == i).astype(int) for i, name in enumerate(CITY_FEATURES)}
+
+    binary_df = pd.DataFrame({**state_columns, **city_columns}, index=df.index)
+    return pd.concat([df, binary_df], axis=1)
+
+def drop_binary_variables(df):
+    """
+    Remove stored binary_* indicator columns (files written before the categorical encoding)
+    """
+    return df.drop(columns=[col for col in df.columns if col.startswith('binary_')])
+
+# Feature cache: the parsed numeric columns, state/city codes, price and price date of a
+# portfolio CSV, saved as .npy arrays in <source>.features/ with features.json recording the
+# source's sha256 and the feature columns. While the source is unchanged the arrays are
+# mapped straight from disk instead of re-parsing the CSV.
+
+CACHE_ARRAYS = ['numeric', 'state_code', 'city_code', 'price', 'price_date']
+
+# Rows parsed per step while building the cache - the build never holds more than this many rows of the CSV
+FEATURE_CHUNK_ROWS = 100_000
+
+def feature_cache_dir(source_path):
+    return f"{source_path}.features"
+
+def read_cache_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'features.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_cache_meta(cache_dir, meta):
+    tmp_path = os.path.join(cache_dir, 'features.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(cache_dir, 'features.json'))
+
+def price_dates(df):
+    """
+    Day each row's price was observed (scraped_date set by script 3) as days since 1970-01-01, NaN if unknown
+    """
+    if 'scraped_date' not in df.columns:
+        return np.full(len(df), np.nan)
+    dates = pd.to_datetime(df['scraped_date'], errors='coerce')
+    days = (dates - pd.Timestamp('1970-01-01')) / pd.Timedelta(days=1)
+    return days.to_numpy(dtype=np.float64)
+
+def feature_arrays(df):
+    """
+    The cached arrays for the rows of df (every array is computed row by row, so chunks concatenate to the whole file's)
+    """
+    return {
+        'numeric': numeric_features(df),
+        'state_code': state_codes(df),
+        'city_code': city_codes(df),
+        'price': pd.to_numeric(df['price'], errors='coerce').astype(np.float64).to_numpy(),
+        'price_date': price_dates(df)
+    }
+
+def build_feature_cache(source_path, cache_dir=None, source_hash=None, chunk_rows=FEATURE_CHUNK_ROWS):
+    """
+    Parse the source CSV once, chunk_rows at a time, and write the cached arrays + features.json
+    Each chunk's arrays are appended to a raw file, then copied into the .npy files by memory map
+    """
+    cache_dir = cache_dir or feature_cache_dir(source_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    raw_files = {name: open(os.path.join(cache_dir, f"{name}.raw"), 'wb') for name in CACHE_ARRAYS}
+    layout = {}
+    rows = 0
+    try:
+        reader = schema.read_csv(source_path, 'complete_portfolio', chunksize=chunk_rows,
+                                 usecols=lambda col: col in NUMERIC_FEATURES + ['state', 'city', 'price', 'scraped_date'])
+        for chunk in reader:
+            for name, array in feature_arrays(chunk).items():
+                raw_files[name].write(np.ascontiguousarray(array).tobytes())
+                layout[name] = (array.dtype, array.shape[1:])
+            rows += len(chunk)
+    finally:
+        for f in raw_files.values():
+            f.close()
+
+    if not layout:
+        layout = {name: (array.dtype, array.shape[1:]) for name, array in feature_arrays(
+            pd.DataFrame(columns=NUMERIC_FEATURES + ['state', 'city', 'price'])).items()}
+    for name in CACHE_ARRAYS:
+        dtype, inner_shape = layout[name]
+        raw_path = os.path.join(cache_dir, f"{name}.raw")
+        npy_path = os.path.join(cache_dir, f"{name}.npy")
+        if rows == 0:
+            np.save(npy_path, np.empty((0,) + inner_shape, dtype=dtype))
+        else:
+            source = np.memmap(raw_path, dtype=dtype, mode='r', shape=(rows,) + inner_shape)
+            target = np.lib.format.open_memmap(npy_path, mode='w+', dtype=dtype, shape=(rows,) + inner_shape)
+            for start in range(0, rows, chunk_rows):
+                target[start:start + chunk_rows] = source[start:start + chunk_rows]
+            target.flush()
+            del source, target
+        os.remove(raw_path)
+
+    # features.json is written last, so an interrupted build is never mistaken for a valid cache
+    write_cache_meta(cache_dir, {
+        'source': os.path.abspath(source_path),
+        'sha256': source_hash or file_sha256(source_path),
+        'rows': rows,
+        'columns': FEATURES,
+        'arrays': CACHE_ARRAYS
+    })
+
+def matrix_rows(feature_cache, rows, sparse_output=True):
+    """
+    Rows of the feature matrix (same values as feature_cache['X'][rows]) encoded from the cached arrays,
+    without building the matrix of the whole portfolio
+    """
+    return encode_features(feature_cache['numeric'][rows], feature_cache['state_code'][rows],
+                           feature_cache['city_code'][rows], sparse_output)
+
+class FeatureCache(dict):
+    """
+    The cached arrays; cache['X'], the sparse matrix of every row, is encoded on first use - scoring
+    the portfolio in chunks (script 4) never needs it
+    """
+
+    def __missing__(self, key):
+        if key != 'X':
+            raise KeyError(key)
+        self['X'] = encode_features(self['numeric'], self['state_code'], self['city_code'])
+        return self['X']
+
+def load_feature_cache(source_path, cache_dir=None):
+    """
+    Cached feature arrays for source_path, rebuilt only when the file's sha256 (or the
+    feature column list) has changed. Arrays are memory-mapped read-only.
+    Returns: FeatureCache with 'X' (CSR, columns FEATURES), 'price', 'price_date', 'numeric', 'state_code', 'city_code'
+    """
+    cache_dir = cache_dir or feature_cache_dir(source_path)
+    source_hash = file_sha256(source_path)
+    meta = read_cache_meta(cache_dir)
+
+    if meta is None or meta['sha256'] != source_hash or meta['columns'] != FEATURES or meta['arrays'] != CACHE_ARRAYS:
+        print(f"Building feature cache for {source_path}...")
+        build_feature_cache(source_path, cache_dir, source_hash)
+
+    return FeatureCache({name: np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r') for name in CACHE_ARRAYS})
+
+def rekey_feature_cache(source_path, cache_dir=None):
+    """
+    Point an existing cache at the current contents of source_path. Only for writes that
+    leave the cached columns untouched (e.g. script 4 saving adjusted_price back).
+    """
+    cache_dir = cache_dir or feature_cache_dir(source_path)
+    meta = read_cache_meta(cache_dir)
+    if meta is not None:
+        meta['sha256'] = file_sha256(source_path)
+        write_cache_meta(cache_dir, meta)
@@ -0,0 +1,314 @@
+import os
+import numpy as np
+from features import NUMERIC_FEATURES, STATES, CITIES, FEATURES
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Flattened forest: every tree of a fitted RandomForestRegressor packed into one set of
+# contiguous node arrays (feature, threshold, child, region, value) with per-tree root offsets.
+#
+# The forest is trained on one-hot state/city columns, and fully grown trees spend most of
+# their depth on chains of "is it city k?" splits (~50 nodes per path vs ~15 after collapsing).
+# Those splits only depend on the row's city (or state) code, so compile_forest collapses every
+# connected run of city splits (or state splits) into one lookup node: region_keys/region_exits
+# map (region, code) to the node the run exits at, and codes the run never reaches take the
+# node's default exit (its child). Numeric splits keep both children next to each other
+# (right = child + 1).
+#
+# Rows are scored from the compact columns (4 numeric features + state/city codes, as stored in
+# the feature cache). With numba installed the trees are walked by a compiled loop, otherwise by
+# vectorized numpy steps one tree at a time, so node lookups stay in cache.
+
+FLAT_ARRAYS = ['feature', 'threshold', 'child', 'region', 'value', 'roots', 'region_keys', 'region_exits', 'key_offsets']
+
+# feature: 0-3 numeric column, STATE_LOOKUP / CITY_LOOKUP (compact row column of the code), LEAF
+N_NUMERIC = len(NUMERIC_FEATURES)
+STATE_LOOKUP = N_NUMERIC
+CITY_LOOKUP = N_NUMERIC + 1
+LEAF = -1
+# Codes are keyed as code + 1 so unknown locations (-1, all one-hot columns 0) never match
+CODE_SPACE = max(len(STATES), len(CITIES)) + 1
+
+def float32_floor(threshold):
+    """
+    Largest float32 <= each float64 threshold. Features are compared as float32, and for a
+    float32 x, x <= t exactly when x <= float32_floor(t) - so the split decisions don't change
+    """
+    threshold32 = np.asarray(threshold, dtype=np.float64).astype(np.float32)
+    too_high = threshold32.astype(np.float64) > threshold
+    threshold32[too_high] = np.nextafter(threshold32[too_high], np.float32(-np.inf))
+    return threshold32
+
+def split_kinds(tree):
+    """
+    Compact column read by each sklearn tree node (LEAF for leaves) and the state/city code
+    each one-hot split tests
+    """
+    feature = tree.feature
+    kinds = np.where(feature < N_NUMERIC, feature, np.where(feature < N_NUMERIC + len(STATES), STATE_LOOKUP, CITY_LOOKUP))
+    kinds[tree.children_left < 0] = LEAF
+    codes = np.where(kinds == STATE_LOOKUP, feature - N_NUMERIC, feature - N_NUMERIC - len(STATES))
+    return kinds, codes
+
+def region_exits(kinds, codes, one_side, zero_side, root):
+    """
+    Walk a run of same-variable one-hot splits starting at root
+    Returns: ({code: exit node} for codes whose own split is on their path, default exit node)
+    """
+    kind = kinds[root]
+    exits, default = {}, None
+    stack = [(root, None)]
+    while stack:
+        node, code = stack.pop()
+        if kinds[node] != kind:
+            if code is None:
+                default = node
+            else:
+                exits[code] = node
+        elif code is None:
+            # Rows whose code is tested here go one way, every other code the other way
+            stack.append((one_side[node], codes[node]))
+            stack.append((zero_side[node], None))
+        else:
+            stack.append((one_side[node] if codes[node] == code else zero_side[node], code))
+    return exits, default
+
+def compile_tree(tree):
+    """
+    Collapse one sklearn tree into node lists (local ids, children adjacent) plus the
+    sorted (code, exit) pairs of each lookup node
+    """
+    kinds, codes = split_kinds(tree)
+    threshold32 = float32_floor(tree.threshold)
+    # One-hot column value is 1.0 for the tested code, 0.0 for every other code
+    one_side = np.where(np.float32(1.0) <= threshold32, tree.children_left, tree.children_right).tolist()
+    zero_side = np.where(np.float32(0.0) <= threshold32, tree.children_left, tree.children_right).tolist()
+    kinds, codes, threshold32 = kinds.tolist(), codes.tolist(), threshold32.tolist()
+    left, right, leaf_value = tree.children_left.tolist(), tree.children_right.tolist(), tree.value[:, 0, 0].tolist()
+
+    order, lookups = [0], []
+    nodes = {'feature': [], 'threshold': [], 'child': [], 'region': [], 'value': []}
+    # Breadth-first: a node's children (or a lookup's exits) get consecutive ids when it is visited
+    for node in order:
+        kind = kinds[node]
+        nodes['feature'].append(kind)
+        nodes['value'].append(leaf_value[node] if kind == LEAF else 0.0)
+        nodes['threshold'].append(threshold32[node] if 0 <= kind < N_NUMERIC else np.inf)
+        nodes['region'].append(-1)
+        if kind == LEAF:
+            nodes['child'].append(-1)
+        elif kind < N_NUMERIC:
+            nodes['child'].append(len(order))
+            order.extend([left[node], right[node]])
+        else:
+            exits, default = region_exits(kinds, codes, one_side, zero_side, node)
+            nodes['child'].append(len(order))
+            nodes['region'][-1] = len(lookups)
+            lookups.append([(code, len(order) + 1 + i) for i, code in enumerate(sorted(exits))])
+            order.extend([default] + [exits[code] for code in sorted(exits)])
+    return nodes, lookups
+
+def compile_forest(model):
+    """
+    Pack a fitted RandomForestRegressor (single output, trained on FEATURES) into flat arrays
+    """
+    if model.n_features_in_ != len(FEATURES):
+        raise ValueError(f"Expected a model trained on {len(FEATURES)} features, got {model.n_features_in_}")
+
+    arrays = {name: [] for name in ['feature', 'threshold', 'child', 'region', 'value']}
+    roots, keys, exits, key_offsets = [], [], [], [0]
+    node_offset, region_offset = 0, 0
+    for estimator in model.estimators_:
+        nodes, lookups = compile_tree(estimator.tree_)
+        child = np.array(nodes['child'], dtype=np.int32)
+        region = np.array(nodes['region'], dtype=np.int32)
+        child[child >= 0] += node_offset
+        region[region >= 0] += region_offset
+
+        for local_region, pairs in enumerate(lookups):
+            for code, exit_node in pairs:
+                keys.append((region_offset + local_region) * CODE_SPACE + code + 1)
+                exits.append(node_offset + exit_node)
+
+        roots.append(node_offset)
+        arrays['feature'].append(np.array(nodes['feature'], dtype=np.int8))
+        arrays['threshold'].append(np.array(nodes['threshold'], dtype=np.float32))
+        arrays['child'].append(child)
+        arrays['region'].append(region)
+        arrays['value'].append(np.array(nodes['value'], dtype=np.float64))
+        node_offset += len(child)
+        region_offset += len(lookups)
+        key_offsets.append(len(keys))
+
+    flat = {name: np.concatenate(parts) for name, parts in arrays.items()}
+    flat['roots'] = np.array(roots, dtype=np.int32)
+    flat['region_keys'] = np.array(keys, dtype=np.int64)
+    flat['region_exits'] = np.array(exits, dtype=np.int32)
+    flat['key_offsets'] = np.array(key_offsets, dtype=np.int64)
+    return flat
+
+def flat_nbytes(flat):
+    return sum(flat[name].nbytes for name in FLAT_ARRAYS)
+
+def save_flat_forest(flat, flat_dir):
+    os.makedirs(flat_dir, exist_ok=True)
+    # roots.npy is written last: a directory without it is incomplete and gets recompiled
+    for name in sorted(FLAT_ARRAYS, key=lambda name: name == 'roots'):
+        np.save(os.path.join(flat_dir, f"{name}.npy"), flat[name])
+
+def load_flat_forest(flat_dir):
+    return {name: np.load(os.path.join(flat_dir, f"{name}.npy"), mmap_mode='r') for name in FLAT_ARRAYS}
+
+def flat_forest_for(model, model_dir, version):
+    """
+    The compiled forest for a registry model, compiled on first use and stored as
+    <model_dir>/<version>/flat/*.npy (memory-mapped on later loads)
+    """
+    flat_dir = os.path.join(model_dir, version, 'flat')
+    if not os.path.exists(os.path.join(flat_dir, 'roots.npy')):
+        save_flat_forest(compile_forest(model), flat_dir)
+    return load_flat_forest(flat_dir)
+
+def compact_rows(numeric, state_code, city_code):
+    """
+    float32 row matrix the flat forest reads: numeric columns, then state code, then city code
+    """
+    rows = np.empty((len(numeric), N_NUMERIC + 2), dtype=np.float32)
+    rows[:, :N_NUMERIC] = numeric
+    rows[:, STATE_LOOKUP] = state_code
+    rows[:, CITY_LOOKUP] = city_code
+    return rows
+
+def lookup_table(flat, tree):
+    """
+    Dense (region, code + 1) -> next node table for one tree's lookup nodes
+    Returns: (table, first region id of the tree)
+    """
+    start, end = flat['roots'][tree], (flat['roots'][tree + 1] if tree + 1 < len(flat['roots']) else len(flat['feature']))
+    region, child = np.asarray(flat['region'][start:end]), np.asarray(flat['child'][start:end])
+    is_lookup = region >= 0
+    if not is_lookup.any():
+        return np.empty(0, dtype=np.int32), 0
+
+    first_region = region[is_lookup].min()
+    table = np.empty(((region.max() - first_region + 1), CODE_SPACE), dtype=np.int32)
+    table[region[is_lookup] - first_region] = child[is_lookup][:, None]
+    keys = slice(flat['key_offsets'][tree], flat['key_offsets'][tree + 1])
+    table.ravel()[np.asarray(flat['region_keys'][keys]) - first_region * CODE_SPACE] = flat['region_exits'][keys]
+    return table.ravel(), first_region
+
+def predict_tree_sums_numpy(flat, rows):
+    """
+    Sum of the leaf values over all trees for each compact row, one vectorized step per tree level
+    """
+    n, width = rows.shape
+    cells = rows.ravel()
+    feature, threshold, child, region, value = (np.asarray(flat[name]) for name in ['feature', 'threshold', 'child', 'region', 'value'])
+    totals = np.zeros(n)
+
+    for tree, root in enumerate(np.asarray(flat['roots'])):
+        table, first_region = lookup_table(flat, tree)
+        starts = np.arange(0, n * width, width)
+        nodes = np.full(n, root, dtype=np.int32)
+
+        while len(nodes) > 0:
+            node_feature = feature[nodes]
+            # Rows sitting on a leaf add its value and drop out
+            at_leaf = node_feature < 0
+            if at_leaf.any():
+                totals[starts[at_leaf] // width] += value[nodes[at_leaf]]
+                keep = ~at_leaf
+                starts, nodes, node_feature = starts[keep], nodes[keep], node_feature[keep]
+                if len(nodes) == 0:
+                    break
+
+            x = cells[starts + node_feature]
+            # Right child unless x <= threshold (NaN goes right, as in sklearn)
+            next_nodes = child[nodes] + 1 - (x <= threshold[nodes])
+            lookup = np.flatnonzero(node_feature >= STATE_LOOKUP)
+            if len(lookup) > 0:
+                codes = x[lookup].astype(np.int64) + 1
+                next_nodes[lookup] = table[(region[nodes[lookup]] - first_region) * CODE_SPACE + codes]
+            nodes = next_nodes
+
+    return totals
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _next_node(feature, threshold, child, region, table, first_region, rows, i, node):
+        x = rows[i, feature[node]]
+        if feature[node] >= STATE_LOOKUP:
+            return table[(region[node] - first_region) * CODE_SPACE + np.int64(x) + 1]
+        if x <= threshold[node]:
+            return child[node]
+        return child[node] + 1
+
+    @numba.njit(cache=True)
+    def _tree_sums_compiled(feature, threshold, child, region, value, roots, tables, table_offsets, first_regions, rows):
+        n = rows.shape[0]
+        totals = np.zeros(n)
+        for tree in range(roots.shape[0]):
+            table = tables[table_offsets[tree]:table_offsets[tree + 1]]
+            first_region = first_regions[tree]
+            root = roots[tree]
+            # Four rows walk the tree together, so their node loads overlap
+            for i in range(0, n - n % 4, 4):
+                a = b = c = d = root
+                while feature[a] >= 0 or feature[b] >= 0 or feature[c] >= 0 or feature[d] >= 0:
+                    if feature[a] >= 0:
+                        a = _next_node(feature, threshold, child, region, table, first_region, rows, i, a)
+                    if feature[b] >= 0:
+                        b = _next_node(feature, threshold, child, region, table, first_region, rows, i + 1, b)
+                    if feature[c] >= 0:
+                        c = _next_node(feature, threshold, child, region, table, first_region, rows, i + 2, c)
+                    if feature[d] >= 0:
+                        d = _next_node(feature, threshold, child, region, table, first_region, rows, i + 3, d)
+                totals[i] += value[a]
+                totals[i + 1] += value[b]
+                totals[i + 2] += value[c]
+                totals[i + 3] += value[d]
+            for i in range(n - n % 4, n):
+                node = root
+                while feature[node] >= 0:
+                    node = _next_node(feature, threshold, child, region, table, first_region, rows, i, node)
+                totals[i] += value[node]
+        return totals
+
+def predict_tree_sums(flat, rows):
+    """
+    Sum of the leaf values over all trees for each compact row (compiled loop when numba is installed)
+    """
+    if numba is None:
+        return predict_tree_sums_numpy(flat, rows)
+
+    tables = [lookup_table(flat, tree) for tree in range(len(flat['roots']))]
+    table_offsets = np.cumsum([0] + [len(table) for table, _ in tables])
+    return _tree_sums_compiled(
+        *(np.asarray(flat[name]) for name in ['feature', 'threshold', 'child', 'region', 'value', 'roots']),
+        np.concatenate([table for table, _ in tables]), table_offsets,
+        np.array([first_region for _, first_region in tables], dtype=np.int64), rows
+    )
+
+def predict_flat(flat, numeric, state_code, city_code, chunk_size=65536):
+    """
+    Forest prediction (mean over trees) from the feature cache's compact columns
+    Identical rows (same floor plan, floor and city) are scored once per chunk
+    """
+    n = len(numeric)
+    predictions = np.empty(n)
+
+    for start in range(0, n, chunk_size):
+        end = min(n, start + chunk_size)
+        rows = compact_rows(numeric[start:end], state_code[start:end], city_code[start:end])
+
+        row_keys = rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).ravel()
+        _, first, inverse = np.unique(row_keys, return_index=True, return_inverse=True)
+
+        sums = predict_tree_sums(flat, rows[first])
+        predictions[start:end] = sums[inverse.ravel()] / len(flat['roots'])
+
+    return predictions
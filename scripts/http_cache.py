@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+# On-disk HTTP response cache shared by the scrapers (scripts 1 and 2)
+#   bodies/<hh>/<sha256>        raw response bodies, content-addressed (identical payloads stored once)
+#   <endpoint>/<url hash>.json  per-URL entry: body hash, ETag / Last-Modified, fetch times, applied hash
+# A cached URL is requested with If-None-Match / If-Modified-Since, so an unchanged payload costs a
+# 304 and is served from disk. Within its endpoint's TTL it is not requested at all. The applied hash
+# is the body the caller last wrote to its output (mark_applied) - unchanged() lets a scraper skip
+# parsing a payload it has already merged.
+# Bodies are never held whole: a response is spooled to a temp file chunk by chunk while it is
+# decoded (json_stream.decode_json), and cached bodies are read back in chunks (iter_body).
+
+# Seconds a cached body is used without revalidating, per endpoint (0 = always revalidate)
+CACHE_TTLS = {
+    'sightmap': 12 * 3600,      # floor plans and unit inventories rarely change
+    'community_units': 0        # prices change daily
+}
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+def default_cache_dir(output_path):
+    """
+    http_cache/ next to a scraper's output file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(output_path)), 'http_cache')
+
+def write_atomic(path, data):
+    # Fetch threads may write entries concurrently - never leave a half-written file behind
+    tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+class BodySpool:
+    """
+    Response body written to a temp file in the cache as it streams in, hashed on the way
+    """
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        self.file = os.fdopen(fd, 'wb')
+        self.hasher = hashlib.sha256()
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.hasher.update(chunk)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class ResponseCache:
+
+    def __init__(self, cache_dir, ttls=CACHE_TTLS):
+        self.cache_dir = cache_dir
+        self.ttls = ttls
+        self.counts = {'fresh': 0, 'not_modified': 0, 'changed': 0, 'new': 0}
+        os.makedirs(os.path.join(cache_dir, 'bodies'), exist_ok=True)
+        for endpoint in ttls:
+            os.makedirs(os.path.join(cache_dir, endpoint), exist_ok=True)
+
+    def entry_path(self, url, endpoint):
+        return os.path.join(self.cache_dir, endpoint, f"{url_key(url)}.json")
+
+    def body_path(self, body_hash):
+        return os.path.join(self.cache_dir, 'bodies', body_hash[:2], body_hash)
+
+    def entry(self, url, endpoint):
+        try:
+            with open(self.entry_path(url, endpoint)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # An entry whose body is gone is as good as no entry
+        return entry if os.path.exists(self.body_path(entry['body_hash'])) else None
+
+    def save_entry(self, url, endpoint, entry):
+        write_atomic(self.entry_path(url, endpoint), json.dumps(entry).encode())
+
+    def iter_body(self, entry, chunk_size=64 * 1024):
+        with open(self.body_path(entry['body_hash']), 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def spool(self):
+        return BodySpool(os.path.join(self.cache_dir, 'bodies'))
+
+    def prepare(self, url, endpoint):
+        """
+        Look url up before requesting it
+        Returns: (entry, request headers) - headers is None when the cached body is within its TTL
+        and no request is needed
+        """
+        entry = self.entry(url, endpoint)
+        if entry is None:
+            return None, {}
+        if time.time() - entry['checked_at'] < self.ttls.get(endpoint, 0):
+            self.counts['fresh'] += 1
+            return entry, None
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return entry, headers
+
+    def revalidated(self, url, endpoint, entry):
+        """
+        Record a 304 for url: its cached body is current
+        Returns: the updated entry
+        """
+        self.counts['not_modified'] += 1
+        entry['checked_at'] = time.time()
+        self.save_entry(url, endpoint, entry)
+        return entry
+
+    def store(self, url, endpoint, entry, spool, headers):
+        """
+        Move a fully received body (spool) into the cache as url's current body, with its validators
+        Returns: the new entry
+        """
+        spool.file.close()
+        body_hash = spool.hasher.hexdigest()
+        body_path = self.body_path(body_hash)
+        if os.path.exists(body_path):
+            os.remove(spool.path)
+        else:
+            os.makedirs(os.path.dirname(body_path), exist_ok=True)
+            os.replace(spool.path, body_path)
+
+        self.counts['new' if entry is None else 'changed' if entry['body_hash'] != body_hash else 'not_modified'] += 1
+        now = time.time()
+        entry = {
+            'url': url,
+            'body_hash': body_hash,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched_at': now,
+            'checked_at': now,
+            'applied_hash': entry.get('applied_hash') if entry else None
+        }
+        self.save_entry(url, endpoint, entry)
+        return entry
+
+    def unchanged(self, entry):
+        """
+        True if entry's body is the one last marked applied (already merged into the output)
+        """
+        return entry is not None and entry['body_hash'] == entry.get('applied_hash')
+
+    def mark_applied(self, urls, endpoint):
+        """
+        Record the current body of each url as merged into the output - call after the output is saved
+        """
+        for url in urls:
+            entry = self.entry(url, endpoint)
+            if entry is not None and entry.get('applied_hash') != entry['body_hash']:
+                entry['applied_hash'] = entry['body_hash']
+                self.save_entry(url, endpoint, entry)
+
+    def summary(self):
+        return ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in self.counts.items())
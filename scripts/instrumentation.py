@@ -0,0 +1,273 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Run instrumentation for scripts 1-5
+# Every script records into the module-level RUN recorder:
+#   requests   per-host latency histogram, status codes, retries and bytes downloaded (scrapers)
+#   stages     wall seconds, calls, rows (-> rows/s) and the process peak RSS at the end of each timed step
+#   counters   any other labelled totals (e.g. response cache outcomes)
+#   models     holdout accuracy of the models a run fitted or loaded (script 4's global vs per-market models)
+# save() writes runs/<script>_<time>.json (the full run report) and <script>.prom, a Prometheus
+# textfile for node_exporter's textfile collector, under metrics/ next to the script's output.
+# Recording is a lock plus a few dict updates per request or step - nothing next to an HTTP
+# round trip or a pandas pass - so it stays on. Peak RSS is the process high-water mark
+# (getrusage), so a step's value includes every step before it; it is None where resource is unavailable.
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]     # seconds
+METRIC_PREFIX = "avb"
+
+# HELP text of the counters the scripts record (others get their name)
+COUNTER_HELP = {
+    'http_requests_total': "HTTP requests by host and status ('error' if no response)",
+    'http_bytes_total': "Response body bytes downloaded",
+    'http_retries_total': "HTTP retries (the scraper's own attempts plus the adapter's)",
+    'response_cache_total': "Response cache lookups by outcome",
+    'properties_total': "Properties by scrape outcome"
+}
+
+# HELP text of the model figures (exported as avb_model_<name>)
+MODEL_HELP = {
+    'mae': "Holdout mean absolute error",
+    'r2': "Holdout R²",
+    'adj_r2': "Holdout adjusted R²",
+    'n_test': "Holdout rows",
+    'fit_seconds': "Wall seconds of the model's fit"
+}
+
+def default_report_dir(output_path):
+    """
+    metrics/ next to a script's output file
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(output_path)), 'metrics')
+
+def json_ready(value):
+    """
+    value (dicts and lists of it too) with NaN and infinite floats as None, so it dumps as strict JSON (null)
+    """
+    if isinstance(value, dict):
+        return {key: json_ready(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_ready(item) for item in value]
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+def metered(chunks, meter):
+    """
+    Pass body chunks through, adding their length to meter['bytes']
+    """
+    for chunk in chunks:
+        meter['bytes'] += len(chunk)
+        yield chunk
+
+async def metered_async(chunks, meter):
+    async for chunk in chunks:
+        meter['bytes'] += len(chunk)
+        yield chunk
+
+def host_of(url):
+    return urlsplit(url).netloc or 'unknown'
+
+class Recorder:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.latencies = {}
+        self.stages = {}
+        self.models = []
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def request(self, url, seconds, status, nbytes=0, retries=0):
+        """
+        Record one HTTP request: latency (including the streamed body), status ('error' if none), bytes and retries
+        """
+        host = host_of(url)
+        with self.lock:
+            latency = self.latencies.setdefault(host, {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'count': 0, 'sum': 0.0, 'max': 0.0})
+            latency['buckets'][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            latency['count'] += 1
+            latency['sum'] += seconds
+            latency['max'] = max(latency['max'], seconds)
+        self.count('http_requests_total', host=host, status=str(status))
+        if nbytes:
+            self.count('http_bytes_total', nbytes, host=host)
+        if retries:
+            self.count('http_retries_total', retries, host=host)
+
+    def record_stage(self, name, seconds, rows=None):
+        """
+        Add one timed step to stage name (repeated calls, e.g. one parse per property, accumulate)
+        """
+        with self.lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'rows': None})
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            if rows is not None:
+                stage['rows'] = (stage['rows'] or 0) + rows
+            stage['peak_rss_mb'] = peak_rss_mb()
+
+    def record_model(self, figures, **labels):
+        """
+        Add a model's accuracy figures (mae, r2, ... - see MODEL_HELP) labelled e.g. model=, market=
+        """
+        with self.lock:
+            self.models.append({'labels': labels, 'figures': dict(figures)})
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Time the block as one step of stage name - set step['rows'] inside it if the count is known only then
+        """
+        step = {'rows': rows}
+        start = time.perf_counter()
+        try:
+            yield step
+        finally:
+            self.record_stage(name, time.perf_counter() - start, step['rows'])
+
+    def report(self, script):
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                stages[name] = dict(stage)
+                if stage['rows'] is not None:
+                    stages[name]['rows_per_second'] = stage['rows'] / stage['seconds'] if stage['seconds'] > 0 else None
+
+            requests = {}
+            for host, latency in self.latencies.items():
+                cumulative = 0
+                buckets = {}
+                for bound, hits in zip(LATENCY_BUCKETS + ['+Inf'], latency['buckets']):
+                    cumulative += hits
+                    buckets[str(bound)] = cumulative
+                requests[host] = {
+                    'count': latency['count'],
+                    'mean_seconds': latency['sum'] / latency['count'],
+                    'max_seconds': latency['max'],
+                    'buckets': buckets
+                }
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            models = [{'labels': dict(model['labels']), 'figures': dict(model['figures'])} for model in self.models]
+
+        finished = time.time()
+        return {
+            'script': script,
+            'started': datetime.fromtimestamp(self.started).strftime('%Y-%m-%d %H:%M:%S'),
+            'finished': datetime.fromtimestamp(finished).strftime('%Y-%m-%d %H:%M:%S'),
+            'seconds': finished - self.started,
+            'finished_timestamp': finished,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': stages,
+            'requests': requests,
+            'counters': counters,
+            'models': models
+        }
+
+    def save(self, report_dir, script):
+        """
+        Write the JSON run report and the Prometheus textfile for this run
+        Returns: path of the JSON report
+        """
+        report = self.report(script)
+        os.makedirs(os.path.join(report_dir, 'runs'), exist_ok=True)
+        stamp = datetime.fromtimestamp(report['finished_timestamp']).strftime('%Y%m%d-%H%M%S')
+        report_path = os.path.join(report_dir, 'runs', f"{script}_{stamp}.json")
+        with open(report_path, 'w') as f:
+            json.dump(json_ready(report), f, indent=2, allow_nan=False)
+
+        # The textfile collector may read at any moment - only ever rename a complete file into place
+        prom_path = os.path.join(report_dir, f"{script}.prom")
+        with open(f"{prom_path}.tmp", 'w') as f:
+            f.write(prometheus_text(report))
+        os.replace(f"{prom_path}.tmp", prom_path)
+        return report_path
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def label_text(labels):
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+def prometheus_text(report):
+    """
+    A run report in the Prometheus text exposition format (one family per metric, labelled by script)
+    """
+    script = {'script': report['script']}
+    families = {}
+
+    def add(name, kind, help_text, labels, value):
+        if value is None:
+            return
+        family = families.setdefault(f"{METRIC_PREFIX}_{name}", {'type': kind, 'help': help_text, 'samples': []})
+        family['samples'].append((labels, value))
+
+    add('run_seconds', 'gauge', "Wall seconds of the last run", script, report['seconds'])
+    add('run_finished_timestamp_seconds', 'gauge', "Unix time the last run finished", script, report['finished_timestamp'])
+    if report['peak_rss_mb'] is not None:
+        add('run_peak_rss_bytes', 'gauge', "Peak resident set size of the last run", script, report['peak_rss_mb'] * 1e6)
+
+    for name, stage in report['stages'].items():
+        labels = {**script, 'stage': name}
+        add('stage_seconds', 'gauge', "Wall seconds spent in a stage", labels, stage['seconds'])
+        add('stage_calls', 'gauge', "Timed steps in a stage", labels, stage['calls'])
+        add('stage_rows', 'gauge', "Rows processed by a stage", labels, stage['rows'])
+        add('stage_rows_per_second', 'gauge', "Rows per second of a stage", labels, stage.get('rows_per_second'))
+        if stage['peak_rss_mb'] is not None:
+            add('stage_peak_rss_bytes', 'gauge', "Process peak RSS at the end of a stage", labels, stage['peak_rss_mb'] * 1e6)
+
+    for host, latency in report['requests'].items():
+        labels = {**script, 'host': host}
+        for bound, cumulative in latency['buckets'].items():
+            add('http_request_duration_seconds_bucket', 'histogram', "HTTP request latency", {**labels, 'le': bound}, cumulative)
+        add('http_request_duration_seconds_sum', 'histogram', "HTTP request latency", labels, latency['mean_seconds'] * latency['count'])
+        add('http_request_duration_seconds_count', 'histogram', "HTTP request latency", labels, latency['count'])
+
+    for counter in report['counters']:
+        add(counter['name'], 'counter', COUNTER_HELP.get(counter['name'], counter['name']), {**script, **counter['labels']},
+            counter['value'])
+
+    for model in report['models']:
+        for name, value in model['figures'].items():
+            add(f"model_{name}", 'gauge', MODEL_HELP.get(name, name), {**script, **model['labels']}, value)
+
+    lines = []
+    for name, family in families.items():
+        # The _bucket/_sum/_count series share one histogram family header
+        base = name.rsplit('_', 1)[0] if family['type'] == 'histogram' else name
+        if family['type'] != 'histogram' or name.endswith('_bucket'):
+            lines.append(f"# HELP {base} {family['help']}")
+            lines.append(f"# TYPE {base} {family['type']}")
+        for labels, value in family['samples']:
+            # NaN (e.g. adjusted R² of a holdout smaller than the feature count) is valid here, unlike in JSON
+            lines.append(f"{name}{label_text(labels)} {'NaN' if value != value else value}")
+    return '\n'.join(lines) + '\n'
+
+# The recorder of the running script
+RUN = Recorder()
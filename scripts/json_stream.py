@@ -0,0 +1,151 @@
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Incremental decoding of the scrapers' API responses
+# Body chunks are pushed into an ijson parser as they arrive, and only the fields the parsers use
+# are kept from each item of the streamed arrays (sightmap units/floor_plans/floors, community
+# units). Peak memory per request is then one item plus the kept fields, instead of the whole
+# body plus its full object tree. Without ijson installed, or with fields=None, the chunks are
+# joined and decoded with json.loads as before.
+#
+# fields maps an ijson prefix to the keys kept from each value at it (None keeps the whole value):
+#   {'data.asset.name': None, 'data.units.item': ['id', 'area']}
+#   -> {'data': {'asset': {'name': ...}, 'units': [{'id': ..., 'area': ...}, ...]}}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class ProjectedDecoder:
+    """
+    Push-style decoder: feed() body chunks in order, close() returns the projected document
+    """
+
+    def __init__(self, fields):
+        self.fields = {prefix: None if keys is None else set(keys) for prefix, keys in fields.items()}
+        self.events = ijson.sendable_list()
+        # use_float: numbers come back as int/float, like json.loads (not Decimal)
+        self.parser = ijson.parse_coro(self.events, use_float=True)
+        self.result = {}
+        self.builder = None
+        self.item_prefix = None
+        self.item_keys = None
+        self.depth = 0
+        self.skipping = False
+
+    def add(self, prefix, value):
+        keys = self.fields[prefix]
+        if keys is not None and isinstance(value, dict):
+            value = {key: value[key] for key in keys if key in value}
+
+        path = prefix.split('.')
+        append = path[-1] == 'item'
+        if append:
+            path = path[:-1]
+        node = self.result
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        if append:
+            node.setdefault(path[-1], []).append(value)
+        else:
+            node[path[-1]] = value
+
+    def consume(self):
+        for prefix, event, value in self.events:
+            if self.builder is not None:
+                # Inside a kept item: build it, and hand it over when its closing event arrives.
+                # Values of keys outside the projection are skipped here rather than built and dropped
+                if self.skipping:
+                    if event in ('start_map', 'start_array'):
+                        self.depth += 1
+                    elif event in ('end_map', 'end_array'):
+                        self.depth -= 1
+                    if self.depth == 1 and event not in ('start_map', 'start_array'):
+                        self.skipping = False
+                    continue
+                if event == 'map_key' and self.depth == 1 and self.item_keys is not None and value not in self.item_keys:
+                    self.skipping = True
+                    continue
+                self.builder.event(event, value)
+                if event in ('start_map', 'start_array'):
+                    self.depth += 1
+                elif event in ('end_map', 'end_array'):
+                    self.depth -= 1
+                    if self.depth == 0:
+                        self.add(self.item_prefix, self.builder.value)
+                        self.builder = None
+            elif prefix in self.fields:
+                if event in ('start_map', 'start_array'):
+                    self.builder = ijson.ObjectBuilder()
+                    self.builder.event(event, value)
+                    self.item_prefix = prefix
+                    self.item_keys = self.fields[prefix]
+                    self.depth = 1
+                elif event != 'map_key':
+                    self.add(prefix, value)
+            elif event == 'start_array' and f"{prefix}.item" in self.fields:
+                # An empty array still shows up as an empty list
+                path = prefix.split('.')
+                node = self.result
+                for part in path[:-1]:
+                    node = node.setdefault(part, {})
+                node.setdefault(path[-1], [])
+        del self.events[:]
+
+    def feed(self, chunk):
+        self.parser.send(chunk)
+        self.consume()
+
+    def close(self):
+        self.parser.close()
+        self.consume()
+        return self.result
+
+def failed(e, spool):
+    """
+    Drop the partial spool and report ijson's errors as json.JSONDecodeError, like json.loads
+    """
+    if spool:
+        spool.discard()
+    if ijson is not None and isinstance(e, ijson.JSONError):
+        raise json.JSONDecodeError(str(e), '', 0) from e
+    raise e
+
+def decode_json(chunks, fields=None, spool=None):
+    """
+    Decode a JSON body from an iterable of byte chunks, also writing them to spool (http_cache) if given
+    Raises: json.JSONDecodeError for a malformed or incomplete body, whichever decoder ran
+    """
+    decoder = ProjectedDecoder(fields) if fields is not None and ijson is not None else None
+    body = bytearray()
+    try:
+        for chunk in chunks:
+            if spool:
+                spool.write(chunk)
+            if decoder:
+                decoder.feed(chunk)
+            else:
+                body += chunk
+        return decoder.close() if decoder else json.loads(body)
+    except BaseException as e:
+        failed(e, spool)
+
+async def decode_json_async(chunks, fields=None, spool=None):
+    """
+    decode_json for an async iterable of chunks (aiohttp's response.content.iter_chunked)
+    """
+    decoder = ProjectedDecoder(fields) if fields is not None and ijson is not None else None
+    body = bytearray()
+    try:
+        async for chunk in chunks:
+            if spool:
+                spool.write(chunk)
+            if decoder:
+                decoder.feed(chunk)
+            else:
+                body += chunk
+        return decoder.close() if decoder else json.loads(body)
+    except BaseException as e:
+        failed(e, spool)
@@ -0,0 +1,236 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from features import (FEATURES, STATES, CITIES, CACHE_ARRAYS, STATE_INDEX, CITY_INDEX, feature_cache_dir,
+                      load_feature_cache, matrix_rows)
+from model_registry import (MODEL_PARAMS, default_model_dir, holdout_split, load_model, model_version,
+                            prediction_metrics, read_meta, save_model, training_data_hash)
+from instrumentation import RUN
+
+# Per-market models: one forest per market - a state (SEGMENT_BY = "state") or a metro cluster
+# ("metro": METROS, with the rest of each state as its own market) - next to the global model.
+# Each market's forest trains on the market's rows of the global model's 80/20 split and is saved in
+# the model registry as its own version, keyed by those rows: a run where only one market's prices
+# changed refits that market alone (a new draw of the split - the number of priced rows changed -
+# refits every market, as it does the global model). Market fits run in parallel, one process per
+# market, with the feature cache arrays memory-mapped in each worker.
+# Rows are routed to their market's model; markets with fewer than MIN_SEGMENT_ROWS priced training
+# rows, and rows outside every market, are scored by the global model. Market models keep the global
+# feature columns (FEATURES), so the same encoding and flat_forest.py compilation apply.
+
+SEGMENT_BY = "state"
+MIN_SEGMENT_ROWS = 500
+SEGMENT_WORKERS = os.cpu_count()
+
+# Metro clusters: {name: {state: [cities]}} - cities of a state not listed in any cluster stay in the state's market
+METROS = {
+    'bay_area': {'california': ['San_Francisco', 'San_Jose', 'Sunnyvale', 'Mountain_View', 'Fremont', 'Dublin',
+                                'Pleasanton', 'Walnut_Creek', 'Emeryville', 'Foster_City', 'San_Bruno', 'Pacifica',
+                                'Lafayette']},
+    'los_angeles': {'california': ['Agoura_Hills', 'Artesia', 'Brea', 'Burbank', 'Calabasas', 'Camarillo',
+                                   'Canoga_Park', 'Chino_Hills', 'Costa_Mesa', 'Encino', 'Glendale', 'Glendora',
+                                   'Huntington_Beach', 'Irvine', 'Lake_Forest', 'Los_Angeles', 'Monrovia', 'Pasadena',
+                                   'Pomona', 'Rancho_Santa_Margarita', 'San_Dimas', 'Santa_Monica', 'Seal_Beach',
+                                   'Studio_City', 'Thousand_Oaks', 'West_Hollywood', 'Woodland_Hills']},
+    'san_diego': {'california': ['La_Mesa', 'San_Diego', 'San_Marcos', 'Vista']},
+    'washington_dc': {'district_of_columbia': ['Washington'],
+                      'virginia': ['Alexandria', 'Arlington', 'Fairfax_County', 'Falls_Church', 'Herndon',
+                                   'Merrifield', 'Reston', 'Tysons_Corner'],
+                      'maryland': ['North_Bethesda', 'North_Potomac', 'Rockville', 'Silver_Spring', 'Wheaton']},
+    'new_york_city': {'new_york': ['New_York_City', 'Brooklyn', 'Long_Island_City', 'Long_Island', 'Yonkers',
+                                   'White_Plains', 'Harrison', 'Great_Neck', 'Garden_City', 'Melville',
+                                   'Rockville_Centre', 'Smithtown', 'Huntington_Station', 'Westbury', 'Somers'],
+                      'new_jersey': ['Jersey_City', 'Hoboken', 'North_Bergen', 'Union_City', 'Edgewater', 'Teaneck']},
+    'austin': {'texas': ['Austin', 'Georgetown', 'Pflugerville']}
+}
+
+def market_names(segment_by=SEGMENT_BY):
+    """
+    Market of each market code (the codes segment_codes returns)
+    """
+    if segment_by == "metro":
+        return list(METROS) + STATES
+    if segment_by == "state":
+        return list(STATES)
+    raise ValueError(f"Unknown SEGMENT_BY {segment_by!r} (expected 'state' or 'metro')")
+
+def metro_table():
+    """
+    (state code, city code) -> metro code, -1 for the cities no metro lists
+    """
+    table = np.full((len(STATES), len(CITIES)), -1, dtype=np.int16)
+    for code, markets in enumerate(METROS.values()):
+        for state, cities in markets.items():
+            for city in cities:
+                table[STATE_INDEX[state], CITY_INDEX[city.lower()]] = code
+    return table
+
+def segment_codes(state_code, city_code, segment_by=SEGMENT_BY):
+    """
+    Market code of each row (position in market_names(segment_by), -1 if not an AVB state)
+    """
+    states = np.asarray(state_code, dtype=np.int16)
+    if segment_by == "state":
+        return states
+    if segment_by != "metro":
+        raise ValueError(f"Unknown SEGMENT_BY {segment_by!r} (expected 'state' or 'metro')")
+    cities = np.asarray(city_code, dtype=np.int16)
+    codes = np.where(states >= 0, states + len(METROS), -1).astype(np.int16)
+    known = (states >= 0) & (cities >= 0)
+    metros = np.full(len(states), -1, dtype=np.int16)
+    metros[known] = metro_table()[states[known], cities[known]]
+    return np.where(metros >= 0, metros, codes).astype(np.int16)
+
+class MarketModels:
+    """
+    The global model plus one model per market - each row is scored by its market's model, rows of
+    the markets without one by the global model
+    """
+
+    def __init__(self, segment_by, fallback, models):
+        self.segment_by = segment_by
+        self.fallback = fallback        # (model, version)
+        self.models = models            # {market code: (model, version)}
+
+    def predict(self, feature_cache, rows, score):
+        """
+        Predictions for feature cache rows (a slice or row numbers), from score(model, version, row numbers)
+        called once per model on its share of the rows
+        """
+        rows = np.arange(*rows.indices(len(feature_cache['price']))) if isinstance(rows, slice) else np.asarray(rows)
+        codes = segment_codes(feature_cache['state_code'][rows], feature_cache['city_code'][rows], self.segment_by)
+        predicted = np.empty(len(rows))
+        fallback_rows = np.ones(len(rows), dtype=bool)
+        for code, (model, version) in self.models.items():
+            in_market = codes == code
+            if in_market.any():
+                predicted[in_market] = score(model, version, rows[in_market])
+                fallback_rows &= ~in_market
+        if fallback_rows.any():
+            predicted[fallback_rows] = score(*self.fallback, rows[fallback_rows])
+        return predicted
+
+_cache = {}
+
+def load_cache_arrays(cache_dir):
+    """
+    Worker initializer: map the feature cache arrays once per process
+    """
+    for name in CACHE_ARRAYS:
+        _cache[name] = np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode='r')
+
+def fit_market(meta, train_rows, test_rows, params, n_jobs, model_dir):
+    """
+    Fit and save one market's model (in a worker process)
+    Returns: its meta
+    """
+    X_train, y_train = matrix_rows(_cache, train_rows, False), np.asarray(_cache['price'][train_rows])
+    model = RandomForestRegressor(**params, n_jobs=n_jobs)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    predicted = model.predict(matrix_rows(_cache, test_rows))
+    meta = {
+        **meta,
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'metrics': prediction_metrics(np.asarray(_cache['price'][test_rows]), predicted, X_train.shape[1]),
+        'fit_seconds': fit_seconds
+    }
+    # Not the latest version - that stays the global model the other scripts load
+    save_model(model, meta, model_dir, latest=False)
+    return meta
+
+def train_or_load_markets(source_path, fallback, segment_by=SEGMENT_BY, model_dir=None, params=MODEL_PARAMS,
+                          feature_cache=None, min_rows=MIN_SEGMENT_ROWS, workers=SEGMENT_WORKERS):
+    """
+    A model for every market with at least min_rows priced training rows - loaded from the registry if the
+    market's rows have been fitted before, otherwise fitted in parallel and saved. fallback is the global
+    (model, meta). The holdout metrics of the routed predictions and of the global model, overall and per
+    market, go into the run report (RUN.record_model)
+    Returns: (MarketModels, {'global': metrics, 'markets': metrics})
+    """
+    model_dir = model_dir or default_model_dir(source_path)
+    feature_cache = feature_cache if feature_cache is not None else load_feature_cache(source_path)
+    names = market_names(segment_by)
+    train_rows, test_rows = holdout_split(feature_cache)
+    train_codes = segment_codes(feature_cache['state_code'][train_rows], feature_cache['city_code'][train_rows], segment_by)
+    test_codes = segment_codes(feature_cache['state_code'][test_rows], feature_cache['city_code'][test_rows], segment_by)
+
+    metas = {}
+    pending = []
+    for code, name in enumerate(names):
+        market_train, market_test = train_rows[train_codes == code], test_rows[test_codes == code]
+        if len(market_train) < min_rows:
+            continue
+        data_hash = training_data_hash(feature_cache, np.concatenate([market_train, market_test]))
+        version = model_version(data_hash, {**params, 'market': name, 'segment_by': segment_by,
+                                            'n_test': len(market_test)})
+        meta = read_meta(model_dir, version)
+        if meta is not None:
+            metas[code] = meta
+            continue
+        pending.append((code, {
+            'version': version,
+            'kind': 'market',
+            'market': name,
+            'segment_by': segment_by,
+            'source': os.path.abspath(source_path),
+            'training_data_hash': data_hash,
+            'params': params,
+            'features': FEATURES,
+            'n_train': len(market_train),
+            'n_test': len(market_test)
+        }, market_train, market_test))
+
+    print(f"{len(metas)} market models unchanged, {len(pending)} to fit")
+    if pending:
+        # Largest markets first, so the longest fits don't start last
+        pending.sort(key=lambda job: -len(job[2]))
+        workers = min(workers, len(pending))
+        n_jobs = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_cache_arrays,
+                                 initargs=(feature_cache_dir(source_path),)) as executor:
+            futures = {executor.submit(fit_market, meta, market_train, market_test, params, n_jobs, model_dir): code
+                       for code, meta, market_train, market_test in pending}
+            for future in as_completed(futures):
+                meta = future.result()
+                metas[futures[future]] = meta
+                RUN.record_stage('fit_market', meta['fit_seconds'], rows=meta['n_train'])
+                print(f"  {meta['market']}: fitted on {meta['n_train']} rows in {meta['fit_seconds']:.2f}s")
+
+    fallback_model, fallback_meta = fallback
+    market_models = MarketModels(segment_by, (fallback_model, fallback_meta['version']),
+                                 {code: (load_model(model_dir, meta['version'])[0], meta['version'])
+                                  for code, meta in sorted(metas.items())})
+
+    # Both on the global model's holdout rows, which no model trained on
+    y_test = np.asarray(feature_cache['price'][test_rows])
+    global_predicted = fallback_model.predict(matrix_rows(feature_cache, test_rows))
+    routed = market_models.predict(feature_cache, test_rows,
+                                   lambda model, version, rows: model.predict(matrix_rows(feature_cache, rows)))
+    comparison = {
+        'global': prediction_metrics(y_test, global_predicted, len(FEATURES)),
+        'markets': prediction_metrics(y_test, routed, len(FEATURES))
+    }
+    RUN.record_model({**comparison['global'], 'n_test': len(y_test)}, model='global', market='all')
+    RUN.record_model({**comparison['markets'], 'n_test': len(y_test)}, model='markets', market='all')
+
+    for code, name in enumerate(names):
+        in_market = test_codes == code
+        if not in_market.any():
+            continue
+        global_metrics = prediction_metrics(y_test[in_market], global_predicted[in_market], len(FEATURES))
+        RUN.record_model({**global_metrics, 'n_test': int(in_market.sum())}, model='global', market=name)
+        if code not in metas:
+            print(f"  {name}: global model (under {min_rows} training rows), MAE ${global_metrics['mae']:.2f}")
+            continue
+        RUN.record_model({**metas[code]['metrics'], 'n_test': metas[code]['n_test'],
+                          'fit_seconds': metas[code]['fit_seconds']}, model='market', market=name)
+        print(f"  {name}: MAE ${metas[code]['metrics']['mae']:.2f} (global ${global_metrics['mae']:.2f}), "
+              f"{metas[code]['n_train']} training rows, fit {metas[code]['fit_seconds']:.2f}s")
+
+    return market_models, comparison
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+from sklearn.model_selection import train_test_split
+from features import FEATURES, load_feature_cache, matrix_rows
+from instrumentation import RUN, json_ready
+
+# Model registry: each fitted forest is saved under <model_dir>/<version>/ as model.joblib
+# (uncompressed, so it can be loaded memory-mapped) plus meta.json with the feature list,
+# training-data hash, parameters and holdout metrics. The version is derived from the
+# training data and parameters, so scoring runs load the existing forest and a refit only
+# happens when the priced rows (or the parameters) change. latest.json points at the
+# most recently used version.
+#
+# Incremental updates (update_model) start from the latest version instead: trees fitted on the
+# recently priced rows are added by warm start, the oldest trees beyond the window are retired,
+# and the result is saved as a new version that records its parent and the full fit it grew from,
+# with the holdout metrics of both the update and that full fit.
+
+MODEL_PARAMS = {'n_estimators': 100, 'random_state': 1}
+N_JOBS = -1
+
+INCREMENTAL = {
+    'trees_per_update': 10,     # trees added per update
+    'tree_window': 100,         # newest trees kept; older ones are retired
+    'recent_days': 14,          # new trees train on rows priced within this many days of the newest price
+    'full_rebuild_days': 7      # full refit once the last full fit is this old
+}
+# Also fit a full model on the same split and record its holdout metrics and fit time - costs a full fit on
+# every update, so only for measuring the incremental mode
+COMPARE_WITH_FULL_REFIT = False
+
+def default_model_dir(source_path):
+    return os.path.join(os.path.dirname(os.path.abspath(source_path)), 'models')
+
+def training_data_hash(feature_cache, rows=None):
+    """
+    sha256 of the priced rows' features and prices (adjusted_price or unpriced rows don't count),
+    or of the given rows (row numbers)
+    """
+    train_rows = ~np.isnan(feature_cache['price']) if rows is None else rows
+    digest = hashlib.sha256(json.dumps(FEATURES).encode())
+    for name in ['numeric', 'state_code', 'city_code', 'price']:
+        digest.update(np.ascontiguousarray(feature_cache[name][train_rows]).tobytes())
+    return digest.hexdigest()
+
+def model_version(data_hash, params):
+    key = json.dumps({'data': data_hash, 'params': params}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def prediction_metrics(y_test, predicted, n_features):
+    """
+    MAE, R² and adjusted R² of predictions for a holdout set (NaN where a set is too small for them:
+    R² under 2 rows, adjusted R² unless there are more rows than n_features + 1 - saved as null)
+    """
+    n = len(y_test)
+    r2 = r2_score(y_test, predicted) if n > 1 else np.nan
+    return {
+        'mae': float(mean_absolute_error(y_test, predicted)),
+        'r2': float(r2),
+        'adj_r2': float(1 - (1 - r2) * (n - 1) / (n - n_features - 1)) if n > n_features + 1 else np.nan
+    }
+
+def evaluate(model, X_test, y_test, n_features):
+    """
+    MAE, R² and adjusted R² on a holdout set
+    """
+    return prediction_metrics(y_test, model.predict(X_test), n_features)
+
+def holdout_split(feature_cache):
+    """
+    Row numbers of the priced rows split 80/20 (train_test_split random_state=1)
+    Returns: (train rows, test rows)
+    """
+    priced = np.flatnonzero(~np.isnan(feature_cache['price']))
+    return train_test_split(priced, test_size=0.2, random_state=1)
+
+def fit_model(feature_cache, params=MODEL_PARAMS):
+    """
+    Fit on 80% of the priced rows (train_test_split random_state=1) and evaluate on the rest
+    Returns: (model, metrics, n_train, n_test)
+    """
+    train_rows, test_rows = holdout_split(feature_cache)
+    # Dense training rows - same trees as the old binary-column model (see 4_scikit.py)
+    X_train, X_test = matrix_rows(feature_cache, train_rows, False), matrix_rows(feature_cache, test_rows, False)
+    y_train, y_test = np.asarray(feature_cache['price'][train_rows]), np.asarray(feature_cache['price'][test_rows])
+    model = RandomForestRegressor(**params, n_jobs=N_JOBS)
+    with RUN.stage('fit', rows=len(y_train)):
+        model.fit(X_train, y_train)
+    return model, evaluate(model, X_test, y_test, X_train.shape[1]), len(y_train), len(y_test)
+
+def save_model(model, meta, model_dir, latest=True):
+    """
+    Save a fitted model as version meta['version'] and (latest=True) make it the latest version
+    """
+    version_dir = os.path.join(model_dir, meta['version'])
+    os.makedirs(version_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(version_dir, 'model.joblib'))
+    # meta.json is written last: a version without it is incomplete and gets refitted
+    with open(os.path.join(version_dir, 'meta.json'), 'w') as f:
+        json.dump(json_ready(meta), f, indent=2, allow_nan=False)
+    if latest:
+        set_latest(model_dir, meta['version'])
+
+def set_latest(model_dir, version):
+    tmp_path = os.path.join(model_dir, 'latest.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': version}, f)
+    os.replace(tmp_path, os.path.join(model_dir, 'latest.json'))
+
+def read_meta(model_dir, version):
+    try:
+        with open(os.path.join(model_dir, version, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+    # Metrics too small a holdout has no value for are saved as null - NaN again, as prediction_metrics returns them
+    meta['metrics'] = {name: np.nan if value is None else value for name, value in meta['metrics'].items()}
+    return meta
+
+def latest_version(model_dir):
+    try:
+        with open(os.path.join(model_dir, 'latest.json')) as f:
+            return json.load(f)['version']
+    except FileNotFoundError:
+        return None
+
+def load_model(model_dir, version=None, mmap=True):
+    """
+    Load a saved forest, memory-mapped unless it is going to be modified (latest.json's version by default)
+    Returns: (model, meta)
+    """
+    version = version or latest_version(model_dir)
+    meta = read_meta(model_dir, version)
+    model = joblib.load(os.path.join(model_dir, version, 'model.joblib'), mmap_mode='r' if mmap else None)
+    if meta['features'] != FEATURES:
+        raise ValueError(f"Model {version} was trained on a different feature list")
+    return model, meta
+
+def train_or_load(source_path, model_dir=None, params=MODEL_PARAMS, feature_cache=None):
+    """
+    The registry's model for the priced rows of source_path - loaded if this training data
+    and these parameters have been fitted before, otherwise fitted and saved
+    Returns: (model, meta)
+    """
+    model_dir = model_dir or default_model_dir(source_path)
+    feature_cache = feature_cache if feature_cache is not None else load_feature_cache(source_path)
+    data_hash = training_data_hash(feature_cache)
+    version = model_version(data_hash, params)
+
+    if read_meta(model_dir, version) is not None:
+        print(f"Loading model {version} (training data unchanged)")
+        model, meta = load_model(model_dir, version)
+        set_latest(model_dir, version)
+        return model, meta
+
+    print(f"Training model {version}...")
+    model, metrics, n_train, n_test = fit_model(feature_cache, params)
+    meta = {
+        'version': version,
+        'kind': 'full',
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'source': os.path.abspath(source_path),
+        'training_data_hash': data_hash,
+        'params': params,
+        'features': FEATURES,
+        'metrics': metrics,
+        'n_train': n_train,
+        'n_test': n_test
+    }
+    save_model(model, meta, model_dir)
+    return model, meta
+
+def update_model(source_path, model_dir=None, settings=INCREMENTAL, params=MODEL_PARAMS, feature_cache=None):
+    """
+    Grow the latest model with trees fitted on the recently priced rows (warm start) and retire
+    the oldest trees beyond settings['tree_window']. Falls back to train_or_load (a full fit)
+    when there is no model yet, the last full fit is settings['full_rebuild_days'] old, or no
+    priced rows have a scraped_date.
+    Holdout metrics use the same split as fit_model and are recorded next to those of the last full fit
+    (base) on the same rows. Both may have trained on some of those rows in earlier fits - set
+    COMPARE_WITH_FULL_REFIT for a comparison with a fresh full fit.
+    Returns: (model, meta)
+    """
+    model_dir = model_dir or default_model_dir(source_path)
+    feature_cache = feature_cache if feature_cache is not None else load_feature_cache(source_path)
+    parent_version = latest_version(model_dir)
+    parent_meta = read_meta(model_dir, parent_version) if parent_version else None
+    if parent_meta is None:
+        return train_or_load(source_path, model_dir, params, feature_cache)
+
+    base_meta = parent_meta if parent_meta.get('kind', 'full') == 'full' else read_meta(model_dir, parent_meta['base'])
+    base_age = datetime.now() - datetime.strptime(base_meta['created'], '%Y-%m-%d %H:%M:%S')
+    if base_age.days >= settings['full_rebuild_days']:
+        print(f"Scheduled full rebuild (last full fit {base_age.days} days ago)")
+        return train_or_load(source_path, model_dir, params, feature_cache)
+
+    data_hash = training_data_hash(feature_cache)
+    if parent_meta['training_data_hash'] == data_hash:
+        print(f"Loading model {parent_version} (training data unchanged)")
+        return load_model(model_dir, parent_version)
+
+    version = model_version(data_hash, {'parent': parent_version, **settings})
+    if read_meta(model_dir, version) is not None:
+        print(f"Loading model {version} (update already applied)")
+        set_latest(model_dir, version)
+        return load_model(model_dir, version)
+
+    train_rows, test_rows = holdout_split(feature_cache)
+    price_date = np.asarray(feature_cache['price_date'])
+    if np.isnan(price_date[train_rows]).all():
+        print("No scraped_date on the priced rows - fitting the full model instead")
+        return train_or_load(source_path, model_dir, params, feature_cache)
+    recent_rows = train_rows[price_date[train_rows] >= np.nanmax(price_date[train_rows]) - settings['recent_days']]
+
+    print(f"Updating model {parent_version} with {settings['trees_per_update']} trees on {len(recent_rows)} recent rows...")
+    model, _ = load_model(model_dir, parent_version, mmap=False)
+    start = time.perf_counter()
+    # A different seed per update, so the new trees don't repeat the bootstrap draws of retired ones
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + settings['trees_per_update'],
+                     random_state=int(data_hash[:8], 16), n_jobs=N_JOBS)
+    model.fit(matrix_rows(feature_cache, recent_rows, False), np.asarray(feature_cache['price'][recent_rows]))
+    model.estimators_ = model.estimators_[-settings['tree_window']:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    fit_seconds = time.perf_counter() - start
+    RUN.record_stage('fit_incremental', fit_seconds, rows=len(recent_rows))
+
+    X_test, y_test = matrix_rows(feature_cache, test_rows, False), np.asarray(feature_cache['price'][test_rows])
+    meta = {
+        'version': version,
+        'kind': 'incremental',
+        'parent': parent_version,
+        'base': base_meta['version'],
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'source': os.path.abspath(source_path),
+        'training_data_hash': data_hash,
+        'params': params,
+        'settings': settings,
+        'features': FEATURES,
+        'metrics': evaluate(model, X_test, y_test, X_test.shape[1]),
+        'n_trees': len(model.estimators_),
+        'n_recent': len(recent_rows),
+        'n_test': len(test_rows),
+        'fit_seconds': fit_seconds
+    }
+
+    # The last full fit, scored on today's holdout rows - what the update is meant to improve on
+    base_model, _ = load_model(model_dir, base_meta['version'])
+    meta['base_model'] = {'version': base_meta['version'], 'metrics': evaluate(base_model, X_test, y_test, X_test.shape[1])}
+    print(f"  MAE ${meta['metrics']['mae']:.2f} (last full fit ${meta['base_model']['metrics']['mae']:.2f}), fit {fit_seconds:.2f}s")
+
+    if COMPARE_WITH_FULL_REFIT:
+        start = time.perf_counter()
+        _, full_metrics, _, _ = fit_model(feature_cache, params)
+        meta['full_refit'] = {'metrics': full_metrics, 'fit_seconds': time.perf_counter() - start}
+        print(f"  MAE ${meta['metrics']['mae']:.2f} (full refit ${full_metrics['mae']:.2f}), "
+              f"fit {fit_seconds:.2f}s (full refit {meta['full_refit']['fit_seconds']:.2f}s)")
+
+    save_model(model, meta, model_dir)
+    return model, meta
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import pandas as pd
+from checksums import file_sha256
+
+# Pipeline runner for scripts 1-5
+# Every stage declares the files it reads and writes (names in FILES, under data_dir). Before a
+# stage runs, its inputs are fingerprinted and compared with the fingerprints recorded when it
+# last succeeded - a stage whose inputs, outputs and schedule are all unchanged is skipped.
+# A file a stage also writes is recorded as the stage left it, so a stage never invalidates
+# itself, and columns listed in an input's exclusions (written by a later stage, e.g. script
+# 4's adjusted_price) are left out of its fingerprint. Stages that share no written file run in
+# parallel (the two scrapes); the others wait for the earlier stages that write their files.
+# Scrapes read the live APIs, so they also rerun once their refresh interval has passed.
+# Each stage runs its script in a subprocess with the paths set as the script's globals and its
+# output in <data_dir>/pipeline/logs/<stage>.log; state.json there holds the fingerprints.
+# The scripts are expected in their default "csv" output modes.
+
+# Remove # Below - and change directory location
+#data_dir = "[insert directory path]/data"
+
+FILES = {
+    'property_urls': 'property_urls.csv',
+    'complete_portfolio': 'complete_portfolio.csv',
+    'currently_available': 'currently_available.csv',
+    'missing_predictions': 'missing_properties_predictions.csv'
+}
+
+# inputs: {file: columns left out of the fingerprint (None = the whole file)}
+# paths: {script global: file} - the path constants each script expects
+# refresh: seconds after which a stage reruns even with unchanged inputs (None = only when inputs change)
+STAGES = [
+    {'name': 'scrape_portfolio', 'script': '1_scrape_complete_portfolio.py',
+     'inputs': {'property_urls': None},
+     'outputs': ['complete_portfolio'],
+     'paths': {'file_link': 'property_urls', 'output_file': 'complete_portfolio'},
+     'refresh': 7 * 24 * 3600},       # floor plans and unit inventories rarely change
+    {'name': 'scrape_available', 'script': '2_currently_available.py',
+     'inputs': {'property_urls': None},
+     'outputs': ['currently_available'],
+     'paths': {'file_path': 'property_urls', 'output_file': 'currently_available'},
+     'refresh': 0},                   # prices change daily - every run
+    {'name': 'merge', 'script': '3_available_to_complete_portfolio.py',
+     'inputs': {'complete_portfolio': ['adjusted_price'], 'currently_available': None},
+     'outputs': ['complete_portfolio'],
+     'paths': {'currently_available': 'currently_available', 'output_path': 'complete_portfolio'},
+     'refresh': None},
+    {'name': 'train_predict', 'script': '4_scikit.py',
+     'inputs': {'complete_portfolio': ['adjusted_price']},
+     'outputs': ['complete_portfolio'],
+     'paths': {'file_path': 'complete_portfolio'},
+     'refresh': None},
+    {'name': 'missing_revenue', 'script': '5_scikit_missing.py',
+     'inputs': {'complete_portfolio': ['adjusted_price'],
+                'missing_predictions': ['avg_rent', 'monthly_revenue', 'annual_revenue']},
+     'outputs': ['missing_predictions'],
+     'paths': {'all_properties_path': 'complete_portfolio', 'predictions_path': 'missing_predictions'},
+     'refresh': None}
+]
+
+# Stages run regardless of their fingerprints (e.g. ['train_predict'])
+FORCE_STAGES = []
+
+# Report what would run without running it
+DRY_RUN = False
+
+PIPELINE_WORKERS = 2
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs a script as __main__ with the path globals set before its first line executes
+BOOTSTRAP = ("import json, runpy, sys; sys.path.insert(0, sys.argv[1]); "
+             "runpy.run_path(sys.argv[2], init_globals=json.loads(sys.argv[3]), run_name='__main__')")
+
+def file_path(data_dir, name):
+    return os.path.join(data_dir, FILES[name])
+
+def fingerprint(path, exclude=None):
+    """
+    sha256 of a file, or with exclude, of its other columns' values (so edits to the excluded columns do not count)
+    Returns: hex digest, or None if the file does not exist
+    """
+    if not os.path.exists(path):
+        return None
+    if not exclude:
+        return file_sha256(path)
+
+    df = pd.read_csv(path, dtype=str, keep_default_na=False, low_memory=False, usecols=lambda col: col not in exclude)
+    digest = hashlib.sha256(json.dumps(list(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def input_fingerprints(stage, data_dir):
+    return {name: fingerprint(file_path(data_dir, name), exclude) for name, exclude in stage['inputs'].items()}
+
+def load_state(state_dir):
+    try:
+        with open(os.path.join(state_dir, 'state.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_state(state_dir, state):
+    tmp_path = os.path.join(state_dir, 'state.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(state_dir, 'state.json'))
+
+def dependencies(stages=STAGES):
+    """
+    For each stage, the earlier stages that write a file it reads or writes
+    """
+    deps = {}
+    for i, stage in enumerate(stages):
+        touched = set(stage['inputs']) | set(stage['outputs'])
+        deps[stage['name']] = [earlier['name'] for earlier in stages[:i] if touched & set(earlier['outputs'])]
+    return deps
+
+def stale_reason(stage, record, inputs, data_dir):
+    """
+    Why stage has to run, or None if its last successful run still holds
+    """
+    if stage['name'] in FORCE_STAGES:
+        return "forced"
+    if record is None:
+        return "never run"
+    changed = [name for name, value in inputs.items() if record['inputs'].get(name) != value]
+    if changed:
+        return f"changed: {', '.join(changed)}"
+    missing = [name for name in stage['outputs'] if not os.path.exists(file_path(data_dir, name))]
+    if missing:
+        return f"missing: {', '.join(missing)}"
+    if stage['refresh'] is not None and time.time() - record['finished'] >= stage['refresh']:
+        return "refresh due"
+    return None
+
+def run_stage(stage, data_dir, log_dir):
+    """
+    Run one stage's script in a subprocess, its output going to <log_dir>/<stage>.log
+    Returns: (succeeded, seconds)
+    """
+    paths = {name: file_path(data_dir, file) for name, file in stage['paths'].items()}
+    command = [sys.executable, '-c', BOOTSTRAP, SCRIPTS_DIR, os.path.join(SCRIPTS_DIR, stage['script']), json.dumps(paths)]
+    start = time.perf_counter()
+    with open(os.path.join(log_dir, f"{stage['name']}.log"), 'w') as log:
+        result = subprocess.run(command, cwd=data_dir, stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode == 0, time.perf_counter() - start
+
+def run_pipeline(data_dir, stages=STAGES, workers=PIPELINE_WORKERS):
+    """
+    Run every stale stage in dependency order, independent stages in parallel
+    Returns: {stage: 'ran' | 'skipped' | 'failed' | 'blocked' | 'would run'}
+    """
+    state_dir = os.path.join(data_dir, 'pipeline')
+    log_dir = os.path.join(state_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    state = load_state(state_dir)
+    deps = dependencies(stages)
+    outcome = {}
+    running = {}
+
+    def start(stage):
+        inputs = input_fingerprints(stage, data_dir)
+        reason = stale_reason(stage, state.get(stage['name']), inputs, data_dir)
+        if reason is None and DRY_RUN and any(outcome[dep] == 'would run' for dep in deps[stage['name']]):
+            reason = "upstream would run"
+        if reason is None:
+            print(f"= {stage['name']} → unchanged, skipped")
+            outcome[stage['name']] = 'skipped'
+        elif DRY_RUN:
+            print(f"~ {stage['name']} → would run ({reason})")
+            outcome[stage['name']] = 'would run'
+        else:
+            print(f"▶ {stage['name']} ({reason})")
+            running[executor.submit(run_stage, stage, data_dir, log_dir)] = (stage, inputs)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(outcome) < len(stages):
+            for stage in stages:
+                name = stage['name']
+                if name in outcome or any(s['name'] == name for s, _ in running.values()):
+                    continue
+                if any(outcome.get(dep) in ('failed', 'blocked') for dep in deps[name]):
+                    print(f"✗ {name} → blocked by a failed stage")
+                    outcome[name] = 'blocked'
+                elif all(dep in outcome for dep in deps[name]):
+                    start(stage)
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, inputs = running.pop(future)
+                succeeded, seconds = future.result()
+                if not succeeded:
+                    print(f"✗ {stage['name']} → failed after {seconds:.1f}s (see {log_dir}/{stage['name']}.log)")
+                    outcome[stage['name']] = 'failed'
+                    continue
+
+                # Files the stage rewrote are recorded as it left them, so its own writes do not make it stale
+                for name in set(stage['inputs']) & set(stage['outputs']):
+                    inputs[name] = fingerprint(file_path(data_dir, name), stage['inputs'][name])
+                state[stage['name']] = {
+                    'inputs': inputs,
+                    'finished': time.time(),
+                    'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'seconds': round(seconds, 1)
+                }
+                save_state(state_dir, state)
+                print(f"✓ {stage['name']} → done in {seconds:.1f}s")
+                outcome[stage['name']] = 'ran'
+
+    return outcome
+
+def main():
+    print(f"Pipeline in {data_dir}\n")
+    start = time.perf_counter()
+    outcome = run_pipeline(data_dir)
+    counts = {status: list(outcome.values()).count(status) for status in ['ran', 'skipped', 'failed', 'blocked', 'would run']}
+    print(f"\nFinished in {time.perf_counter() - start:.1f}s: " +
+          ', '.join(f"{count} {status}" for status, count in counts.items() if count))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import json
+import os
+import re
+import pandas as pd
+import schema
+
+# Append-only price log for the currently-available scrape (script 2, OUTPUT_MODE = "log")
+#   segments/<seq>.units.csv   attributes of the units first seen by scrape <seq>
+#   segments/<seq>.obs.csv     one (key, observed, price) record per unit observed by scrape <seq>
+#   snapshot-<seq>.csv         current state of every unit, folded from all segments up to <seq>
+#   history/<seq>.csv          price changes folded by the compaction up to <seq>
+#   state.json                 {"compacted_through": <seq>} - the snapshot in use
+# A scrape only writes its own segment, so its cost follows the number of units observed, not
+# the size of the table. compact() folds the pending segments into a new snapshot and history
+# file and then removes them; until then every view folds them in on read. Current price,
+# first_seen / last_seen, days_on_market and the price history all come from the log, and
+# export_csv() writes the same currently_available.csv layout as the other output modes.
+
+KEY_COLUMNS = ['apt_complex', 'apt_name', 'apt_id']
+UNIT_ATTRIBUTES = ['state', 'city', 'apt_complex', 'block_id', 'apt_id', 'apt_name', 'bed_count', 'bath_count',
+                   'sqft', 'floor', 'floor_plan_id', 'unit_number', 'web_url']
+OBSERVATION_COLUMNS = ['key', 'observed', 'price']
+SNAPSHOT_COLUMNS = ['key'] + UNIT_ATTRIBUTES + ['price', 'adjusted_price', 'first_seen', 'last_seen']
+
+SEGMENT_NAME = re.compile(r'^(\d{8})\.obs\.csv$')
+
+def unit_key(df):
+    """
+    Composite key string (apt_complex|apt_name|apt_id) for every row - as script 2's unit_keys
+    """
+    return df['apt_complex'].astype(str) + '|' + df['apt_name'].astype(str) + '|' + df['apt_id'].astype(str)
+
+def write_csv(df, path, table=None):
+    # Temp file + rename: a crash mid-write never leaves a partial segment or snapshot
+    tmp_path = f"{path}.tmp"
+    if table:
+        schema.to_csv(df, table, tmp_path)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def read_csv(path, columns):
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns)
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def load_state(log_dir):
+    try:
+        with open(os.path.join(log_dir, 'state.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'compacted_through': 0}
+
+def save_state(log_dir, state):
+    tmp_path = os.path.join(log_dir, 'state.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, os.path.join(log_dir, 'state.json'))
+
+def pending_segments(log_dir):
+    """
+    Sequence numbers of the complete segments not yet folded into the snapshot, oldest first
+    """
+    segment_dir = os.path.join(log_dir, 'segments')
+    if not os.path.isdir(segment_dir):
+        return []
+    through = load_state(log_dir)['compacted_through']
+    seqs = [int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(segment_dir)) if match]
+    return sorted(seq for seq in seqs if seq > through)
+
+def segment_path(log_dir, seq, kind):
+    return os.path.join(log_dir, 'segments', f"{seq:08d}.{kind}.csv")
+
+def load_snapshot(log_dir):
+    through = load_state(log_dir)['compacted_through']
+    return read_csv(os.path.join(log_dir, f"snapshot-{through:08d}.csv"), SNAPSHOT_COLUMNS)
+
+def known_keys(log_dir):
+    """
+    Keys of every unit in the snapshot or a pending segment
+    """
+    through = load_state(log_dir)['compacted_through']
+    snapshot_path = os.path.join(log_dir, f"snapshot-{through:08d}.csv")
+    keys = set()
+    if os.path.exists(snapshot_path):
+        keys.update(pd.read_csv(snapshot_path, dtype=str, usecols=['key'], keep_default_na=False)['key'])
+    for seq in pending_segments(log_dir):
+        keys.update(read_csv(segment_path(log_dir, seq, 'units'), ['key'])['key'])
+    return keys
+
+def append_scrape(log_dir, new_data):
+    """
+    Append one scrape (script 2's priced units, with last_seen as the observation time) as a new segment
+    Returns: (number of units seen for the first time, number of known units observed again)
+    """
+    os.makedirs(os.path.join(log_dir, 'segments'), exist_ok=True)
+    keys = unit_key(new_data)
+    # A unit listed twice in one scrape keeps its last observation, like the keyed upsert
+    latest = ~keys.duplicated(keep='last')
+    new_data, keys = new_data[latest], keys[latest]
+
+    is_new = ~keys.isin(known_keys(log_dir))
+    pending = pending_segments(log_dir)
+    seq = max(pending + [load_state(log_dir)['compacted_through']]) + 1
+
+    units = new_data.loc[is_new, UNIT_ATTRIBUTES].copy()
+    units.insert(0, 'key', keys[is_new])
+    observations = pd.DataFrame({'key': keys, 'observed': new_data['last_seen'], 'price': new_data['price']})
+
+    # The obs file marks the segment complete, so it is written last. Both in the schema's text form, which
+    # the log compares prices in
+    write_csv(units, segment_path(log_dir, seq, 'units'), 'currently_available')
+    write_csv(observations, segment_path(log_dir, seq, 'obs'), 'currently_available')
+    return int(is_new.sum()), int((~is_new).sum())
+
+def fold(snapshot, units, observations):
+    """
+    Apply observations (in log order) to a snapshot: new units are added with their first observation as first_seen;
+    every observed unit takes its latest price and last_seen
+    Returns: (new snapshot, price changes as key/observed/price rows)
+    """
+    first = observations.drop_duplicates('key', keep='first').set_index('key')
+    last = observations.drop_duplicates('key', keep='last').set_index('key')
+
+    added = units.drop_duplicates('key')
+    added = added[~added['key'].isin(snapshot['key'])].copy()
+    added['adjusted_price'] = ''
+    added['first_seen'] = added['key'].map(first['observed'])
+
+    # A change is an observation whose price differs from the unit's previous one - the first
+    # observation of a unit new to the snapshot always starts its history
+    prior_price = snapshot.set_index('key')['price']
+    previous = observations.groupby('key')['price'].shift()
+    first_rows = previous.isna()
+    previous[first_rows] = observations.loc[first_rows, 'key'].map(prior_price)
+    changes = observations[previous.isna() | (observations['price'] != previous)]
+
+    snapshot = pd.concat([snapshot, added], ignore_index=True)
+    # Observations of a unit whose attributes are missing cannot be placed - skipped
+    positions = pd.Index(snapshot['key']).get_indexer(last.index)
+    found = positions >= 0
+    snapshot.loc[positions[found], 'price'] = last['price'].to_numpy()[found]
+    snapshot.loc[positions[found], 'last_seen'] = last['observed'].to_numpy()[found]
+    return snapshot[SNAPSHOT_COLUMNS], changes[OBSERVATION_COLUMNS]
+
+def read_pending(log_dir, seqs):
+    units = [read_csv(segment_path(log_dir, seq, 'units'), ['key'] + UNIT_ATTRIBUTES) for seq in seqs]
+    observations = [read_csv(segment_path(log_dir, seq, 'obs'), OBSERVATION_COLUMNS) for seq in seqs]
+    units = pd.concat(units, ignore_index=True) if units else pd.DataFrame(columns=['key'] + UNIT_ATTRIBUTES)
+    observations = pd.concat(observations, ignore_index=True) if observations else pd.DataFrame(columns=OBSERVATION_COLUMNS)
+    return units, observations
+
+def compact(log_dir):
+    """
+    Fold every pending segment into a new snapshot and history file, then remove the folded files
+    Returns: number of segments folded
+    """
+    seqs = pending_segments(log_dir)
+    if not seqs:
+        return 0
+    through = seqs[-1]
+    old = load_state(log_dir)['compacted_through']
+
+    # Leftovers of a compaction that crashed before its commit point would otherwise be counted twice
+    history_dir = os.path.join(log_dir, 'history')
+    for name in os.listdir(history_dir) if os.path.isdir(history_dir) else []:
+        if name.endswith('.csv') and int(name[:8]) > old:
+            os.remove(os.path.join(history_dir, name))
+
+    snapshot, changes = fold(load_snapshot(log_dir), *read_pending(log_dir, seqs))
+
+    os.makedirs(os.path.join(log_dir, 'history'), exist_ok=True)
+    write_csv(changes, os.path.join(log_dir, 'history', f"{through:08d}.csv"))
+    write_csv(snapshot, os.path.join(log_dir, f"snapshot-{through:08d}.csv"))
+    # Commit point: before this the old snapshot and segments are still the log
+    save_state(log_dir, {'compacted_through': through})
+
+    old_snapshot = os.path.join(log_dir, f"snapshot-{old:08d}.csv")
+    if os.path.exists(old_snapshot):
+        os.remove(old_snapshot)
+    for seq in seqs:
+        for kind in ['units', 'obs']:
+            if os.path.exists(segment_path(log_dir, seq, kind)):
+                os.remove(segment_path(log_dir, seq, kind))
+    return len(seqs)
+
+def current_view(log_dir):
+    """
+    Current state of every unit (snapshot with the pending segments folded in), in
+    currently_available.csv layout with days_on_market
+    """
+    snapshot, _ = fold(load_snapshot(log_dir), *read_pending(log_dir, pending_segments(log_dir)))
+    view = snapshot.drop(columns='key')
+    first_seen = pd.to_datetime(view['first_seen'], errors='coerce')
+    last_seen = pd.to_datetime(view['last_seen'], errors='coerce')
+    view['days_on_market'] = (last_seen - first_seen).dt.days.astype('Int64')
+    return view
+
+def price_history(log_dir):
+    """
+    Every recorded price change: key, observed, price (compacted history plus pending segments)
+    """
+    history_dir = os.path.join(log_dir, 'history')
+    files = sorted(os.listdir(history_dir)) if os.path.isdir(history_dir) else []
+    through = load_state(log_dir)['compacted_through']
+    frames = [read_csv(os.path.join(history_dir, name), OBSERVATION_COLUMNS) for name in files
+              if name.endswith('.csv') and int(name[:8]) <= through]
+    _, changes = fold(load_snapshot(log_dir), *read_pending(log_dir, pending_segments(log_dir)))
+    return pd.concat(frames + [changes], ignore_index=True)
+
+def total_units(log_dir):
+    return len(known_keys(log_dir))
+
+def export_csv(log_dir, output_path):
+    """
+    Write the current view to a single CSV (for scripts 3-5) through the currently_available schema
+    """
+    view = current_view(log_dir)
+    write_csv(view, output_path, 'currently_available')
+    return len(view)
+
+def import_csv(log_dir, csv_path):
+    """
+    Seed an empty log from an existing currently_available.csv (its first_seen/last_seen/price become the snapshot)
+    """
+    if load_state(log_dir)['compacted_through'] or pending_segments(log_dir):
+        raise ValueError(f"{log_dir} already holds a price log")
+    existing = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    existing = existing[~unit_key(existing).duplicated(keep='last')]
+    snapshot = existing.reindex(columns=SNAPSHOT_COLUMNS, fill_value='')
+    snapshot['key'] = unit_key(existing).to_numpy()
+
+    os.makedirs(os.path.join(log_dir, 'history'), exist_ok=True)
+    write_csv(pd.DataFrame({'key': snapshot['key'], 'observed': snapshot['last_seen'], 'price': snapshot['price']}),
+              os.path.join(log_dir, 'history', f"{1:08d}.csv"))
+    write_csv(snapshot, os.path.join(log_dir, f"snapshot-{1:08d}.csv"))
+    save_state(log_dir, {'compacted_through': 1})
+    return len(snapshot)
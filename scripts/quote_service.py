@@ -0,0 +1,208 @@
+import json
+import math
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from features import encode_records
+from schema import FLOOR_NUMBERS
+from model_registry import load_model
+from instrumentation import json_ready
+
+# Local rent quote service
+#   POST /quote  {"bed_count": 2, "bath_count": 2, "sqft": 1050, "floor": 3, "city": "Boston", "state": "Massachusetts"}
+#                or a list of those objects for a bulk quote
+#   GET  /health model version and batching stats
+# The forest is loaded once from the model registry. Concurrent requests are coalesced into
+# micro-batches so one predict call serves every quote waiting at that moment. Quotes are encoded
+# with encode_records, which applies the same state/city/floor encoding as build_feature_matrix
+# (used by script 4 for the portfolio predictions) without the DataFrame overhead.
+
+# Remove # Below - and change directory location
+#model_dir = "[insert file path to]/models"
+
+HOST = "127.0.0.1"
+PORT = 8750
+MAX_BATCH = 512          # max units per predict call
+BATCH_WINDOW_MS = 2      # how long the batcher waits for more quotes once one has arrived
+
+QUOTE_FIELDS = ['bed_count', 'bath_count', 'sqft', 'floor', 'city', 'state']
+
+class MicroBatcher:
+    """
+    Collects quote requests from handler threads and scores them together on one thread
+    """
+
+    def __init__(self, model, max_batch=MAX_BATCH, window_ms=BATCH_WINDOW_MS):
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.quotes = 0
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def predict(self, units):
+        """
+        Called from a handler thread: block until the units (list of dicts) are scored
+        """
+        pending = {'units': units, 'done': threading.Event(), 'result': None, 'error': None}
+        self.requests.put(pending)
+        pending['done'].wait()
+        if pending['error'] is not None:
+            raise pending['error']
+        return pending['result']
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0]['units'])
+            deadline = time.perf_counter() + self.window
+
+            # Keep collecting until the window closes or the batch is full
+            while size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                size += len(pending['units'])
+
+            self.score(batch)
+
+    def score(self, batch):
+        try:
+            prices = self.model.predict(encode_records([unit for pending in batch for unit in pending['units']]))
+        except Exception as e:
+            # Score the requests one by one, so a request that fails only fails itself
+            if len(batch) > 1:
+                for pending in batch:
+                    self.score([pending])
+                return
+            for pending in batch:
+                pending['error'] = e
+                pending['done'].set()
+            return
+
+        start = 0
+        for pending in batch:
+            end = start + len(pending['units'])
+            pending['result'] = prices[start:end].tolist()
+            start = end
+            pending['done'].set()
+
+        self.batches += 1
+        self.quotes += len(prices)
+
+class QuoteServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Bursts of concurrent clients would otherwise overflow the default listen backlog of 5
+    request_queue_size = 256
+
+def is_number(value):
+    """
+    A finite JSON number (not a bool, NaN or Infinity - json.loads accepts both literals)
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def validate_unit(unit):
+    """
+    Check one quote object has every field, with finite numeric bed/bath/sqft and floor (number, numeric string or 'GR')
+    """
+    if not isinstance(unit, dict):
+        raise ValueError("each quote must be a JSON object")
+    missing = [field for field in QUOTE_FIELDS if field not in unit]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+    for field in ['bed_count', 'bath_count', 'sqft']:
+        if not is_number(unit[field]):
+            raise ValueError(f"{field} must be a number")
+    floor = unit['floor']
+    if isinstance(floor, str) and floor not in FLOOR_NUMBERS:
+        try:
+            number = float(floor)
+        except ValueError:
+            raise ValueError("floor must be a number or 'GR'")
+        if not math.isfinite(number):
+            raise ValueError("floor must be a number or 'GR'")
+    elif not isinstance(floor, str) and not is_number(floor):
+        raise ValueError("floor must be a number or 'GR'")
+    return unit
+
+def make_handler(batcher, meta):
+
+    class QuoteHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status, body):
+            data = json.dumps(json_ready(body), allow_nan=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                self.send_json(404, {'error': 'not found'})
+                return
+            self.send_json(200, {
+                'model_version': meta['version'],
+                'metrics': meta['metrics'],
+                'batches': batcher.batches,
+                'quotes': batcher.quotes
+            })
+
+        def do_POST(self):
+            if self.path != "/quote":
+                self.send_json(404, {'error': 'not found'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                units = [validate_unit(unit) for unit in (body if isinstance(body, list) else [body])]
+            except (ValueError, TypeError) as e:
+                self.send_json(400, {'error': str(e)})
+                return
+
+            if not units:
+                self.send_json(200, {'quotes': []})
+                return
+
+            try:
+                prices = batcher.predict(units)
+            except Exception as e:
+                self.send_json(500, {'error': f"scoring failed: {e}"})
+                return
+            if isinstance(body, list):
+                self.send_json(200, {'quotes': prices, 'model_version': meta['version']})
+            else:
+                self.send_json(200, {'price': prices[0], 'model_version': meta['version']})
+
+        def log_message(self, format, *args):
+            pass
+
+    return QuoteHandler
+
+def serve(model_dir, host=HOST, port=PORT):
+    model, meta = load_model(model_dir)
+    # One thread per predict: thread-pool dispatch would cost more than scoring a small batch
+    model.set_params(n_jobs=1)
+    batcher = MicroBatcher(model)
+
+    # Score once so the first real quote doesn't pay for warm-up
+    batcher.predict([{'bed_count': 1, 'bath_count': 1, 'sqft': 700, 'floor': 1, 'city': 'Boston', 'state': 'Massachusetts'}])
+
+    server = QuoteServer((host, port), make_handler(batcher, meta))
+    print(f"✓ Serving model {meta['version']} on http://{host}:{server.server_port}/quote")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    serve(model_dir)
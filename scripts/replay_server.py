@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Local stand-in for the sightmap and community-units APIs
+#   GET /app/api/v1/<...>/sightmaps/<sightmap id>          -> <replay_dir>/sightmap/<sightmap id>.json
+#   GET /pf/api/v3/content/fetch/community-units?query=...  -> <replay_dir>/community_units/<communityId>.json
+#   GET /stats                                              outcome counts, bytes sent, requests/s
+# Payloads carry an ETag; a request with a matching If-None-Match gets a 304 (like a cached rerun).
+# replay_dir holds recorded responses or the synthetic ones written by synthetic_data.write_inputs
+# (same layout). Every response waits a latency drawn from LATENCY, and a share of them fail
+# with FAULTS, so the crawl concurrency and the retry paths of scripts 1 and 2 can be exercised
+# without touching the live sites. Point the scripts at it with their BASE_URL_OVERRIDE
+# (urls.rebase_url moves a live URL onto this server).
+
+# Remove # Below - and change directory location
+#replay_dir = "[insert file path to]/replay"
+
+HOST = "127.0.0.1"
+PORT = 8760
+SEED = None              # set for a repeatable fault sequence (per server run)
+
+# Latency before the response starts
+#   {'distribution': 'fixed', 'ms': 50}
+#   {'distribution': 'uniform', 'min_ms': 20, 'max_ms': 200}
+#   {'distribution': 'lognormal', 'median_ms': 80, 'sigma': 0.6}
+LATENCY = {'distribution': 'lognormal', 'median_ms': 80, 'sigma': 0.6}
+
+# Share of requests that get each fault (drawn once per request, in this order)
+#   status codes    the status with an empty JSON body (429 and 503 also carry Retry-After)
+#   'truncate'      chunked body cut off halfway, then the connection is closed
+#   'drip'          full body sent in DRIP_CHUNK pieces at DRIP_BYTES_PER_SEC
+FAULTS = {429: 0.02, 500: 0.01, 502: 0.0, 503: 0.01, 504: 0.0, 'truncate': 0.02, 'drip': 0.02}
+RETRY_AFTER = 1          # seconds
+DRIP_CHUNK = 1024
+DRIP_BYTES_PER_SEC = 16_384
+
+SIGHTMAP_ROUTE = re.compile(r'^/app/api/v1/.+/sightmaps/([^/]+)$')
+COMMUNITY_UNITS_ROUTE = '/pf/api/v3/content/fetch/community-units'
+
+def draw_latency(rng, latency=LATENCY):
+    """
+    Returns: seconds to wait before responding
+    """
+    kind = latency['distribution']
+    if kind == 'fixed':
+        ms = latency['ms']
+    elif kind == 'uniform':
+        ms = rng.uniform(latency['min_ms'], latency['max_ms'])
+    elif kind == 'lognormal':
+        ms = latency['median_ms'] * rng.lognormvariate(0, latency['sigma'])
+    else:
+        raise ValueError(f"unknown latency distribution: {kind}")
+    return ms / 1000
+
+def draw_fault(rng, faults=FAULTS):
+    """
+    Returns: the fault for one request (a status code, 'truncate' or 'drip'), or None
+    """
+    draw = rng.random()
+    for fault, share in faults.items():
+        if draw < share:
+            return fault
+        draw -= share
+    return None
+
+class PayloadStore:
+    """
+    Response bodies read from replay_dir on first request and kept in memory
+    """
+
+    def __init__(self, replay_dir):
+        self.replay_dir = replay_dir
+        self.bodies = {}
+
+    def get(self, kind, key):
+        # Keys come from the request - never let them leave the payload directory
+        if not key or key != os.path.basename(key):
+            return None
+        if (kind, key) not in self.bodies:
+            path = os.path.join(self.replay_dir, kind, f"{key}.json")
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as f:
+                self.bodies[(kind, key)] = f.read()
+        return self.bodies[(kind, key)]
+
+def resolve(store, path):
+    """
+    Map a request path to a recorded body
+    Returns: (route, body) - body is None when nothing is recorded, route is None for an unknown path
+    """
+    parts = urlsplit(path)
+    match = SIGHTMAP_ROUTE.match(parts.path)
+    if match:
+        return 'sightmap', store.get('sightmap', match.group(1))
+    if parts.path == COMMUNITY_UNITS_ROUTE:
+        try:
+            community_id = json.loads(parse_qs(parts.query)['query'][0])['communityId']
+        except (KeyError, IndexError, ValueError, TypeError):
+            return 'community_units', None
+        return 'community_units', store.get('community_units', community_id)
+    return None, None
+
+class ReplayStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.outcomes = {}
+        self.bytes_sent = 0
+
+    def record(self, route, outcome, nbytes=0):
+        with self.lock:
+            key = f"{route}:{outcome}"
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+            self.bytes_sent += nbytes
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            requests = sum(self.outcomes.values())
+            return {
+                'outcomes': dict(sorted(self.outcomes.items())),
+                'requests': requests,
+                'bytes_sent': self.bytes_sent,
+                'seconds': elapsed,
+                'requests_per_second': requests / elapsed if elapsed > 0 else 0.0
+            }
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The crawls open up to 20 connections at once
+    request_queue_size = 256
+
+def make_handler(store, stats, rng, latency=LATENCY, faults=FAULTS):
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_body(self, status, data, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_truncated(self, data):
+            # Announce a chunked body, send the first half as one chunk and hang up without the
+            # terminating chunk - the client sees an incomplete read / ChunkedEncodingError
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            half = data[:max(1, len(data) // 2)]
+            self.wfile.write(f"{len(half):x}\r\n".encode() + half + b"\r\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+        def send_drip(self, data):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            for start in range(0, len(data), DRIP_CHUNK):
+                self.wfile.write(data[start:start + DRIP_CHUNK])
+                self.wfile.flush()
+                time.sleep(DRIP_CHUNK / DRIP_BYTES_PER_SEC)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.send_body(200, json.dumps(stats.snapshot()).encode())
+                return
+
+            route, data = resolve(store, self.path)
+            if data is None:
+                stats.record(route or 'unknown', 404)
+                self.send_body(404, b'{"error": "not recorded"}')
+                return
+
+            time.sleep(draw_latency(rng, latency))
+            fault = draw_fault(rng, faults)
+            etag = f'"{hashlib.sha1(data).hexdigest()[:16]}"'
+            if fault is None and self.headers.get('If-None-Match') == etag:
+                self.send_body(304, b'', {'ETag': etag})
+                stats.record(route, 304)
+                return
+            try:
+                if fault is None:
+                    self.send_body(200, data, {'ETag': etag})
+                elif fault == 'truncate':
+                    self.send_truncated(data)
+                elif fault == 'drip':
+                    self.send_drip(data)
+                else:
+                    headers = {'Retry-After': str(RETRY_AFTER)} if fault in (429, 503) else None
+                    self.send_body(fault, b'{}', headers)
+            except (BrokenPipeError, ConnectionResetError):
+                # Client gave up (timeout) mid-body
+                stats.record(route, 'client_closed')
+                self.close_connection = True
+                return
+            stats.record(route, fault or 200, len(data) if fault in (None, 'drip') else 0)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+def serve(replay_dir, host=HOST, port=PORT, seed=SEED, latency=LATENCY, faults=FAULTS):
+    store = PayloadStore(replay_dir)
+    stats = ReplayStats()
+    server = ReplayServer((host, port), make_handler(store, stats, random.Random(seed), latency, faults))
+    print(f"✓ Replaying {replay_dir} on http://{host}:{server.server_port}")
+    print(f"   latency {latency}, faults {faults}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n{json.dumps(stats.snapshot(), indent=2)}")
+
+if __name__ == "__main__":
+    serve(replay_dir)
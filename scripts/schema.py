@@ -0,0 +1,237 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from checksums import file_sha256
+
+# Column schema of the pipeline tables - every script loads and saves its CSVs through read_csv() / to_csv()
+#   category   repeated labels (state, city, property, block, floor): one small code per row, each label stored once
+#   Int8..32   whole numbers (counts, sqft) as nullable ints - empty cells are <NA>, and so are cells that are
+#              not a number, not whole, or outside the type's range (nothing is rounded or fails the load)
+#   float32    measured values; float64 where float32's 7 digits are not enough (prices, revenue).
+#              Written in their shortest form, whole values without '.0' (3747, 1.5)
+#   datetime   timestamps, parsed as DATE_FORMAT (other layouts are still recognised) and written back as DATE_FORMAT
+#   str        identifiers and free text, kept as read
+# A column has the same type in every table it appears in (script 3 copies price and last_seen from
+# currently_available into complete_portfolio). Columns a table does not declare are read and written as
+# text. to_csv() writes one canonical text form per type, so a load/save round trip leaves the file unchanged.
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Typed frame cache: a whole-file read_csv() also pickles the typed frame to <path>.typed/frame.pkl, with
+# typed.json recording the file's sha256, the table's column types and the pandas version. While all three
+# are unchanged the next read unpickles the frame instead of parsing the CSV (a 400k-row portfolio: ~0.2s
+# with the hash, against ~1.5s to parse). Chunked reads always parse, and so do files under
+# TYPED_CACHE_MIN_BYTES (shards), which parse faster than they hash and unpickle.
+TYPED_CACHE = True
+TYPED_CACHE_MIN_BYTES = 1_000_000
+
+# Floor labels that stand for a floor number ('GR' ground floor) - any other non-numeric label has no number
+FLOOR_NUMBERS = {'GR': 0}
+
+UNIT_COLUMNS = {
+    'state': 'category',
+    'city': 'category',
+    'apt_complex': 'category',
+    'block_id': 'category',
+    'apt_id': 'str',
+    'apt_name': 'str',
+    'bed_count': 'Int8',
+    'bath_count': 'float32',        # half baths
+    'sqft': 'Int32',
+    'floor': 'category',            # labels ('GR'), see floor_numbers()
+    'floor_plan_id': 'category',
+    'unit_number': 'str',
+    'web_url': 'category',          # the property's sightmap URL in complete_portfolio
+    'price': 'float64',             # whole dollars today, but cents are kept if a listing has them
+    'adjusted_price': 'float32'
+}
+
+TABLES = {
+    'complete_portfolio': {
+        **UNIT_COLUMNS,
+        'date_scraped': 'datetime',
+        'scraped_date': 'datetime'
+    },
+    'currently_available': {
+        **UNIT_COLUMNS,
+        'first_seen': 'datetime',
+        'last_seen': 'datetime',
+        'days_on_market': 'Int16',
+        'date_scraped': 'datetime'      # files written before first_seen/last_seen
+    },
+    'property_urls': {
+        'state': 'category',
+        'city': 'category',
+        'url': 'str',
+        'Unnamed: 4': 'str',            # property name
+        'Sitemap Url': 'str',
+        'communityID': 'str'
+    },
+    'missing_predictions': {
+        'property': 'str',
+        'state': 'category',
+        'city': 'category',
+        'unit_count': 'Int32',
+        'avg_rent': 'float64',
+        'monthly_revenue': 'float64',
+        'annual_revenue': 'float64'
+    }
+}
+
+def parse_datetimes(values):
+    parsed = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    # Cells in another layout (e.g. a bare date) - empty cells come back NaT from both parses
+    other = parsed.isna() & values.notna()
+    if other.any():
+        parsed[other] = pd.to_datetime(values[other], format='mixed', errors='coerce')
+    return parsed
+
+def coerce_column(values, kind):
+    """
+    values as the schema type kind (unchanged if they already have it)
+    """
+    if kind == 'category':
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values
+        return values.where(values.isna() | (values == ''), values.astype(str)).replace('', np.nan).astype('category')
+    if kind == 'str':
+        if values.dtype == object:
+            return values
+        return values.astype(object).where(values.isna(), values.astype(str))
+    if kind == 'datetime':
+        if pd.api.types.is_datetime64_dtype(values.dtype):
+            return values
+        return parse_datetimes(values)
+    if values.dtype == kind:
+        return values
+    numbers = pd.to_numeric(values, errors='coerce')
+    if kind.startswith('Int') and not pd.api.types.is_integer_dtype(numbers.dtype):
+        # Not whole -> <NA> (no rounding); the range check below covers the rest
+        numbers = numbers.where(numbers % 1 == 0)
+    if kind.startswith('Int'):
+        limits = np.iinfo(kind.lower())
+        numbers = numbers.where(numbers.isna() | numbers.between(limits.min, limits.max))
+    return numbers.astype(kind)
+
+def coerce(df, table):
+    """
+    df with every column the table declares converted to its schema type (df itself is not modified)
+    """
+    df = df.copy(deep=False)
+    for col, kind in TABLES[table].items():
+        if col in df.columns:
+            df[col] = coerce_column(df[col], kind)
+    return df
+
+def typed_cache_dir(path):
+    return f"{path}.typed"
+
+def typed_cache_key(table, source_hash):
+    return {'sha256': source_hash, 'table': table, 'types': TABLES[table], 'pandas': pd.__version__}
+
+def read_typed_cache(path, key):
+    """
+    The cached typed frame of path, None if there is none for this key
+    """
+    cache_dir = typed_cache_dir(path)
+    try:
+        with open(os.path.join(cache_dir, 'typed.json')) as f:
+            if json.load(f) != key:
+                return None
+        return pd.read_pickle(os.path.join(cache_dir, 'frame.pkl'))
+    except FileNotFoundError:
+        return None
+
+def write_typed_cache(path, key, df):
+    cache_dir = typed_cache_dir(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # typed.json is written last: a frame without a matching one is never read
+    df.to_pickle(os.path.join(cache_dir, 'frame.pkl.tmp'))
+    os.replace(os.path.join(cache_dir, 'frame.pkl.tmp'), os.path.join(cache_dir, 'frame.pkl'))
+    with open(os.path.join(cache_dir, 'typed.json.tmp'), 'w') as f:
+        json.dump(key, f, indent=2)
+    os.replace(os.path.join(cache_dir, 'typed.json.tmp'), os.path.join(cache_dir, 'typed.json'))
+
+def parse_csv(path, table, **read_csv_kwargs):
+    # The parser builds the categories and parses the numbers and timestamps (a column with stray text
+    # comes back as objects and is converted afterwards); text and undeclared columns are read as str.
+    # The header is read first only to find the undeclared columns
+    types = TABLES[table]
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = read_csv_kwargs.get('usecols')
+    if usecols is not None:
+        header = [col for col in header if (usecols(col) if callable(usecols) else col in usecols)]
+    dtype = {col: 'category' if types.get(col) == 'category' else str
+             for col in header if types.get(col) in (None, 'category', 'str')}
+    dates = [col for col in header if types.get(col) == 'datetime']
+    reader = pd.read_csv(path, dtype=dtype, parse_dates=dates, date_format=DATE_FORMAT, **read_csv_kwargs)
+    if read_csv_kwargs.get('chunksize'):
+        return (coerce(chunk, table) for chunk in reader)
+    return coerce(reader, table)
+
+def read_csv(path, table, **read_csv_kwargs):
+    """
+    pd.read_csv of one of TABLES in its schema types (undeclared columns as text), from the typed frame
+    cache while the file is unchanged. With chunksize, an iterator of typed chunks
+    """
+    # usecols picks columns of the cached frame; other options (chunksize, nrows, ...) change what is read
+    if not TYPED_CACHE or set(read_csv_kwargs) - {'usecols', 'low_memory'} or os.path.getsize(path) < TYPED_CACHE_MIN_BYTES:
+        return parse_csv(path, table, **read_csv_kwargs)
+    key = typed_cache_key(table, file_sha256(path))
+    df = read_typed_cache(path, key)
+    usecols = read_csv_kwargs.get('usecols')
+    if df is None:
+        if usecols is not None:
+            return parse_csv(path, table, **read_csv_kwargs)
+        df = parse_csv(path, table, **read_csv_kwargs)
+        write_typed_cache(path, key, df)
+        return df
+    if usecols is None:
+        return df
+    return df[[col for col in df.columns if (usecols(col) if callable(usecols) else col in usecols)]]
+
+def float_text(values):
+    """
+    Floats in their shortest text form, whole values without '.0' (None where missing)
+    """
+    text = values.astype(str).str.replace(r'\.0$', '', regex=True)
+    return text.astype(object).where(values.notna(), None)
+
+def to_csv(df, table, path, **to_csv_kwargs):
+    """
+    Write df in the schema's text form (timestamps as DATE_FORMAT, floats as float_text, empty cells for missing values)
+    """
+    df = coerce(df, table)
+    for col in df.columns:
+        if pd.api.types.is_float_dtype(df[col].dtype):
+            df[col] = float_text(df[col])
+    df.to_csv(path, index=False, date_format=DATE_FORMAT, **to_csv_kwargs)
+
+def as_text(df):
+    """
+    df's values as the strings to_csv() writes them, None where empty - for text stores (unit_store.py)
+    """
+    text = {}
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_datetime64_dtype(values.dtype):
+            rendered = values.dt.strftime(DATE_FORMAT)
+        elif pd.api.types.is_float_dtype(values.dtype):
+            rendered = float_text(values)
+        else:
+            rendered = values.astype(str)
+        text[col] = rendered.astype(object).where(values.notna(), None)
+    return pd.DataFrame(text, index=df.index)
+
+def floor_numbers(floor):
+    """
+    Floor labels as float floor numbers ('GR' -> 0, labels that are not a number -> NaN)
+    """
+    floor = pd.Series(floor, copy=False)
+    if isinstance(floor.dtype, pd.CategoricalDtype):
+        # Once per label, then looked up by code (-1, a missing floor, picks the NaN on the end)
+        numbers = floor_numbers(floor.cat.categories.to_series()).to_numpy()
+        return pd.Series(np.append(numbers, np.nan)[floor.cat.codes], index=floor.index)
+    floor = floor.astype(object).replace(FLOOR_NUMBERS)
+    return pd.to_numeric(floor, errors='coerce').astype(np.float64)
@@ -0,0 +1,126 @@
+import json
+import os
+import re
+import pandas as pd
+import schema
+from checksums import file_sha256
+
+# Per-property output: one CSV shard per block_id plus manifest.json recording each
+# shard's file name, row count and sha256. A scrape rewrites only the shards of the
+# properties it scraped, and every file is replaced atomically (temp file + rename),
+# so a crash mid-write leaves the previous shard and manifest intact.
+
+MANIFEST_NAME = "manifest.json"
+
+def shard_file(block_id):
+    """
+    File name for a block_id's shard (anything outside [A-Za-z0-9_-] becomes '_')
+    """
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(block_id)) + ".csv"
+
+def atomic_write(path, write):
+    """
+    Call write(tmp_path), then rename tmp_path over path
+    """
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def load_manifest(shard_dir):
+    """
+    Manifest dict: {"shards": {block_id: {"file", "rows", "sha256", "updated"}}}
+    """
+    try:
+        with open(os.path.join(shard_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"shards": {}}
+
+def save_manifest(shard_dir, manifest):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    atomic_write(os.path.join(shard_dir, MANIFEST_NAME), write)
+
+def write_csv(df, path, table=None):
+    if table:
+        schema.to_csv(df, table, path)
+    else:
+        df.to_csv(path, index=False)
+
+def write_shards(df, shard_dir, table=None):
+    """
+    Write one shard per block_id present in df (replacing those shards entirely)
+    and update their manifest entries. Shards of other block_ids are not touched.
+    With table, shards are written through its schema (schema.py)
+    Returns: list of block_ids written
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    manifest = load_manifest(shard_dir)
+    updated = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    written = []
+    for block_id, shard in df.groupby(df['block_id'].astype(str), sort=False):
+        path = os.path.join(shard_dir, shard_file(block_id))
+        atomic_write(path, lambda tmp_path: write_csv(shard, tmp_path, table))
+        manifest["shards"][block_id] = {
+            "file": shard_file(block_id),
+            "rows": len(shard),
+            "sha256": file_sha256(path),
+            "updated": updated
+        }
+        written.append(block_id)
+
+    save_manifest(shard_dir, manifest)
+    return written
+
+def iter_shards(shard_dir, block_ids=None, verify=False, table=None, **read_csv_kwargs):
+    """
+    Lazily yield (block_id, DataFrame) for every shard in the manifest, or only the given block_ids
+    verify=True checks each shard against its manifest checksum. Shards are only ever renamed into place
+    whole, so a mismatch is a shard written after the last manifest save (a crash between the two): it is
+    read like any other and its manifest entry brought up to date. A shard that cannot be read raises
+    With table, shards are read in its schema types
+    """
+    manifest = load_manifest(shard_dir)
+    wanted = list(manifest["shards"]) if block_ids is None else [str(b) for b in block_ids]
+
+    for block_id in wanted:
+        entry = manifest["shards"].get(block_id)
+        if entry is None:
+            continue
+        path = os.path.join(shard_dir, entry["file"])
+        sha256 = file_sha256(path) if verify else None
+        shard = schema.read_csv(path, table, **read_csv_kwargs) if table else pd.read_csv(path, **read_csv_kwargs)
+        if verify and sha256 != entry["sha256"]:
+            print(f"⚠ Shard {entry['file']} is newer than its manifest entry - manifest updated")
+            manifest["shards"][block_id] = {
+                **entry,
+                "rows": len(shard),
+                "sha256": sha256,
+                "updated": pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+            save_manifest(shard_dir, manifest)
+        yield block_id, shard
+
+def read_shards(shard_dir, block_ids=None, verify=False, table=None, **read_csv_kwargs):
+    """
+    Assemble the shards (all, or only the given block_ids) into one DataFrame
+    """
+    frames = [shard for _, shard in iter_shards(shard_dir, block_ids, verify, table, **read_csv_kwargs)]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    # Shards with different labels concatenate to plain objects - one set of categories for the whole frame
+    return schema.coerce(df, table) if table else df
+
+def total_rows(shard_dir):
+    return sum(entry["rows"] for entry in load_manifest(shard_dir)["shards"].values())
+
+def export_csv(shard_dir, output_path, verify=True):
+    """
+    Write the combined view of every shard to a single CSV (for scripts 3-5)
+    """
+    df = read_shards(shard_dir, verify=verify, dtype=str, low_memory=False)
+    atomic_write(output_path, lambda tmp_path: df.to_csv(tmp_path, index=False))
+    return len(df)
@@ -0,0 +1,254 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from features import STATES, CITIES
+
+# Synthetic AvalonBay-shaped inputs for benchmarks and local test runs, at any scale:
+#   sightmap/<block_id>.json              sightmap API response per property (script 1)
+#   community_units/<community_id>.json   community-units API response per property (script 2)
+#   property_urls.csv                     property list with 'Sitemap Url' and communityID
+#   complete_portfolio.csv                script 1 output, with the previous run's prices matched in
+#   currently_available.csv               script 2 output from the previous run
+#   missing_properties_predictions.csv    script 5 input
+# Today's availability (community-units payloads) overlaps the previous run's like a daily scrape.
+
+# Property count by state in property_urls.csv
+STATE_WEIGHTS = {
+    'california': 91, 'massachusetts': 34, 'new_jersey': 25, 'new_york': 23, 'washington': 18,
+    'maryland': 16, 'virginia': 16, 'texas': 15, 'colorado': 11, 'florida': 11,
+    'north_carolina': 10, 'district_of_columbia': 6
+}
+
+SIGHTMAP_BASE = "https://sightmap.com/app/api/v1/synthetic/sightmaps"
+COMMUNITY_UNITS_BASE = "https://www.avaloncommunities.com/pf/api/v3/content/fetch/community-units"
+
+AVAILABLE_SHARE = 0.08      # share of units with a listed price today
+CARRYOVER_SHARE = 0.8       # share of the previous run's available units still listed today
+MISSING_SHARE = 0.2         # properties in missing_properties_predictions.csv, relative to the portfolio
+
+def display_name(name):
+    return name.replace('_', ' ').title() if name in STATES else name.replace('_', ' ')
+
+def community_units_url(community_id):
+    query = ('%7B%22arcSite%22%3A%22avalon-communities%22%2C%22communityId%22%3A%22'
+             f'{community_id}%22%2C%22sortBy%22%3A%22LowestPrice%22%7D')
+    return f"{COMMUNITY_UNITS_BASE}?query={query}&_website=avalon-communities"
+
+def generate_portfolio(n_units=76_000, n_properties=273, seed=0):
+    """
+    Properties and units of a synthetic portfolio
+    Returns: (properties DataFrame, units DataFrame)
+    """
+    rng = np.random.default_rng(seed)
+    states = np.array(list(STATE_WEIGHTS))
+    weights = np.array(list(STATE_WEIGHTS.values()), dtype=float)
+
+    properties = pd.DataFrame({
+        'state': [display_name(state) for state in rng.choice(states, n_properties, p=weights / weights.sum())],
+        'city': [display_name(city) for city in rng.choice(CITIES, n_properties)],
+        'sightmap_id': np.arange(60000, 60000 + n_properties).astype(str),
+        'community_id': [f"AVB-P{i:05d}" for i in range(n_properties)],
+        'floors': rng.integers(3, 25, n_properties),
+        'ground_label': rng.random(n_properties) < 0.2,
+        'long_unit_names': rng.random(n_properties) < 0.5,
+        'rent_level': rng.uniform(1800, 4200, n_properties)
+    })
+    properties['name'] = [f"Avalon {city} {i}" for i, city in enumerate(properties['city'])]
+    # Every property has at least one unit; the rest are spread unevenly
+    properties['unit_count'] = rng.multinomial(n_units - n_properties, rng.dirichlet(np.ones(n_properties) * 2)) + 1
+
+    prop = np.repeat(np.arange(n_properties), properties['unit_count'])
+    plan = rng.integers(0, 12, n_units)
+    plan_key = prop * 12 + plan
+    # Floor plans: bed/bath/sqft fixed per (property, plan)
+    plan_rng = np.random.default_rng(seed + 1)
+    plan_bed = plan_rng.integers(0, 4, n_properties * 12)
+    plan_bath = np.maximum(1, plan_bed - plan_rng.integers(0, 2, n_properties * 12))
+    plan_sqft = 450 + plan_bed * 350 + plan_rng.integers(-60, 120, n_properties * 12)
+    floor = np.floor(rng.random(n_units) * properties['floors'].to_numpy()[prop]).astype(int) + 1
+    position = np.arange(n_units) - np.repeat(np.cumsum(properties['unit_count']) - properties['unit_count'], properties['unit_count'])
+
+    units = pd.DataFrame({
+        'prop': prop,
+        'apt_id': np.arange(n_units) + 1_000_000,
+        'unit_number': [f"{f:02d}-{p:04d}" for f, p in zip(floor, position)],
+        'floor_plan_id': plan_key + 500_000,
+        'bed_count': plan_bed[plan_key],
+        'bath_count': plan_bath[plan_key],
+        'sqft': plan_sqft[plan_key],
+        'floor_number': floor,
+        'price': np.round(properties['rent_level'].to_numpy()[prop] + plan_bed[plan_key] * 450
+                          + plan_sqft[plan_key] * 0.9 + floor * 12 + rng.normal(0, 120, n_units))
+    })
+    units['floor'] = np.where((floor == 1) & properties['ground_label'].to_numpy()[prop], 'GR', floor.astype(str))
+    units['available_before'] = rng.random(n_units) < AVAILABLE_SHARE
+    units['available_now'] = np.where(units['available_before'], rng.random(n_units) < CARRYOVER_SHARE,
+                                      rng.random(n_units) < AVAILABLE_SHARE * (1 - CARRYOVER_SHARE))
+    return properties, units
+
+def sightmap_payload(prop, units):
+    """
+    Sightmap API response for one property (units = that property's rows)
+    """
+    floor_labels = ['GR' if n == 1 and prop['ground_label'] else str(n) for n in range(1, prop['floors'] + 1)]
+    plans = units.drop_duplicates('floor_plan_id')
+    unit_records = [
+        {
+            'id': str(apt_id),
+            'display_unit_number': f"APT {unit_number}",
+            'unit_number': unit_number,
+            'floor_plan_id': str(plan_id),
+            'floor_id': f"{prop['sightmap_id']}-{floor_number}",
+            'area': int(sqft)
+        }
+        for apt_id, unit_number, plan_id, floor_number, sqft in zip(
+            units['apt_id'], units['unit_number'], units['floor_plan_id'], units['floor_number'], units['sqft'])
+    ]
+    # Non-residential spaces are listed too and skipped by the parser
+    unit_records.append({'id': f"{prop['sightmap_id']}-r", 'display_unit_number': 'RETAIL 1', 'unit_number': 'R1',
+                         'floor_plan_id': None, 'floor_id': None, 'area': 1500})
+    return {'data': {
+        'asset': {'name': prop['name']},
+        'floor_plans': [{'id': str(plan_id), 'bedroom_count': int(bed), 'bathroom_count': int(bath)}
+                        for plan_id, bed, bath in zip(plans['floor_plan_id'], plans['bed_count'], plans['bath_count'])],
+        'floors': [{'id': f"{prop['sightmap_id']}-{n}", 'filter_short_label': label} for n, label in enumerate(floor_labels, 1)],
+        'units': unit_records
+    }}
+
+def unit_name(prop, unit_number):
+    # Half the properties list units as AVB-XXXXX-<number> (matched by suffix in script 3)
+    return f"{prop['community_id']}-{unit_number}" if prop['long_unit_names'] else unit_number
+
+def community_units_payload(prop, units):
+    """
+    Community-units API response for one property: today's available units with prices
+    """
+    available = units[units['available_now']]
+    return {'units': [
+        {
+            'unitId': str(apt_id),
+            'unitName': unit_name(prop, unit_number),
+            'floorNumber': str(floor_number),
+            'bedroomNumber': int(bed),
+            'bathroomNumber': int(bath),
+            'squareFeet': int(sqft),
+            'floorPlanId': str(plan_id),
+            'url': f"https://www.avaloncommunities.com/units/{apt_id}",
+            'startingAtPricesUnfurnished': {'prices': {'price': int(price)}}
+        }
+        for apt_id, unit_number, floor_number, bed, bath, sqft, plan_id, price in zip(
+            available['apt_id'], available['unit_number'], available['floor_number'], available['bed_count'],
+            available['bath_count'], available['sqft'], available['floor_plan_id'], available['price'])
+    ]}
+
+def property_urls_frame(properties):
+    return pd.DataFrame({
+        'state': properties['state'],
+        'city': properties['city'],
+        'url': [f"https://www.avaloncommunities.com/{name.lower().replace(' ', '-')}" for name in properties['name']],
+        'Unnamed: 4': properties['name'],
+        'Sitemap Url': [f"{SIGHTMAP_BASE}/{sightmap_id}" for sightmap_id in properties['sightmap_id']],
+        'communityID': [community_units_url(community_id) for community_id in properties['community_id']]
+    })
+
+def portfolio_frame(properties, units, scraped='2025-10-01 00:00:00'):
+    """
+    complete_portfolio.csv after scripts 1 and 3: every unit, previous run's prices matched in
+    """
+    prop = properties.iloc[units['prop']].reset_index(drop=True)
+    priced = units['available_before'].to_numpy()
+    return pd.DataFrame({
+        'state': prop['state'],
+        'city': prop['city'],
+        'apt_complex': prop['name'],
+        'block_id': prop['sightmap_id'],
+        'apt_id': units['apt_id'],
+        'apt_name': 'APT ' + units['unit_number'],
+        'bed_count': units['bed_count'],
+        'bath_count': units['bath_count'],
+        'sqft': units['sqft'],
+        'floor': units['floor'],
+        'floor_plan_id': units['floor_plan_id'],
+        'unit_number': units['unit_number'],
+        'web_url': SIGHTMAP_BASE + '/' + prop['sightmap_id'],
+        'price': np.where(priced, units['price'], np.nan),
+        'adjusted_price': np.nan,
+        'date_scraped': scraped,
+        'scraped_date': np.where(priced, '2025-10-27 08:00:00', None)
+    })
+
+def available_frame(properties, units, seen='2025-10-27 08:00:00'):
+    """
+    currently_available.csv as script 2 left it after the previous run
+    """
+    available = units[units['available_before']].reset_index(drop=True)
+    prop = properties.iloc[available['prop']].reset_index(drop=True)
+    names = np.where(prop['long_unit_names'], prop['community_id'] + '-' + available['unit_number'], available['unit_number'])
+    return pd.DataFrame({
+        'state': prop['state'],
+        'city': prop['city'],
+        'apt_complex': prop['name'],
+        'block_id': prop['community_id'],
+        'apt_id': available['apt_id'],
+        'apt_name': names,
+        'bed_count': available['bed_count'],
+        'bath_count': available['bath_count'],
+        'sqft': available['sqft'],
+        'floor': available['floor_number'].astype(str),
+        'floor_plan_id': available['floor_plan_id'],
+        'unit_number': names,
+        'web_url': 'https://www.avaloncommunities.com/units/' + available['apt_id'].astype(str),
+        'price': available['price'].astype(int),
+        'adjusted_price': np.nan,
+        'first_seen': '2025-10-20 08:00:00',
+        'last_seen': seen,
+        'days_on_market': 7
+    })
+
+def missing_frame(n_properties, seed=0):
+    """
+    missing_properties_predictions.csv: properties without sightmap data, revenue still to estimate
+    """
+    rng = np.random.default_rng(seed + 2)
+    states = rng.choice(list(STATE_WEIGHTS), n_properties)
+    return pd.DataFrame({
+        'property': [f"Avalon Missing {i}" for i in range(n_properties)],
+        'state': [display_name(state) for state in states],
+        'city': [display_name(city) for city in rng.choice(CITIES, n_properties)],
+        'unit_count': rng.integers(80, 600, n_properties),
+        'avg_rent': np.nan,
+        'monthly_revenue': np.nan,
+        'annual_revenue': np.nan
+    })
+
+def write_json(path, payload):
+    with open(path, 'w') as f:
+        json.dump(payload, f)
+
+def write_inputs(out_dir, n_units=76_000, n_properties=273, seed=0):
+    """
+    Write the full synthetic input set to out_dir
+    Returns: dict of the written paths
+    """
+    properties, units = generate_portfolio(n_units, n_properties, seed)
+    paths = {
+        'sightmap_dir': os.path.join(out_dir, 'sightmap'),
+        'community_units_dir': os.path.join(out_dir, 'community_units'),
+        'property_urls': os.path.join(out_dir, 'property_urls.csv'),
+        'complete_portfolio': os.path.join(out_dir, 'complete_portfolio.csv'),
+        'currently_available': os.path.join(out_dir, 'currently_available.csv'),
+        'missing_predictions': os.path.join(out_dir, 'missing_properties_predictions.csv')
+    }
+    os.makedirs(paths['sightmap_dir'], exist_ok=True)
+    os.makedirs(paths['community_units_dir'], exist_ok=True)
+
+    for (_, prop), (_, prop_units) in zip(properties.iterrows(), units.groupby('prop', sort=True)):
+        write_json(os.path.join(paths['sightmap_dir'], f"{prop['sightmap_id']}.json"), sightmap_payload(prop, prop_units))
+        write_json(os.path.join(paths['community_units_dir'], f"{prop['community_id']}.json"), community_units_payload(prop, prop_units))
+
+    property_urls_frame(properties).to_csv(paths['property_urls'], index=False)
+    portfolio_frame(properties, units).to_csv(paths['complete_portfolio'], index=False)
+    available_frame(properties, units).to_csv(paths['currently_available'], index=False)
+    missing_frame(max(1, int(n_properties * MISSING_SHARE)), seed).to_csv(paths['missing_predictions'], index=False)
+    return paths
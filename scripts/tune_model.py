@@ -0,0 +1,204 @@
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import schema
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import KFold, GroupKFold
+from features import load_feature_cache, matrix_rows
+from model_registry import evaluate, training_data_hash
+from instrumentation import json_ready
+
+# Cross-validated hyperparameter search for the rent model
+# Every configuration in SEARCH_SPACE is scored with shuffled k-fold CV and with CV grouped by
+# property (block_id - every unit of a held-out property is unseen, like the script 5
+# estimates). The priced rows and the fold indices are written once to
+# tuning/<training data hash>/ next to the portfolio CSV, and worker processes memory-map
+# them. Each finished (configuration, CV mode, fold) is appended to results.jsonl, so an
+# interrupted search picks up where it stopped.
+
+# Remove # Below, and edit directory path
+#file_path = "/[file path directory]/complete_portfolio.csv"
+
+SEARCH_SPACE = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [None, 20, 40],
+    'max_features': [1.0, 'sqrt', 0.5],
+    'min_samples_leaf': [1, 2, 5]
+}
+CV_MODES = ['kfold', 'group']
+N_FOLDS = 5
+TRIAL_WORKERS = os.cpu_count()
+
+# Cheapest configuration (mean predict time) with a mean MAE at or below this is reported. None to skip
+TARGET_MAE = None
+
+METRICS = ['mae', 'r2', 'adj_r2', 'fit_seconds', 'predict_seconds']
+
+def search_configs(space=SEARCH_SPACE):
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+def trial_key(params, mode, fold):
+    return hashlib.sha256(json.dumps({'params': params, 'mode': mode, 'fold': fold}, sort_keys=True).encode()).hexdigest()[:16]
+
+def prepare_search(source_path, feature_cache, n_folds=N_FOLDS):
+    """
+    Write the priced rows (X, y, property groups) and the fold indices for every CV mode
+    to the search directory, unless they are already there for this training data
+    Returns: search directory
+    """
+    data_hash = training_data_hash(feature_cache)
+    search_dir = os.path.join(os.path.dirname(os.path.abspath(source_path)), 'tuning', data_hash[:16])
+    if os.path.exists(os.path.join(search_dir, 'folds.npz')):
+        return search_dir
+    os.makedirs(search_dir, exist_ok=True)
+
+    train_rows = ~np.isnan(feature_cache['price'])
+    X = matrix_rows(feature_cache, train_rows, False).astype(np.float32)
+    y = np.asarray(feature_cache['price'][train_rows])
+    groups = schema.read_csv(source_path, 'complete_portfolio', usecols=['block_id'])['block_id'].to_numpy()[train_rows]
+    np.save(os.path.join(search_dir, 'X.npy'), X)
+    np.save(os.path.join(search_dir, 'y.npy'), y)
+
+    splitters = {
+        'kfold': KFold(n_splits=n_folds, shuffle=True, random_state=1).split(X),
+        'group': GroupKFold(n_splits=n_folds).split(X, y, groups)
+    }
+    folds = {}
+    for mode, splits in splitters.items():
+        for fold, (train_idx, test_idx) in enumerate(splits):
+            folds[f'{mode}_{fold}_train'] = train_idx
+            folds[f'{mode}_{fold}_test'] = test_idx
+    # folds.npz is written last: it marks the search directory as complete
+    np.savez(os.path.join(search_dir, 'folds.npz'), **folds)
+    return search_dir
+
+def load_results(search_dir):
+    results = {}
+    path = os.path.join(search_dir, 'results.jsonl')
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                # A line cut off by an interrupted run is skipped and that trial reruns
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                results[result['key']] = result
+    return results
+
+_shared = {}
+
+def load_shared(search_dir):
+    """
+    Worker initializer: map the priced rows and folds once per process
+    """
+    _shared['X'] = np.load(os.path.join(search_dir, 'X.npy'), mmap_mode='r')
+    _shared['y'] = np.load(os.path.join(search_dir, 'y.npy'), mmap_mode='r')
+    _shared['folds'] = np.load(os.path.join(search_dir, 'folds.npz'))
+
+def run_trial(params, mode, fold):
+    """
+    Fit one configuration on one fold (single-threaded - the pool provides the parallelism)
+    """
+    X, y, folds = _shared['X'], _shared['y'], _shared['folds']
+    train_idx, test_idx = folds[f'{mode}_{fold}_train'], folds[f'{mode}_{fold}_test']
+
+    model = RandomForestRegressor(**params, random_state=1, n_jobs=1)
+    start = time.perf_counter()
+    model.fit(X[train_idx], y[train_idx])
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    metrics = evaluate(model, X[test_idx], y[test_idx], X.shape[1])
+    predict_seconds = time.perf_counter() - start
+
+    return {
+        'key': trial_key(params, mode, fold),
+        'params': params,
+        'mode': mode,
+        'fold': fold,
+        **metrics,
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds,
+        'n_test': len(test_idx)
+    }
+
+def run_search(search_dir, configs, modes=CV_MODES, n_folds=N_FOLDS, workers=TRIAL_WORKERS):
+    """
+    Run every (configuration, mode, fold) not already in results.jsonl
+    Returns: all results, keyed by trial
+    """
+    results = load_results(search_dir)
+    pending = [(params, mode, fold) for params in configs for mode in modes for fold in range(n_folds)
+               if trial_key(params, mode, fold) not in results]
+    print(f"{len(results)} trials cached, {len(pending)} to run")
+    if not pending:
+        return results
+
+    with open(os.path.join(search_dir, 'results.jsonl'), 'a') as log, \
+         ProcessPoolExecutor(max_workers=workers, initializer=load_shared, initargs=(search_dir,)) as executor:
+        futures = [executor.submit(run_trial, *trial) for trial in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            results[result['key']] = result
+            log.write(json.dumps(json_ready(result), allow_nan=False) + '\n')
+            log.flush()
+            if done % 10 == 0 or done == len(pending):
+                print(f"  {done}/{len(pending)} trials")
+    return results
+
+def summarize(results, configs, modes=CV_MODES, n_folds=N_FOLDS):
+    """
+    Mean and std of each metric per (mode, configuration) over its folds
+    """
+    rows = []
+    for mode in modes:
+        for params in configs:
+            folds = [results[trial_key(params, mode, fold)] for fold in range(n_folds)]
+            row = {'mode': mode, **{name: str(value) for name, value in params.items()}}
+            for metric in METRICS:
+                values = np.array([fold[metric] for fold in folds], dtype=float)     # null (NaN) in results.jsonl -> NaN
+                row[metric] = values.mean()
+                row[f'{metric}_std'] = values.std()
+            rows.append(row)
+    return pd.DataFrame(rows).sort_values(['mode', 'mae'])
+
+def main():
+    print("Loading data...")
+    feature_cache = load_feature_cache(file_path)
+    search_dir = prepare_search(file_path, feature_cache)
+    configs = search_configs()
+    print(f"{len(configs)} configurations x {len(CV_MODES)} CV modes x {N_FOLDS} folds -> {search_dir}\n")
+
+    results = run_search(search_dir, configs)
+    report = summarize(results, configs)
+    report_path = os.path.join(search_dir, 'report.csv')
+    report.to_csv(report_path, index=False)
+
+    for mode in CV_MODES:
+        mode_report = report[report['mode'] == mode]
+        print(f"\n{mode} CV (best 5 by MAE):")
+        for _, row in mode_report.head(5).iterrows():
+            params = ', '.join(f"{name}={row[name]}" for name in SEARCH_SPACE)
+            print(f"  {params}: MAE ${row['mae']:.2f} ± {row['mae_std']:.2f}, R² {row['r2']:.4f}, "
+                  f"adj R² {row['adj_r2']:.4f}, fit {row['fit_seconds']:.2f}s, predict {row['predict_seconds']:.3f}s")
+
+        if TARGET_MAE is not None:
+            meets = mode_report[mode_report['mae'] <= TARGET_MAE]
+            if len(meets) > 0:
+                cheapest = meets.sort_values('predict_seconds').iloc[0]
+                params = ', '.join(f"{name}={cheapest[name]}" for name in SEARCH_SPACE)
+                print(f"✓ Cheapest under ${TARGET_MAE:.2f} MAE: {params} (predict {cheapest['predict_seconds']:.3f}s)")
+            else:
+                print(f"✗ No configuration reaches ${TARGET_MAE:.2f} MAE")
+
+    print(f"\nReport saved to: {report_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import pandas as pd
+import schema
+
+# Embedded store for the two scraped tables - one SQLite file (OUTPUT_MODE = "store" in scripts 1-3)
+#   portfolio  script 1's units, unique on (apt_id, apt_complex, block_id)
+#   available  script 2's priced units, unique on (apt_complex, apt_name, apt_id)
+# Values are stored as TEXT, in the form schema.to_csv writes them, and empty strings as NULL, as they
+# come back from a CSV round trip. NULLs never match each other in a UNIQUE index, so the key is indexed
+# as coalesce(column, '') - a unit with an empty key column is still one row. A run writes its rows with
+# batched INSERT ... ON CONFLICT upserts in one transaction, so it touches only the rows it inserts or
+# updates and a crash leaves the last committed state. The WAL journal lets readers (script 3, export_csv,
+# ad-hoc queries) keep reading that state while a scraper writes. export_csv() writes a table in the CSV
+# layout scripts 3-5 read.
+
+STORE_BATCH_SIZE = 5000        # rows per executemany call
+BUSY_TIMEOUT = 30              # seconds a writer waits for another writer's lock
+
+TABLES = {
+    'portfolio': {
+        'columns': ['state', 'city', 'apt_complex', 'block_id', 'apt_id', 'apt_name', 'bed_count', 'bath_count',
+                    'sqft', 'floor', 'floor_plan_id', 'unit_number', 'web_url', 'price', 'adjusted_price',
+                    'date_scraped', 'scraped_date'],
+        'key': ['apt_id', 'apt_complex', 'block_id'],
+        'schema': 'complete_portfolio',
+        # Script 1 never overwrites a known unit: conflicting rows are skipped
+        'on_conflict': {},
+        # Script 3 looks units up by property
+        'indexes': {'portfolio_property': ['city', 'apt_complex']}
+    },
+    'available': {
+        'columns': ['state', 'city', 'apt_complex', 'block_id', 'apt_id', 'apt_name', 'bed_count', 'bath_count',
+                    'sqft', 'floor', 'floor_plan_id', 'unit_number', 'web_url', 'price', 'adjusted_price',
+                    'first_seen', 'last_seen', 'days_on_market'],
+        'key': ['apt_complex', 'apt_name', 'apt_id'],
+        'schema': 'currently_available',
+        # A known unit takes the scraped price and last_seen; first_seen is never touched
+        'on_conflict': {
+            'price': 'excluded.price',
+            'last_seen': 'excluded.last_seen',
+            'days_on_market': "(strftime('%s', excluded.last_seen) - strftime('%s', first_seen)) / 86400"
+        },
+        'indexes': {}
+    }
+}
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def key_columns(table):
+    """
+    The unique key index's columns, with NULL indexed as '' (also the ON CONFLICT target)
+    """
+    return [f"coalesce({quote(col)}, '')" for col in TABLES[table]['key']]
+
+def connect(store_path):
+    """
+    Open (creating if needed) the store in WAL mode with both tables and their indexes
+    """
+    directory = os.path.dirname(os.path.abspath(store_path))
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(store_path, timeout=BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL: a commit is durable once the WAL is synced at checkpoint - no fsync per transaction
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with conn:
+        for table, spec in TABLES.items():
+            columns = ', '.join(f"{quote(col)} TEXT" for col in spec['columns'])
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_key ON {table} ({', '.join(key_columns(table))})")
+            for name, index_columns in spec['indexes'].items():
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(map(quote, index_columns))})")
+    return conn
+
+def row_values(df, columns):
+    """
+    Rows of df as tuples of text (as schema.to_csv writes it) in column order - missing columns, NaN and
+    empty strings become NULL
+    """
+    values = schema.as_text(df.reindex(columns=columns))
+    values = values.where(values.notna() & (values != ''), None)
+    return values.itertuples(index=False, name=None)
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+def upsert(conn, table, df, batch_size=STORE_BATCH_SIZE):
+    """
+    Insert df's rows into table in one transaction; rows whose key already exists get the table's
+    on_conflict updates (or are skipped). Within df, a repeated key resolves like a second scrape
+    Returns: (rows inserted, rows that matched an existing key)
+    """
+    spec = TABLES[table]
+    columns = spec['columns']
+    placeholders = ', '.join('?' for _ in columns)
+    sql = f"INSERT INTO {table} ({', '.join(map(quote, columns))}) VALUES ({placeholders}) " \
+          f"ON CONFLICT ({', '.join(key_columns(table))}) DO "
+    if spec['on_conflict']:
+        sql += "UPDATE SET " + ', '.join(f"{quote(col)} = {expr}" for col, expr in spec['on_conflict'].items())
+    else:
+        sql += "NOTHING"
+
+    rows = row_values(df, columns)
+    with conn:
+        before = count(conn, table)
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            conn.executemany(sql, batch)
+        inserted = count(conn, table) - before
+    return inserted, len(df) - inserted
+
+def read_table(conn, table, where=None, params=(), chunksize=None):
+    """
+    Rows of table in insertion order (all columns as strings, NULL as NaN), optionally filtered by a WHERE clause
+    """
+    columns = ', '.join(map(quote, TABLES[table]['columns']))
+    sql = f"SELECT {columns} FROM {table}" + (f" WHERE {where}" if where else "") + " ORDER BY rowid"
+    return pd.read_sql_query(sql, conn, params=params, chunksize=chunksize)
+
+def read_properties(conn, table, properties):
+    """
+    Rows of table whose (city, apt_complex) is one of properties, through the property index
+    """
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_properties (city TEXT, apt_complex TEXT)")
+        conn.execute("DELETE FROM wanted_properties")
+        conn.executemany("INSERT INTO wanted_properties VALUES (?, ?)", properties)
+    columns = ', '.join(f"t.{quote(col)}" for col in TABLES[table]['columns'])
+    sql = f"SELECT {columns} FROM {table} t JOIN wanted_properties w " \
+          f"ON t.city IS w.city AND t.apt_complex IS w.apt_complex ORDER BY t.rowid"
+    return pd.read_sql_query(sql, conn)
+
+def update_rows(conn, table, df, columns, batch_size=STORE_BATCH_SIZE):
+    """
+    Write df's values of columns to the rows with the same key (through the unique key index), in one transaction
+    Returns: number of rows updated
+    """
+    key = TABLES[table]['key']
+    match_key = ' AND '.join(f"{column} = coalesce(?, '')" for column in key_columns(table))
+    sql = f"UPDATE {table} SET {', '.join(f'{quote(col)} = ?' for col in columns)} WHERE {match_key}"
+    rows = row_values(df, columns + key)
+    updated = 0
+    with conn:
+        while True:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            if not batch:
+                break
+            updated += conn.executemany(sql, batch).rowcount
+    return updated
+
+def distinct_properties(conn, table):
+    """
+    Every (city, apt_complex) pair in table
+    """
+    return conn.execute(f"SELECT DISTINCT city, apt_complex FROM {table}").fetchall()
+
+def export_csv(store_path, table, output_path, chunksize=100_000):
+    """
+    Write a table to a single CSV (for scripts 3-5) through its schema, chunk by chunk
+    Returns: number of rows written
+    """
+    conn = connect(store_path)
+    tmp_path = f"{output_path}.tmp"
+    rows = 0
+    try:
+        pd.DataFrame(columns=TABLES[table]['columns']).to_csv(tmp_path, index=False)
+        for chunk in read_table(conn, table, chunksize=chunksize):
+            schema.to_csv(chunk, TABLES[table]['schema'], tmp_path, mode='a', header=False)
+            rows += len(chunk)
+    finally:
+        conn.close()
+    os.replace(tmp_path, output_path)
+    return rows
+
+def import_csv(store_path, table, csv_path):
+    """
+    Load an existing complete_portfolio.csv / currently_available.csv into the store (columns outside the
+    table are dropped; an old currently_available.csv's date_scraped becomes first_seen/last_seen)
+    Returns: (rows inserted, rows that matched an existing key)
+    """
+    df = pd.read_csv(csv_path, dtype=str, low_memory=False).dropna(how='all')
+    if table == 'available' and 'date_scraped' in df.columns and 'first_seen' not in df.columns:
+        df = df.rename(columns={'date_scraped': 'first_seen'})
+        df['last_seen'] = df['first_seen']
+    conn = connect(store_path)
+    try:
+        return upsert(conn, table, df)
+    finally:
+        conn.close()
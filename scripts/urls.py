@@ -0,0 +1,15 @@
+from urllib.parse import urlsplit
+
+# URL helpers shared by the scrapers (scripts 1 and 2) and replay_server.py: BASE_URL_OVERRIDE
+# in the scrapers sends every request to another host (e.g. the local replay server) with the
+# same path and query.
+
+def rebase_url(url, base_url):
+    """
+    Swap the scheme and host of url for base_url's (path and query kept)
+    Returns: url unchanged when base_url is None
+    """
+    if not base_url:
+        return url
+    parts = urlsplit(url)
+    return base_url.rstrip('/') + parts.path + (f"?{parts.query}" if parts.query else '')